@@ -9,4 +9,5 @@ admin.site.register(models.Category)
 admin.site.register(models.Quiz)
 admin.site.register(models.Rating)
 admin.site.register(models.QuizQuestion)
-admin.site.register(models.QuizAnswer)
\ No newline at end of file
+admin.site.register(models.QuizAnswer)
+admin.site.register(models.QuizJob)
\ No newline at end of file
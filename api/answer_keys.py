@@ -0,0 +1,42 @@
+from django.core import signing
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from . import models
+
+SALT = "api.answer_keys"
+
+
+# token jest tylko podpisany, nie zaszyfrowany, więc zamiast liter przechowujemy
+# skróty HMAC, których klient nie jest w stanie sprawdzić bez SECRET_KEY
+def answer_tag(quiz_id, question_id, letter):
+    return salted_hmac(SALT, f"{quiz_id}:{question_id}:{letter}").hexdigest()[:8]
+
+
+def make_answer_key(quiz_id, author_id, correct_answers):
+    keys = [[question_id, answer_tag(quiz_id, question_id, letter)] for question_id, letter in correct_answers]
+    return signing.dumps({"quiz": quiz_id, "author": author_id, "keys": keys}, salt=SALT, compress=True)
+
+
+def load_answer_key(token):
+    try:
+        answer_key = signing.loads(token, salt=SALT)
+    except signing.BadSignature:
+        return None
+    return answer_key.get("quiz"), answer_key.get("author"), [tuple(key) for key in answer_key.get("keys")]
+
+
+def check_quiz_with_answer_key(user, token, answers):
+    answer_key = load_answer_key(token)
+    # klucz wydany innemu użytkownikowi nie może zmienić cudzego wyniku
+    if answer_key is None or answer_key[1] != user.id:
+        return {"error": "Nieprawidłowy klucz odpowiedzi."}
+    quiz_id, _, correct_answers = answer_key
+    answers_dict = {question_id: answer_tag(quiz_id, question_id, letter)
+                    for question_id, letter in answers.items()}
+    raport = models.grade_quiz(correct_answers, answers_dict)
+    if raport.get("error") is None:
+        models.Quiz.objects.for_author(user.id).filter(id=quiz_id, author=user).update(
+            score=raport["final_score"], is_finished=True, timestamp=timezone.now()
+        )
+    return raport
@@ -0,0 +1,228 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.core.signals import request_finished
+from django.db import connections, transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import metrics
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# powyżej tylu zdarzeń bufor jest zapisywany od razu, nawet w trakcie żądania
+HARD_LIMIT_FACTOR = 10
+
+
+class LogBuffer:
+    # zdarzenia Log czekają w pamięci procesu i są zapisywane jednym bulk_create po zakończeniu
+    # żądania, gdy bufor osiągnie max_size albo najstarsze zdarzenie jest starsze niż flush_interval;
+    # z timer=True wątek w tle zapisuje też zdarzenia, po których nie przyszło już żadne żądanie
+
+    def __init__(self, max_size, flush_interval, timer=False):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.timer = timer
+        self.events = []
+        self.oldest = None
+        self.flushed = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._timer = None
+        self._stopped = threading.Event()
+
+    def add(self, user_id, action, count=1):
+        now = timezone.now()
+        if self.timer and self._timer is None:
+            self.start_timer()
+        with self._lock:
+            if not self.events:
+                self.oldest = time.monotonic()
+            self.events += [models.Log(user_id=user_id, action=action, timestamp=now) for _ in range(count)]
+            overflow = len(self.events) >= self.max_size * HARD_LIMIT_FACTOR
+        if overflow:
+            self.try_flush()
+
+    def add_on_commit(self, user_id, action, count=1, using=None):
+        # zdarzenie zapisu trafia do bufora dopiero po zatwierdzeniu, więc wycofany zapis nie zostawia śladu
+        transaction.on_commit(lambda: self.add(user_id, action, count), using=using)
+
+    def is_due(self):
+        with self._lock:
+            if not self.events:
+                return False
+            return len(self.events) >= self.max_size or time.monotonic() - self.oldest >= self.flush_interval
+
+    def flush(self):
+        with self._lock:
+            events, self.events = self.events, []
+            oldest = self.oldest
+        if not events:
+            return 0
+        try:
+            # użytkownik mógł zostać usunięty, zanim jego zdarzenia trafiły do bazy
+            user_ids = set(models.User.objects.filter(
+                id__in={event.user_id for event in events}
+            ).values_list("id", flat=True))
+            kept = [event for event in events if event.user_id in user_ids]
+            models.Log.objects.bulk_create(kept, batch_size=self.max_size)
+        except Exception:
+            self._restore(events, oldest)
+            raise
+        with self._lock:
+            self.flushed += len(kept)
+            self.dropped += len(events) - len(kept)
+        return len(kept)
+
+    def _restore(self, events, oldest):
+        # nieudany zapis (np. zablokowana baza SQLite) wraca na początek bufora; ponad twardy limit
+        # najstarsze zdarzenia są odrzucane, żeby bufor nie rósł bez końca przy dłuższej awarii
+        with self._lock:
+            events = events + self.events
+            dropped = max(len(events) - self.max_size * HARD_LIMIT_FACTOR, 0)
+            self.events = events[dropped:]
+            self.oldest = oldest
+            self.dropped += dropped
+        if dropped:
+            logger.error("Dropped %s buffered log events after a failed flush", dropped)
+
+    def try_flush(self):
+        try:
+            return self.flush()
+        except Exception:
+            logger.exception("Flushing buffered log events failed")
+            return 0
+
+    def discard(self):
+        with self._lock:
+            self.events = []
+
+    def start_timer(self):
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._stopped.clear()
+            self._timer = threading.Thread(target=self._flush_periodically, name="log-flush", daemon=True)
+            self._timer.start()
+
+    def stop_timer(self):
+        self._stopped.set()
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.join()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                if self.is_due():
+                    self.try_flush()
+            finally:
+                # połączenia są osobne dla każdego wątku, więc nie czekają otwarte do następnego zapisu
+                connections.close_all()
+
+
+log_buffer = LogBuffer(getattr(settings, "LOG_BUFFER_SIZE", 500), getattr(settings, "LOG_FLUSH_INTERVAL", 5),
+                       timer=getattr(settings, "LOG_FLUSH_TIMER", True))
+atexit.register(log_buffer.try_flush)
+
+
+@receiver(request_finished)
+def flush_due_events(sender, **kwargs):
+    # błąd zapisu nie może przerwać zamykania odpowiedzi
+    if log_buffer.is_due():
+        log_buffer.try_flush()
+
+
+@receiver(user_logged_in)
+def log_login(sender, request=None, user=None, **kwargs):
+    log_buffer.add(user.id, "A1")
+
+
+@receiver(user_logged_out)
+def log_logout(sender, request=None, user=None, **kwargs):
+    if user is not None:
+        log_buffer.add(user.id, "A2")
+
+
+@receiver(post_save, sender=models.Flashcard)
+def log_created_flashcard(sender, instance=None, created=False, using=None, **kwargs):
+    if created:
+        log_buffer.add_on_commit(instance.author_id, "B1", using=using)
+
+
+@receiver(post_save, sender=models.FlashcardsSet)
+def log_created_set(sender, instance=None, created=False, using=None, **kwargs):
+    if created:
+        log_buffer.add_on_commit(instance.author_id, "B2", using=using)
+
+
+def add_daily_counts(counts):
+    counts = {(row["user"], row["day"], row["action"]): row["count"] for row in counts}
+    existing = models.DailyActivity.objects.filter(
+        user_id__in={user_id for user_id, _, _ in counts}, day__in={day for _, day, _ in counts}
+    ).values_list("user_id", "day", "action", "count")
+    for user_id, day, action, count in existing.iterator():
+        if (user_id, day, action) in counts:
+            counts[user_id, day, action] += count
+    # jeden INSERT ... ON CONFLICT zamiast bulk_update, który buduje CASE dla każdego wiersza
+    models.DailyActivity.objects.bulk_create([
+        models.DailyActivity(user_id=user_id, day=day, action=action, count=count)
+        for (user_id, day, action), count in counts.items()
+    ], batch_size=1000, update_conflicts=True, unique_fields=["user", "day", "action"], update_fields=["count"])
+
+
+def roll_up_logs(batch_size):
+    # wiersze Log są wliczane dokładnie raz, w kolejności id, po batch_size w jednej transakcji
+    rolled_up = 0
+    while True:
+        with transaction.atomic():
+            rollup = models.LogRollup.objects.select_for_update().get_or_create(id=1)[0]
+            pending = models.Log.objects.filter(id__gt=rollup.last_log_id).order_by("id").values_list("id", flat=True)
+            last_id = pending[batch_size - 1:batch_size].first()
+            if last_id is None:
+                last_id = models.Log.objects.aggregate(last_id=Max("id"))["last_id"]
+            if last_id is None or last_id <= rollup.last_log_id:
+                return rolled_up
+            counts = models.Log.objects.filter(id__gt=rollup.last_log_id, id__lte=last_id).order_by().annotate(
+                day=TruncDate("timestamp")
+            ).values("user", "day", "action").annotate(count=Count("id"))
+            counts = list(counts)
+            add_daily_counts(counts)
+            rolled_up += sum(row["count"] for row in counts)
+            rollup.last_log_id = last_id
+            rollup.save(update_fields=["last_log_id"])
+
+
+def delete_old_logs(before, batch_size):
+    # usuwane są tylko wiersze już wliczone do DailyActivity, każda porcja w osobnej transakcji
+    last_log_id = models.LogRollup.objects.values_list("last_log_id", flat=True).first() or 0
+    old_logs = models.Log.objects.filter(timestamp__lt=before, id__lte=last_log_id)
+    deleted = 0
+    while True:
+        ids = list(old_logs.values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += models.Log.objects.filter(id__in=ids).delete()[0]
+
+
+def collect_log_buffer_metrics():
+    with log_buffer._lock:
+        pending, flushed, dropped = len(log_buffer.events), log_buffer.flushed, log_buffer.dropped
+    return [
+        ("flashwise_log_buffer_pending", "gauge", "Log events waiting in the buffer.", [({}, pending)]),
+        ("flashwise_log_buffer_flushed_total", "counter", "Log events written to the database.", [({}, flushed)]),
+        ("flashwise_log_buffer_dropped_total", "counter",
+         "Log events of deleted users or dropped after failed flushes.", [({}, dropped)]),
+    ]
+
+
+metrics.registry.register(collect_log_buffer_metrics)
@@ -0,0 +1,97 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from . import metrics
+from . import models
+
+
+class TokenCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [key for key, (_, (user, _)) in self._entries.items() if user.id == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+token_cache = TokenCache(
+    max_size=getattr(settings, "TOKEN_CACHE_SIZE", 1024),
+    ttl=getattr(settings, "TOKEN_CACHE_TTL", 60),
+)
+
+
+def collect_token_cache_metrics():
+    return [
+        ("flashwise_token_cache_hits_total", "counter", "Token authentication cache hits.",
+         [({}, token_cache.hits)]),
+        ("flashwise_token_cache_misses_total", "counter", "Token authentication cache misses.",
+         [({}, token_cache.misses)]),
+    ]
+
+
+metrics.registry.register(collect_token_cache_metrics)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            cached = super(CachedTokenAuthentication, self).authenticate_credentials(key)
+            token_cache.set(key, cached)
+        user, token = cached
+        # każde żądanie dostaje własną kopię, żeby zmiany w request.user nie przeciekały do innych
+        return copy.copy(user), token
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance=None, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=models.User)
+def invalidate_saved_user(sender, instance=None, created=False, **kwargs):
+    if not created:
+        token_cache.invalidate_user(instance.id)
@@ -0,0 +1,116 @@
+import hashlib
+import threading
+import uuid
+
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from . import metrics
+from . import replicas
+
+ALL_SETS = "all"
+
+
+def author_scope(author_id):
+    return f"author:{author_id}"
+
+
+def category_scope(category_id):
+    return f"category:{category_id}"
+
+
+class CatalogueCache:
+    # odpowiedzi publicznego katalogu zestawów; klucz odpowiedzi zawiera aktualne tokeny jej zakresów
+    # (autora, kategorii albo całego katalogu), więc zmiana tokenu unieważnia wszystkie odpowiedzi zakresu
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.hits = {}
+        self.misses = {}
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def tokens(self, scopes):
+        keys = [f"scope:{scope}" for scope in sorted(scopes)]
+        tokens = self.cache.get_many(keys)
+        for key in keys:
+            if key not in tokens:
+                self.cache.add(key, uuid.uuid4().hex, timeout=None)
+                tokens[key] = self.cache.get(key)
+        return [tokens[key] for key in keys]
+
+    def response_key(self, endpoint, request, scopes):
+        # tokeny odczytujemy przed zapytaniem, więc odpowiedź nigdy nie trafi pod nowszy token niż jej dane
+        params = sorted(request.query_params.lists())
+        parts = [endpoint, request.get_host(), params, self.tokens(scopes)]
+        return "response:" + hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def get_or_set(self, endpoint, request, scopes, compute):
+        key = self.response_key(endpoint, request, scopes)
+        data = self.cache.get(key)
+        with self._lock:
+            counters = self.misses if data is None else self.hits
+            counters[endpoint] = counters.get(endpoint, 0) + 1
+        if data is None:
+            # odpowiedź z opóźnionej repliki trafiłaby pod świeży token, więc liczymy ją na bazie głównej
+            with replicas.primary():
+                data = compute()
+            self.cache.set(key, data)
+        return data
+
+    def invalidate(self, author_ids, category_ids):
+        scopes = [ALL_SETS] + [author_scope(author_id) for author_id in author_ids]
+        scopes += [category_scope(category_id) for category_id in category_ids]
+
+        def rotate():
+            self.cache.set_many({f"scope:{scope}": uuid.uuid4().hex for scope in scopes}, timeout=None)
+
+        # od razu dla bieżącego połączenia i jeszcze raz po commicie, żeby inne żądania nie zdążyły
+        # zapisać odpowiedzi z danymi sprzed zmiany pod nowym tokenem
+        rotate()
+        transaction.on_commit(rotate)
+        with self._lock:
+            self.invalidations += 1
+
+    def clear(self):
+        self.cache.clear()
+
+
+catalogue_cache = CatalogueCache("catalogue")
+
+
+def collect_catalogue_cache_metrics():
+    with catalogue_cache._lock:
+        endpoints = sorted(set(catalogue_cache.hits) | set(catalogue_cache.misses))
+        hits = [({"endpoint": endpoint}, catalogue_cache.hits.get(endpoint, 0)) for endpoint in endpoints]
+        misses = [({"endpoint": endpoint}, catalogue_cache.misses.get(endpoint, 0)) for endpoint in endpoints]
+        invalidations = catalogue_cache.invalidations
+    return [
+        ("flashwise_catalogue_cache_hits_total", "counter", "Public catalogue response cache hits.", hits),
+        ("flashwise_catalogue_cache_misses_total", "counter", "Public catalogue response cache misses.", misses),
+        ("flashwise_catalogue_cache_invalidations_total", "counter",
+         "Public set changes that invalidated the catalogue cache.", [({}, invalidations)]),
+    ]
+
+
+metrics.registry.register(collect_catalogue_cache_metrics)
+
+
+class CatalogueCacheMixin:
+    def get_catalogue_scopes(self):
+        # zakresy publicznej listy albo None, jeśli odpowiedź zależy od użytkownika
+        return None
+
+    def list(self, request, *args, **kwargs):
+        scopes = self.get_catalogue_scopes()
+        if scopes is None:
+            return super(CatalogueCacheMixin, self).list(request, *args, **kwargs)
+        data = catalogue_cache.get_or_set(
+            "list", request, scopes, lambda: super(CatalogueCacheMixin, self).list(request, *args, **kwargs).data
+        )
+        return Response(data)
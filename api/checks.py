@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core import checks
+
+LOCAL_CACHE_BACKENDS = ("django.core.cache.backends.locmem.LocMemCache",)
+
+
+@checks.register(checks.Tags.caches, checks.Tags.database)
+def check_replica_pin_cache(app_configs, **kwargs):
+    # przypięcie do bazy głównej po zapisie działa tylko wtedy, gdy widzą je wszystkie procesy serwera
+    if not getattr(settings, "DATABASE_REPLICAS", []):
+        return []
+    backend = settings.CACHES.get("replica_pins", {}).get("BACKEND")
+    if backend is None or backend in LOCAL_CACHE_BACKENDS:
+        return [checks.Error(
+            "DATABASE_REPLICAS requires the 'replica_pins' cache to use a backend shared by all server processes.",
+            hint="Configure CACHES['replica_pins'] with e.g. FileBasedCache, Redis or Memcached.",
+            id="api.E001",
+        )]
+    return []
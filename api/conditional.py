@@ -0,0 +1,33 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+
+def listing_etag(request, versions):
+    # adres zawiera filtry i kursor strony, a format zależy od negocjacji treści
+    parts = [request.build_absolute_uri(), request.accepted_renderer.format, request.user.pk]
+    parts += [":".join(str(value) for value in version) for version in versions]
+    return quote_etag(hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest())
+
+
+class ConditionalListMixin:
+    def get_list_versions(self):
+        # krotki zakończone czasem modyfikacji albo None, jeśli lista nie ma wersji
+        return None
+
+    def list(self, request, *args, **kwargs):
+        # wersje czytamy przed zapytaniem o listę, więc ETag nigdy nie jest nowszy od treści
+        versions = self.get_list_versions()
+        if versions is None:
+            return super(ConditionalListMixin, self).list(request, *args, **kwargs)
+        etag = listing_etag(request, versions)
+        modified = [version[-1] for version in versions if version[-1] is not None]
+        last_modified = int(max(modified).timestamp()) if modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super(ConditionalListMixin, self).list(request, *args, **kwargs)
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        return response
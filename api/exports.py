@@ -0,0 +1,29 @@
+import csv
+import json
+
+from . import models
+
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def flashcard_rows(flashcard_set):
+    flashcards = models.Flashcard.objects.using(flashcard_set._state.db).filter(flashcard_set=flashcard_set)
+    flashcards = flashcards.order_by("id")
+    return flashcards.values_list("front", "back").iterator(chunk_size=CHUNK_SIZE)
+
+
+def export_csv(flashcard_set):
+    writer = csv.writer(Echo())
+    yield writer.writerow(["front", "back"])
+    for front, back in flashcard_rows(flashcard_set):
+        yield writer.writerow([front, back])
+
+
+def export_jsonl(flashcard_set):
+    for front, back in flashcard_rows(flashcard_set):
+        yield json.dumps({"front": front, "back": back}, ensure_ascii=False) + "\n"
@@ -0,0 +1,109 @@
+import csv
+import json
+
+from django.db import transaction
+
+from . import audit
+from . import models
+from . import search
+from . import shards
+
+BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 100
+
+CSV_CONTENT_TYPES = ("text/csv",)
+JSONL_CONTENT_TYPES = ("application/jsonl", "application/x-ndjson", "application/x-jsonlines")
+
+
+def decode_lines(lines):
+    # Excel domyślnie zapisuje plik z BOM, który inaczej stałby się częścią pierwszego nagłówka
+    for index, line in enumerate(lines):
+        yield line.decode("utf-8-sig" if index == 0 else "utf-8")
+
+
+def parse_csv(lines):
+    reader = csv.DictReader(decode_lines(lines))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def parse_jsonl(lines):
+    for line_num, line in enumerate(decode_lines(lines), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_num, None
+            continue
+        yield line_num, row if isinstance(row, dict) else None
+
+
+def get_parser(content_type):
+    content_type = content_type.split(";")[0].strip()
+    if content_type in CSV_CONTENT_TYPES:
+        return parse_csv
+    if content_type in JSONL_CONTENT_TYPES:
+        return parse_jsonl
+    return None
+
+
+def clean_row(row):
+    if row is None:
+        return None, "Nieprawidłowy wiersz."
+    front = row.get("front")
+    back = row.get("back")
+    if not isinstance(front, str) or not front.strip():
+        return None, "Brak przodu fiszki."
+    if not isinstance(back, str) or not back.strip():
+        return None, "Brak tyłu fiszki."
+    return (front, back), None
+
+
+def import_flashcards(flashcard_set, author, rows):
+    db = shards.author_db(author.id)
+    report = {"created": 0, "duplicates": 0, "error_count": 0, "errors": []}
+    batch = []
+
+    def add_error(line_num, error):
+        report["error_count"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": line_num, "error": error})
+
+    def flush():
+        flashcards = {}
+        for front, back in batch:
+            flashcard = models.Flashcard(front=front, back=back, flashcard_set=flashcard_set, author=author)
+            flashcard.content_hash = flashcard.compute_content_hash()
+            if flashcard.content_hash in flashcards:
+                report["duplicates"] += 1
+                continue
+            flashcards[flashcard.content_hash] = flashcard
+        existing = models.Flashcard.objects.using(db).filter(content_hash__in=flashcards.keys())
+        for content_hash in existing.values_list("content_hash", flat=True):
+            del flashcards[content_hash]
+            report["duplicates"] += 1
+        flashcards = list(flashcards.values())
+        models.Flashcard.objects.using(db).bulk_create(flashcards)
+        models.ReviewState.objects.using(db).bulk_create([
+            models.ReviewState(user=author, flashcard=flashcard) for flashcard in flashcards
+        ])
+        search.index_flashcards(flashcards, db)
+        audit.log_buffer.add_on_commit(author.id, "B1", count=len(flashcards), using=db)
+        report["created"] += len(flashcards)
+        batch.clear()
+
+    with transaction.atomic(using=db):
+        for line_num, row in rows:
+            card, error = clean_row(row)
+            if error is not None:
+                add_error(line_num, error)
+                continue
+            batch.append(card)
+            if len(batch) >= BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+        models.change_flashcard_count(flashcard_set.id, report["created"], db)
+    return report
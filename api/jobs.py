@@ -0,0 +1,82 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "QUIZ_JOB_WORKERS", 2),
+                thread_name_prefix="quiz-job",
+            )
+        return _executor
+
+
+def submit_quiz_job(job):
+    transaction.on_commit(lambda: get_executor().submit(_run_in_worker, job.id), using=job._state.db)
+
+
+def run_quiz_job(job_id):
+    # każdy błąd, także przy wczytaniu zadania, trafia do logu i kończy zadanie jako nieudane
+    try:
+        _run_quiz_job(job_id)
+    except Exception as e:
+        logger.exception("Quiz job %s failed", job_id)
+        _fail_job(job_id, str(e))
+
+
+def _run_quiz_job(job_id):
+    job = models.QuizJob.objects.select_related("quiz").get(id=job_id)
+    if job.status != "pending":
+        # zadanie uznane za porzucone albo już wykonane nie jest uruchamiane ponownie
+        return
+    job.status = "running"
+    job.save(update_fields=["status", "updated"])
+    job.quiz.generate_quiz(progress=lambda progress: _save_progress(job, progress))
+    job.payload = job.quiz.serialize_quiz()
+    job.status = "done"
+    job.progress = 100
+    job.finished = timezone.now()
+    job.save(update_fields=["status", "progress", "payload", "finished", "updated"])
+
+
+def _save_progress(job, progress):
+    job.progress = progress
+    job.save(update_fields=["progress", "updated"])
+
+
+def _fail_job(job_id, error):
+    now = timezone.now()
+    try:
+        models.QuizJob.objects.filter(id=job_id).update(status="failed", error=error, finished=now, updated=now)
+    except Exception:
+        logger.exception("Could not mark quiz job %s as failed", job_id)
+
+
+def expire_stale_jobs(queryset):
+    # zadania z wątków, które przerwał restart lub awaria procesu, nie zmienią już statusu same
+    now = timezone.now()
+    stale = queryset.filter(status__in=["pending", "running"],
+                            updated__lt=now - timedelta(seconds=getattr(settings, "QUIZ_JOB_TIMEOUT", 600)))
+    return stale.update(status="failed", error="Generowanie quizu zostało przerwane.", finished=now, updated=now)
+
+
+def _run_in_worker(job_id):
+    try:
+        run_quiz_job(job_id)
+    finally:
+        connections.close_all()
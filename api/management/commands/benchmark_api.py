@@ -0,0 +1,213 @@
+import json
+import math
+import random
+import subprocess
+import time
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import shards
+from api.catalogue import catalogue_cache
+from api.middleware import QueryTimer
+from api.models import Category, FlashcardsSet
+
+SCENARIOS = {
+    "list_sets": 30,
+    "list_sets_filtered": 20,
+    "list_flashcards": 20,
+    "generate_quiz": 10,
+    "check_quiz": 10,
+    "create_rating": 10,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the API in-process against the current database and reports latency percentiles as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--warmup", type=int, default=50)
+        parser.add_argument("--users", type=int, default=50, help="Number of users whose tokens are used.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+        parser.add_argument("--baseline", help="JSON report of an earlier run to compare against.")
+        parser.add_argument("--max-regression", type=float, default=0.2,
+                            help="Allowed relative p95 slowdown against --baseline before failing.")
+        parser.add_argument("--keep-data", action="store_true",
+                            help="Commit the quizzes and ratings created by the benchmark.")
+
+    def handle(self, *args, **options):
+        if shards.is_enabled() and not options["keep_data"]:
+            # wycofywana jest tylko transakcja bazy domyślnej, a quizy trafiają na shardy autorów
+            raise CommandError("With FLASHCARD_SHARDS set the benchmark cannot roll back its data; use --keep-data.")
+        self.rng = random.Random(options["seed"])
+        self.client = APIClient(HTTP_HOST="127.0.0.1")
+        self.load_fixtures(options["users"])
+
+        with transaction.atomic():
+            for _ in range(options["warmup"]):
+                self.run_scenario(self.pick_scenario())
+            samples = {name: [] for name in SCENARIOS}
+            start = time.perf_counter()
+            for _ in range(options["requests"]):
+                name = self.pick_scenario()
+                samples[name].append(self.run_scenario(name))
+            elapsed = time.perf_counter() - start
+            if not options["keep_data"]:
+                transaction.set_rollback(True)
+        if not options["keep_data"]:
+            # odpowiedzi katalogu zapisane w trakcie pomiaru mogą zawierać wycofane oceny
+            catalogue_cache.clear()
+
+        report = self.build_report(samples, elapsed, options)
+        if options["baseline"]:
+            report["regressions"] = self.compare(report, options["baseline"], options["max_regression"])
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+        if report.get("regressions"):
+            raise CommandError(f"p95 latency or query count regressed for: {', '.join(report['regressions'])}")
+
+    def load_fixtures(self, users):
+        self.tokens = list(Token.objects.select_related("user").order_by("user_id")[:users])
+        if not self.tokens:
+            raise CommandError("No users with tokens found, run seed_flashwise first.")
+        self.own_sets = {}
+        for set_id, author_id, name in FlashcardsSet.objects.filter(
+                author__in=[token.user_id for token in self.tokens], flashcard_count__gte=4
+        ).order_by("id").values_list("id", "author_id", "name"):
+            self.own_sets.setdefault(author_id, []).append((set_id, name))
+        if not self.own_sets:
+            raise CommandError("The benchmark users have no sets with at least 4 flashcards.")
+        self.public_set_ids = list(
+            FlashcardsSet.objects.filter(status="public").order_by("-id").values_list("id", flat=True)[:10000]
+        )
+        self.categories = list(Category.objects.values_list("name", flat=True))
+        self.authors = [token.user.username for token in self.tokens]
+        self.quizzes = []
+
+    def pick_scenario(self):
+        return self.rng.choices(list(SCENARIOS), weights=list(SCENARIOS.values()))[0]
+
+    def authenticate(self, token=None):
+        token = token or self.rng.choice(self.tokens)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+
+    def run_scenario(self, name):
+        request = getattr(self, f"scenario_{name}")()
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = request()
+            if getattr(response, "streaming", False):
+                b"".join(response.streaming_content)
+        return time.perf_counter() - start, timer.count, response.status_code
+
+    def scenario_list_sets(self):
+        self.authenticate()
+        return lambda: self.client.get("/api/sets/")
+
+    def scenario_list_sets_filtered(self):
+        self.authenticate()
+        params = self.rng.choice([
+            {"category": self.rng.choice(self.categories)} if self.categories else {},
+            {"author": self.rng.choice(self.authors)},
+            {"user_only": "True"},
+        ])
+        return lambda: self.client.get("/api/sets/", params)
+
+    def own_set(self):
+        token = self.rng.choice([token for token in self.tokens if token.user_id in self.own_sets])
+        return token, self.rng.choice(self.own_sets[token.user_id])
+
+    def scenario_list_flashcards(self):
+        token, (set_id, name) = self.own_set()
+        self.authenticate(token)
+        return lambda: self.client.get("/api/flashcards/", {"flashcard_set": name})
+
+    def scenario_generate_quiz(self):
+        token, (set_id, name) = self.own_set()
+        self.authenticate(token)
+
+        def request():
+            response = self.client.post("/api/quiz/generate/", {"flashcards_set": set_id, "question_count": 20})
+            if response.status_code == 201:
+                self.quizzes.append((token, response.data))
+            return response
+        return request
+
+    def scenario_check_quiz(self):
+        if not self.quizzes:
+            self.scenario_generate_quiz()()
+        token, quiz = self.quizzes.pop(self.rng.randrange(len(self.quizzes)))
+        self.authenticate(token)
+        answers = {str(question["id"]): self.rng.choice("ABCD") for question in quiz[1:]}
+        data = {"quiz_id": quiz[0]["quiz_id"], "answers": json.dumps(answers)}
+        return lambda: self.client.put("/api/quiz/check/", data)
+
+    def scenario_create_rating(self):
+        self.authenticate()
+        data = {"set": self.rng.choice(self.public_set_ids), "rate": self.rng.randint(1, 5)}
+        return lambda: self.client.post("/api/ratings/", data)
+
+    def build_report(self, samples, elapsed, options):
+        total = sum(len(values) for values in samples.values())
+        report = {
+            "revision": git_revision(),
+            "requests": total,
+            "seed": options["seed"],
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+            "scenarios": {},
+        }
+        everything = [sample for values in samples.values() for sample in values]
+        for name, values in list(samples.items()) + [("all", everything)]:
+            latencies = [duration * 1000 for duration, _, _ in values]
+            statuses = {}
+            for _, _, status_code in values:
+                statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+            report["scenarios"][name] = {
+                "count": len(values),
+                "p50_ms": round(percentile(latencies, 0.5), 3) if values else None,
+                "p95_ms": round(percentile(latencies, 0.95), 3) if values else None,
+                "p99_ms": round(percentile(latencies, 0.99), 3) if values else None,
+                "mean_queries": round(sum(queries for _, queries, _ in values) / len(values), 2) if values else None,
+                "status_codes": statuses,
+            }
+        return report
+
+    def compare(self, report, baseline_path, max_regression):
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+        regressions = []
+        for name, stats in report["scenarios"].items():
+            before = baseline.get("scenarios", {}).get(name, {})
+            if before.get("p95_ms") and stats["p95_ms"] and stats["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+                regressions.append(name)
+            elif before.get("mean_queries") is not None and stats["mean_queries"] is not None \
+                    and stats["mean_queries"] > before["mean_queries"] + 0.5:
+                regressions.append(name)
+        return regressions
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import audit
+
+
+class Command(BaseCommand):
+    help = (
+        "Rolls Log events up into per-user daily counters and deletes events older than the retention age. "
+        "Meant to be run periodically, e.g. daily from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retention-days", type=int, default=getattr(settings, "LOG_RETENTION_DAYS", 90),
+                            help="Age in days after which raw Log events are deleted.")
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="Number of Log events rolled up or deleted per transaction.")
+
+    def handle(self, *args, **options):
+        if options["retention_days"] < 0 or options["batch_size"] < 1:
+            raise CommandError("--retention-days must not be negative and --batch-size must be positive.")
+        audit.log_buffer.flush()
+        rolled_up = audit.roll_up_logs(options["batch_size"])
+        self.stdout.write(f"Rolled up {rolled_up} log event(s) into daily activity.")
+        before = timezone.now() - timedelta(days=options["retention_days"])
+        deleted = audit.delete_old_logs(before, options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} log event(s) older than {options['retention_days']} day(s)."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api import jobs, models
+
+
+class Command(BaseCommand):
+    help = (
+        "Marks quiz generation jobs that made no progress for QUIZ_JOB_TIMEOUT seconds as failed, "
+        "e.g. jobs left behind by a restarted worker. Meant to be run periodically, e.g. from cron."
+    )
+
+    def handle(self, *args, **options):
+        expired = jobs.expire_stale_jobs(models.QuizJob.objects.all())
+        self.stdout.write(self.style.SUCCESS(f"Marked {expired} stale quiz job(s) as failed."))
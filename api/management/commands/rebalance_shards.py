@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from api import models, search, shards
+
+BATCH_SIZE = 1000
+
+
+def author_rows(author_id):
+    # modele w kolejności wstawiania: rodzice przed dziećmi
+    return [
+        (models.FlashcardsSet, {"author_id": author_id}),
+        (models.Flashcard, {"author_id": author_id}),
+        (models.ReviewState, {"user_id": author_id}),
+        (models.Quiz, {"author_id": author_id}),
+        (models.QuizQuestion, {"quiz__author_id": author_id}),
+        (models.QuizAnswer, {"question__quiz__author_id": author_id}),
+        (models.QuizQuestion.answers.through, {"quizquestion__quiz__author_id": author_id}),
+        (models.Quiz.questions.through, {"quiz__author_id": author_id}),
+        (models.QuizJob, {"quiz__author_id": author_id}),
+    ]
+
+
+def raw_delete(model, lookup, using):
+    # bez sygnałów: przenoszony zestaw nie jest usuwany, więc jego oceny i quizy innych autorów zostają
+    queryset = model._base_manager.using(using).filter(**lookup)
+    queryset._raw_delete(using)
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves flashcard sets, flashcards, review states and quizzes of every author to the shard "
+        "chosen for them by FLASHCARD_SHARDS. Run it after adding or removing shards, ideally while "
+        "writes are paused."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report which authors would be moved.")
+        parser.add_argument(
+            "--source",
+            action="append",
+            default=[],
+            help="Additional database to drain, e.g. a shard that was removed from FLASHCARD_SHARDS.",
+        )
+
+    def handle(self, *args, **options):
+        if not shards.is_enabled():
+            raise CommandError("No shards are configured in FLASHCARD_SHARDS.")
+        sources = list(dict.fromkeys([DEFAULT_DB_ALIAS, *shards.shard_aliases(), *options["source"]]))
+        for alias in sources:
+            if alias not in settings.DATABASES:
+                raise CommandError(f"{alias} is not a configured database.")
+
+        moves = []
+        for source in sources:
+            for author_id in sorted(self.author_ids(source)):
+                target = shards.shard_for(author_id)
+                if target != source:
+                    moves.append((author_id, source, target))
+        for author_id, source, target in moves:
+            self.stdout.write(f"Author {author_id}: {source} -> {target}")
+            if not options["dry_run"]:
+                self.move_author(author_id, source, target)
+
+        verb = "Would move" if options["dry_run"] else "Moved"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(moves)} author(s)."))
+
+    def author_ids(self, using):
+        author_ids = set(models.FlashcardsSet.objects.using(using).values_list("author_id", flat=True).distinct())
+        author_ids |= set(models.Flashcard.objects.using(using).values_list("author_id", flat=True).distinct())
+        author_ids |= set(models.Quiz.objects.using(using).values_list("author_id", flat=True).distinct())
+        author_ids |= set(models.ReviewState.objects.using(using).values_list("user_id", flat=True).distinct())
+        return author_ids
+
+    def move_author(self, author_id, source, target):
+        rows = author_rows(author_id)
+        flashcard_sets, flashcards = [], []
+        # najpierw kopia z zachowaniem id, potem usunięcie ze źródła; przerwane przeniesienie
+        # można powtórzyć, bo kopia zaczyna od usunięcia pozostałości z poprzedniej próby
+        with transaction.atomic(using=target):
+            for model, lookup in reversed(rows):
+                raw_delete(model, lookup, target)
+            for model, lookup in rows:
+                objs = list(model._base_manager.using(source).filter(**lookup).order_by("pk"))
+                if model._meta.auto_created:
+                    # wiersze tabel pośrednich dostają nowe id z sekwencji docelowej bazy
+                    for obj in objs:
+                        obj.pk = None
+                model._base_manager.using(target).bulk_create(objs, batch_size=BATCH_SIZE)
+                if model is models.FlashcardsSet:
+                    flashcard_sets = objs
+                elif model is models.Flashcard:
+                    flashcards = objs
+            search.index_sets(flashcard_sets, target)
+            search.index_flashcards(flashcards, target)
+        with transaction.atomic(using=source):
+            for model, lookup in reversed(rows):
+                raw_delete(model, lookup, source)
+            search.unindex([search.set_rowid(obj.id) for obj in flashcard_sets], source)
+            search.unindex([search.flashcard_rowid(obj.id) for obj in flashcards], source)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import Flashcard, FlashcardsSet, touch_flashcard_sets
+
+
+class Command(BaseCommand):
+    help = "Rebuilds FlashcardsSet.flashcard_count counters and reports the ones that were wrong."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report sets with wrong counters, without fixing them.",
+        )
+
+    def handle(self, *args, **options):
+        counts = Flashcard.objects.filter(flashcard_set=OuterRef("pk")).order_by().values("flashcard_set")
+        counts = Coalesce(Subquery(counts.annotate(count=Count("id")).values("count")), 0)
+        wrong_sets = FlashcardsSet.objects.annotate(actual_count=counts).exclude(flashcard_count=counts)
+        wrong_sets = list(wrong_sets.values_list("id", "flashcard_count", "actual_count"))
+        for set_id, flashcard_count, actual_count in wrong_sets:
+            self.stdout.write(f"Set {set_id}: flashcard_count={flashcard_count}, actual={actual_count}")
+
+        if options["check"]:
+            if wrong_sets:
+                raise CommandError(f"{len(wrong_sets)} set(s) have wrong flashcard counters.")
+            self.stdout.write(self.style.SUCCESS("All flashcard counters are correct."))
+            return
+
+        if wrong_sets:
+            touch_flashcard_sets([set_id for set_id, _, _ in wrong_sets], flashcard_count=counts)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt flashcard counters, fixed {len(wrong_sets)} set(s)."))
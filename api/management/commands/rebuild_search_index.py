@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of flashcard sets and flashcards."
+
+    def handle(self, *args, **options):
+        databases = search.databases()
+        if not all(search.is_supported(using) for using in databases):
+            raise CommandError("Full-text search is only available on SQLite.")
+        for using in databases:
+            search.rebuild(using)
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
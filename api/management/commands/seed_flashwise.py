@@ -0,0 +1,204 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api import search, shards
+from api.models import (
+    LISTING_FIELDS, Category, Flashcard, FlashcardsSet, Quiz, Rating, ReviewState, Tag, User, bump_set_listings,
+    content_hash,
+)
+
+CATEGORIES = [
+    ("Angielski", "easy"), ("Niemiecki", "medi"), ("Hiszpański", "easy"), ("Historia", "medi"),
+    ("Biologia", "hard"), ("Chemia", "hard"), ("Geografia", "easy"), ("Matematyka", "hard"),
+    ("Informatyka", "medi"), ("Muzyka", "easy"),
+]
+TAGS = ["matura", "studia", "podstawy", "słówka", "egzamin", "powtórka", "gramatyka", "daty"]
+VOCABULARY_SIZE = 5000
+SYLLABLES = ["ka", "ro", "mi", "ta", "le", "no", "pra", "wi", "szu", "do", "ge", "ba", "zo", "przy", "ły", "cie"]
+
+
+class Command(BaseCommand):
+    help = "Fills the database with a large, deterministic synthetic dataset for performance testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--sets", type=int, default=1000, help="Total number of flashcard sets.")
+        parser.add_argument("--cards-per-set", type=int, default=50)
+        parser.add_argument("--ratings", type=int, default=5000, help="Total number of ratings.")
+        parser.add_argument("--quizzes", type=int, default=100, help="Total number of generated quizzes.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--prefix", default="seed", help="Prefix of generated usernames.")
+
+    def handle(self, *args, **options):
+        if shards.is_enabled():
+            raise CommandError(
+                "Seeding writes to the default database only; seed with FLASHCARD_SHARDS empty, "
+                "then enable the shards and run rebalance_shards."
+            )
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.vocabulary = [
+            "".join(self.rng.choices(SYLLABLES, k=self.rng.randint(2, 4))) for _ in range(VOCABULARY_SIZE)
+        ]
+        if options["users"] < 1 and (options["sets"] or options["ratings"] or options["quizzes"]):
+            raise CommandError("At least one user is needed to create sets, ratings or quizzes.")
+        if User.objects.filter(username=f"{options['prefix']}0").exists():
+            raise CommandError(f"Users with prefix '{options['prefix']}' already exist, use another --prefix.")
+
+        if connection.vendor == "sqlite" and not connection.in_atomic_block:
+            # dane syntetyczne, więc przy seedowaniu rezygnujemy z fsync i powiększamy cache stron
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA synchronous = OFF")
+                cursor.execute("PRAGMA cache_size = -262144")
+
+        start = time.perf_counter()
+        user_ids = self.step("users", self.create_users, options["users"], options["prefix"])
+        category_ids, tag_ids = self.step("categories and tags", self.create_categories_and_tags)
+        set_ids = self.step("sets", self.create_sets, options["sets"], user_ids, category_ids, tag_ids)
+        self.step("flashcards", self.create_flashcards, set_ids, options["cards_per_set"])
+        self.step("ratings", self.create_ratings, options["ratings"], user_ids, set_ids)
+        if set_ids and options["cards_per_set"] >= 4:
+            self.step("quizzes", self.create_quizzes, options["quizzes"], user_ids, set_ids)
+        if search.is_supported():
+            self.step("search index", search.rebuild)
+        if connection.vendor in ("sqlite", "postgresql"):
+            # po masowym imporcie planer potrzebuje statystyk, żeby wybierać indeksy złożone
+            self.step("statistics", self.analyze)
+        self.stdout.write(self.style.SUCCESS(f"Seeded database in {time.perf_counter() - start:.1f}s."))
+
+    def step(self, name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.stdout.write(f"Created {name} in {time.perf_counter() - start:.1f}s.")
+        return result
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def chunks(self, count):
+        for offset in range(0, count, self.batch_size):
+            yield range(offset, min(offset + self.batch_size, count))
+
+    def sentence(self, words):
+        return " ".join(self.rng.choices(self.vocabulary, k=words)).capitalize()
+
+    def create_users(self, count, prefix):
+        password = make_password(None)
+        user_ids = []
+        for chunk in self.chunks(count):
+            with transaction.atomic():
+                users = User.objects.bulk_create([User(username=f"{prefix}{i}", password=password)
+                                                  for i in chunk])
+                Token.objects.bulk_create([Token(key=Token.generate_key(), user=user)
+                                           for user in users])
+            user_ids += [user.id for user in users]
+        return user_ids
+
+    def create_categories_and_tags(self):
+        category_ids = []
+        for name, level in CATEGORIES:
+            category = Category.objects.filter(name=name).first()
+            if category is None:
+                category = Category.objects.create(name=name, level=level)
+            category_ids.append(category.id)
+        tag_ids = [Tag.objects.get_or_create(name=name)[0].id for name in TAGS]
+        return category_ids, tag_ids
+
+    def create_sets(self, count, user_ids, category_ids, tag_ids):
+        set_ids = []
+        for chunk in self.chunks(count):
+            flashcard_sets = []
+            for i in chunk:
+                flashcard_set = FlashcardsSet(
+                    name=f"{self.sentence(2)} {i}",
+                    author_id=self.rng.choice(user_ids),
+                    status="public" if self.rng.random() < 0.8 else "private",
+                    is_premium=self.rng.random() < 0.1,
+                    tag_id=self.rng.choice(tag_ids) if self.rng.random() < 0.5 else None,
+                    category_id=self.rng.choice(category_ids),
+                )
+                flashcard_set.content_hash = flashcard_set.compute_content_hash()
+                flashcard_sets.append(flashcard_set)
+            with transaction.atomic():
+                FlashcardsSet.objects.bulk_create(flashcard_sets)
+            set_ids += [(flashcard_set.id, flashcard_set.author_id) for flashcard_set in flashcard_sets]
+        bump_set_listings(self.seeded_sets(set_ids).values_list(*LISTING_FIELDS).distinct())
+        return set_ids
+
+    def seeded_sets(self, set_ids):
+        if not set_ids:
+            return FlashcardsSet.objects.none()
+        return FlashcardsSet.objects.filter(id__range=(set_ids[0][0], set_ids[-1][0]))
+
+    def create_flashcards(self, set_ids, cards_per_set):
+        # przy milionach wierszy narzut tworzenia instancji modelu dominuje, więc fiszki
+        # wstawiamy jako krotki przez executemany w porcjach o rozmiarze --batch-size
+        last_modified = connection.ops.adapt_datetimefield_value(timezone.now())
+        sql = (
+            f"INSERT INTO {Flashcard._meta.db_table} "
+            "(front, back, last_modified, flashcard_set_id, author_id, content_hash) "
+            "VALUES (%s, %s, %s, %s, %s, %s)"
+        )
+        batch = []
+        for set_id, author_id in set_ids:
+            for i in range(cards_per_set):
+                front = f"{self.sentence(3)} {i}?"
+                back = self.sentence(self.rng.randint(1, 6))
+                batch.append((front, back, last_modified, set_id, author_id, content_hash(set_id, front, back)))
+                if len(batch) >= self.batch_size:
+                    self.insert_rows(sql, batch)
+                    batch = []
+        self.insert_rows(sql, batch)
+        self.seeded_sets(set_ids).update(flashcard_count=cards_per_set)
+        if set_ids:
+            # nowe fiszki od razu trafiają do kolejki powtórek autora
+            interval = connection.ops.quote_name("interval")
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {ReviewState._meta.db_table} "
+                    f"(user_id, flashcard_id, {interval}, ease, repetitions, due_at) "
+                    f"SELECT author_id, id, 0, %s, 0, last_modified FROM {Flashcard._meta.db_table} "
+                    "WHERE flashcard_set_id BETWEEN %s AND %s",
+                    [ReviewState._meta.get_field("ease").default, set_ids[0][0], set_ids[-1][0]],
+                )
+
+    def insert_rows(self, sql, rows):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+    def create_ratings(self, count, user_ids, set_ids):
+        count = min(count, len(user_ids) * len(set_ids))
+        pairs = self.rng.sample(range(len(user_ids) * len(set_ids)), count)
+        for chunk in self.chunks(count):
+            ratings = [
+                Rating(user_id=user_ids[pairs[i] % len(user_ids)], set_id=set_ids[pairs[i] // len(user_ids)][0],
+                       rate=self.rng.randint(1, 5))
+                for i in chunk
+            ]
+            with transaction.atomic():
+                Rating.objects.bulk_create(ratings)
+        ratings = Rating.objects.filter(set=OuterRef("pk")).order_by().values("set")
+        self.seeded_sets(set_ids).update(
+            rating_count=Coalesce(Subquery(ratings.annotate(count=Count("id")).values("count")), 0),
+            rating_sum=Coalesce(Subquery(ratings.annotate(sum=Sum("rate")).values("sum")), 0),
+            rating_avg=Coalesce(Subquery(ratings.annotate(avg=Avg("rate")).values("avg")), 0.0),
+        )
+
+    def create_quizzes(self, count, user_ids, set_ids):
+        for _ in range(count):
+            set_id, _ = self.rng.choice(set_ids)
+            quiz = Quiz(flashcards_set_id=set_id, author_id=self.rng.choice(user_ids), question_count=20)
+            quiz.defer_generation = True
+            with transaction.atomic():
+                quiz.save()
+                quiz.generate_quiz(rng=self.rng)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from api import replicas
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the primary SQLite database over the SQLite read replicas listed in DATABASE_REPLICAS. "
+        "Meant for local development; production replicas are kept up to date by the database server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("aliases", nargs="*", help="Replica aliases to refresh (default: all of them).")
+
+    def handle(self, *args, **options):
+        aliases = options["aliases"] or replicas.replica_aliases()
+        if not aliases:
+            raise CommandError("No read replicas are configured in DATABASE_REPLICAS.")
+        for alias in aliases:
+            if alias not in replicas.replica_aliases() or alias not in settings.DATABASES:
+                raise CommandError(f"{alias} is not a configured read replica.")
+            for connection in (connections[DEFAULT_DB_ALIAS], connections[alias]):
+                if connection.vendor != "sqlite":
+                    raise CommandError(f"{connection.alias} is not a SQLite database; use the server's replication.")
+        for alias in aliases:
+            replicas.copy_sqlite_database(DEFAULT_DB_ALIAS, alias)
+            self.stdout.write(self.style.SUCCESS(f"Copied the primary database to {alias}."))
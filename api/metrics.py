@@ -0,0 +1,85 @@
+import threading
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.query_duration = 0.0
+
+    def observe(self, duration, queries, query_duration):
+        index = 0
+        while index < len(BUCKETS) and duration > BUCKETS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.duration += duration
+        self.queries += queries
+        self.query_duration += query_duration
+
+
+class Registry:
+    def __init__(self):
+        self.endpoints = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def observe(self, view, method, duration, queries, query_duration):
+        with self._lock:
+            stats = self.endpoints.get((view, method))
+            if stats is None:
+                stats = self.endpoints[(view, method)] = EndpointStats()
+            stats.observe(duration, queries, query_duration)
+
+    def register(self, collector):
+        # collector zwraca listę (nazwa, typ, opis, [(etykiety, wartość), ...])
+        self.collectors.append(collector)
+
+    def clear(self):
+        with self._lock:
+            self.endpoints.clear()
+
+    def render(self):
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            lines = [
+                "# HELP flashwise_request_duration_seconds Request latency per endpoint.",
+                "# TYPE flashwise_request_duration_seconds histogram",
+            ]
+            for (view, method), stats in endpoints:
+                labels = f'view="{view}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), stats.buckets):
+                    cumulative += count
+                    lines.append(f'flashwise_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"flashwise_request_duration_seconds_sum{{{labels}}} {stats.duration}")
+                lines.append(f"flashwise_request_duration_seconds_count{{{labels}}} {stats.count}")
+            lines += [
+                "# HELP flashwise_db_queries_total Database queries executed per endpoint.",
+                "# TYPE flashwise_db_queries_total counter",
+            ]
+            for (view, method), stats in endpoints:
+                lines.append(f'flashwise_db_queries_total{{view="{view}",method="{method}"}} {stats.queries}')
+            lines += [
+                "# HELP flashwise_db_query_duration_seconds_total Time spent in database queries per endpoint.",
+                "# TYPE flashwise_db_query_duration_seconds_total counter",
+            ]
+            for (view, method), stats in endpoints:
+                lines.append(
+                    f'flashwise_db_query_duration_seconds_total{{view="{view}",method="{method}"}} '
+                    f'{stats.query_duration}'
+                )
+        for collector in self.collectors:
+            for name, kind, description, samples in collector():
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,53 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import metrics
+from . import replicas
+
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match is not None else "unresolved"
+        metrics.registry.observe(view, request.method, duration, timer.count, timer.duration)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with replicas.request_routing() as routing:
+            response = self.get_response(request)
+        # użytkownik ustawiony przez uwierzytelnianie DRF, więc zapis przez API też przypina do bazy głównej
+        user = getattr(request, "user", None)
+        if routing.wrote and user is not None and user.is_authenticated:
+            replicas.pin_to_primary(user.id)
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_quizjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='payload',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
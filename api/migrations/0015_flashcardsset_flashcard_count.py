@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_flashcards(apps, schema_editor):
+    Flashcard = apps.get_model('api', 'Flashcard')
+    FlashcardsSet = apps.get_model('api', 'FlashcardsSet')
+    counts = Flashcard.objects.filter(flashcard_set=OuterRef('pk')).order_by().values('flashcard_set')
+    counts = counts.annotate(count=Count('id')).values('count')
+    FlashcardsSet.objects.update(flashcard_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_quiz_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flashcardsset',
+            name='flashcard_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_flashcards, migrations.RunPython.noop),
+    ]
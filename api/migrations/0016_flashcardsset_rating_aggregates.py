@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:46
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def aggregate_ratings(apps, schema_editor):
+    Rating = apps.get_model('api', 'Rating')
+    FlashcardsSet = apps.get_model('api', 'FlashcardsSet')
+    ratings = Rating.objects.filter(set=OuterRef('pk')).order_by().values('set')
+    FlashcardsSet.objects.update(
+        rating_count=Coalesce(Subquery(ratings.annotate(count=Count('id')).values('count')), 0),
+        rating_sum=Coalesce(Subquery(ratings.annotate(sum=Sum('rate')).values('sum')), 0),
+        rating_avg=Coalesce(Subquery(ratings.annotate(avg=Avg('rate')).values('avg')), 0.0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_flashcardsset_flashcard_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flashcardsset',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='flashcardsset',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='flashcardsset',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(aggregate_ratings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='flashcardsset',
+            index=models.Index(fields=['status', '-rating_avg'], name='set_top_rated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flashcardsset',
+            index=models.Index(fields=['category', 'status', '-rating_avg'], name='set_top_rated_category_idx'),
+        ),
+    ]
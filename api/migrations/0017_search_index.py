@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE api_searchindex USING fts5("
+        "set_id UNINDEXED, title, body, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "INSERT INTO api_searchindex (rowid, set_id, title, body) "
+        "SELECT id * 2, id, name, '' FROM api_flashcardsset"
+    )
+    schema_editor.execute(
+        "INSERT INTO api_searchindex (rowid, set_id, title, body) "
+        "SELECT id * 2 + 1, flashcard_set_id, front, back FROM api_flashcard"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE api_searchindex")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_flashcardsset_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
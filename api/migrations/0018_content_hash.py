@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:51
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def content_hash(*values):
+    content = "\x1f".join("" if value is None else str(value) for value in values)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def fill_hashes(model, compute):
+    # duplikaty sprzed migracji zostają bez skrótu, żeby nie naruszyć ograniczenia unikalności
+    last_id = 0
+    while True:
+        chunk = list(model.objects.filter(id__gt=last_id).order_by('id')[:500])
+        if not chunk:
+            break
+        last_id = chunk[-1].id
+        objs = {}
+        for obj in chunk:
+            obj.content_hash = compute(obj)
+            objs.setdefault(obj.content_hash, obj)
+        taken = set(model.objects.filter(content_hash__in=objs.keys()).values_list('content_hash', flat=True))
+        model.objects.bulk_update([obj for key, obj in objs.items() if key not in taken], ['content_hash'])
+
+
+def compute_hashes(apps, schema_editor):
+    Flashcard = apps.get_model('api', 'Flashcard')
+    FlashcardsSet = apps.get_model('api', 'FlashcardsSet')
+    fill_hashes(Flashcard, lambda f: content_hash(f.flashcard_set_id, f.front, f.back))
+    fill_hashes(FlashcardsSet, lambda s: content_hash(
+        s.author_id, s.name, s.status, s.is_premium, s.tag_id, s.category_id
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flashcard',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='flashcardsset',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(compute_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='flashcard',
+            constraint=models.UniqueConstraint(fields=('content_hash',), name='flashcard_content_hash_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='flashcardsset',
+            constraint=models.UniqueConstraint(fields=('content_hash',), name='set_content_hash_unique'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:02
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_ratings(apps, schema_editor):
+    Rating = apps.get_model('api', 'Rating')
+    FlashcardsSet = apps.get_model('api', 'FlashcardsSet')
+    duplicates = (Rating.objects.values('user', 'set').order_by()
+                  .annotate(first=Min('id'), count=Count('id')).filter(count__gt=1))
+    affected_sets = set()
+    for duplicate in duplicates:
+        Rating.objects.filter(user=duplicate['user'], set=duplicate['set']).exclude(id=duplicate['first']).delete()
+        affected_sets.add(duplicate['set'])
+    if not affected_sets:
+        return
+    ratings = Rating.objects.filter(set=OuterRef('pk')).order_by().values('set')
+    FlashcardsSet.objects.filter(id__in=affected_sets).update(
+        rating_count=Coalesce(Subquery(ratings.annotate(count=Count('id')).values('count')), 0),
+        rating_sum=Coalesce(Subquery(ratings.annotate(sum=Sum('rate')).values('sum')), 0),
+        rating_avg=Coalesce(Subquery(ratings.annotate(avg=Avg('rate')).values('avg')), 0.0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['name'], name='category_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flashcard',
+            index=models.Index(fields=['author', 'flashcard_set'], name='flashcard_author_set_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flashcardsset',
+            index=models.Index(fields=['name'], name='set_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flashcardsset',
+            index=models.Index(fields=['status', 'author'], name='set_status_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['author', 'timestamp'], name='quiz_author_timestamp_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_ratings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(fields=('user', 'set'), name='rating_user_set_unique'),
+        ),
+    ]
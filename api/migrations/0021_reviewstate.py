@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def schedule_flashcards(apps, schema_editor):
+    # każda istniejąca fiszka trafia do kolejki autora jako nowa, w kolejności utworzenia;
+    # INSERT ... SELECT zamiast bulk_create, bo przy milionach fiszek liczy się czas migracji
+    Flashcard = apps.get_model('api', 'Flashcard')
+    ReviewState = apps.get_model('api', 'ReviewState')
+    qn = schema_editor.quote_name
+    columns = ("user_id", "flashcard_id", "interval", "ease", "repetitions", "due_at")
+    columns = ", ".join(qn(column) for column in columns)
+    schema_editor.execute(
+        f"INSERT INTO {qn(ReviewState._meta.db_table)} ({columns}) "
+        f"SELECT {qn('author_id')}, {qn('id')}, 0, 250, 0, {qn('last_modified')} "
+        f"FROM {qn(Flashcard._meta.db_table)}"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0020_listing_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interval', models.PositiveIntegerField(default=0)),
+                ('ease', models.PositiveSmallIntegerField(default=250)),
+                ('repetitions', models.PositiveSmallIntegerField(default=0)),
+                ('due_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('flashcard', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.flashcard')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'due_at'], name='review_due_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reviewstate',
+            constraint=models.UniqueConstraint(fields=('user', 'flashcard'), name='review_user_flashcard_unique'),
+        ),
+        migrations.RunPython(schedule_flashcards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_daily_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardSequence',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('last_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AlterModelOptions(
+            name='flashcardsset',
+            options={'base_manager_name': 'objects'},
+        ),
+    ]
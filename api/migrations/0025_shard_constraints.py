@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def cross_database_constraints():
+    # ta sama zasada co api.shards.cross_database_constraints, ale bez importu kodu aplikacji
+    return not getattr(settings, 'FLASHCARD_SHARDS', [])
+
+
+class AlterShardConstraint(migrations.AlterField):
+    # więzy kluczy obcych między bazami zależą od FLASHCARD_SHARDS w chwili migracji; trafiają też do
+    # stanu migracji, więc kolejne przebudowy tabel w SQLite ich nie przywrócą ani nie zgubią
+    def state_forwards(self, app_label, state):
+        field = self.field.clone()
+        field.db_constraint = cross_database_constraints()
+        state.alter_field(app_label, self.model_name_lower, self.name, field, self.preserve_default)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0024_sharding'),
+    ]
+
+    operations = [
+        AlterShardConstraint(
+            model_name='flashcardsset',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        AlterShardConstraint(
+            model_name='flashcardsset',
+            name='tag',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='api.tag'),
+        ),
+        AlterShardConstraint(
+            model_name='flashcardsset',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.category'),
+        ),
+        AlterShardConstraint(
+            model_name='flashcard',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        AlterShardConstraint(
+            model_name='quiz',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        AlterShardConstraint(
+            model_name='quiz',
+            name='flashcards_set',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.flashcardsset'),
+        ),
+        AlterShardConstraint(
+            model_name='rating',
+            name='set',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.flashcardsset'),
+        ),
+        AlterShardConstraint(
+            model_name='reviewstate',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE,
+                                    to=settings.AUTH_USER_MODEL),
+        ),
+    ]
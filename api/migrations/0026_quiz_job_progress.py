@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_shard_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizjob',
+            name='progress',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quizjob',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
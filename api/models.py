@@ -1,13 +1,22 @@
-import json
+import hashlib
 import random
+from datetime import timedelta
 
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Cast
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.text import slugify
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.admin import User
 
+from . import shards
+from .catalogue import catalogue_cache
+
+CROSS_DATABASE_CONSTRAINTS = shards.cross_database_constraints()
+
 
 @receiver(post_save, sender=User)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
@@ -32,6 +41,11 @@ class Category(models.Model):
     level = models.CharField(max_length=4, choices=CATEGORY_LEVELS)
     slug = models.SlugField(max_length=32, unique=True, default="")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["name"], name="category_name_idx"),
+        ]
+
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
         super(Category, self).save(*args, **kwargs)
@@ -40,43 +54,338 @@ class Category(models.Model):
         return self.name
 
 
+def content_hash(*values):
+    content = "\x1f".join("" if value is None else str(value) for value in values)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+# pola zestawu, od których zależy, na których listach się pojawia
+LISTING_FIELDS = ("author_id", "category_id", "status")
+
+
 class FlashcardsSet(models.Model):
     SET_STATUSES = [
         ("public", "Publiczny"),
         ("private", "Prywatny")
     ]
 
+    # zestawy, fiszki i quizy autora leżą na jego shardzie (api.shards), a użytkownicy, kategorie
+    # i tagi w bazie domyślnej; więzy kluczy obcych między bazami zależą od FLASHCARD_SHARDS, tak jak
+    # w migracji 0025 - nowa migracja tych pól musi zachować db_constraint zależne od ustawień
+    shard_key = "author"
+
     name = models.CharField(max_length=96, null=False)
-    author = models.ForeignKey(User, on_delete=models.CASCADE)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=CROSS_DATABASE_CONSTRAINTS)
     status = models.CharField(max_length=7, choices=SET_STATUSES, default="public")
     is_premium = models.BooleanField(default=False)
-    tag = models.ForeignKey(Tag, null=True, on_delete=models.CASCADE)
-    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, null=True, on_delete=models.CASCADE, db_constraint=CROSS_DATABASE_CONSTRAINTS)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, db_constraint=CROSS_DATABASE_CONSTRAINTS)
+    flashcard_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
+    content_hash = models.CharField(max_length=64, null=True, editable=False)
+    # wersja i czas ostatniej zmiany fiszek zestawu, na ich podstawie liczony jest ETag listy fiszek
+    version = models.PositiveIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = shards.ShardedManager()
+
+    class Meta:
+        # rating.set i quiz.flashcards_set mogą wskazywać zestaw z innego sharda niż ich własny
+        base_manager_name = "objects"
+        indexes = [
+            models.Index(fields=["status", "-rating_avg"], name="set_top_rated_idx"),
+            models.Index(fields=["category", "status", "-rating_avg"], name="set_top_rated_category_idx"),
+            models.Index(fields=["name"], name="set_name_idx"),
+            models.Index(fields=["status", "author"], name="set_status_author_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["content_hash"], name="set_content_hash_unique"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(FlashcardsSet, cls).from_db(db, field_names, values)
+        instance._loaded_listing = tuple(instance.__dict__.get(field) for field in LISTING_FIELDS)
+        return instance
+
+    def compute_content_hash(self):
+        return content_hash(self.author_id, self.name, self.status, self.is_premium, self.tag_id, self.category_id)
 
-    @property
-    def flashcard_count(self):
-        return Flashcard.objects.filter(flashcard_set=self).count()
+    def save(self, *args, **kwargs):
+        self.content_hash = self.compute_content_hash()
+        super(FlashcardsSet, self).save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
 
 class Flashcard(models.Model):
+    shard_key = "author"
+
     front = models.TextField(blank=False, null=False)
     back = models.TextField(blank=False, null=False)
     last_modified = models.DateTimeField(auto_now_add=True)
     flashcard_set = models.ForeignKey(FlashcardsSet, on_delete=models.CASCADE)
-    author = models.ForeignKey(User, on_delete=models.CASCADE)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=CROSS_DATABASE_CONSTRAINTS)
+    content_hash = models.CharField(max_length=64, null=True, editable=False)
+
+    objects = shards.ShardedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["author", "flashcard_set"], name="flashcard_author_set_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["content_hash"], name="flashcard_content_hash_unique"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Flashcard, cls).from_db(db, field_names, values)
+        instance._loaded_flashcard_set_id = instance.__dict__.get("flashcard_set_id")
+        return instance
+
+    def compute_content_hash(self):
+        return content_hash(self.flashcard_set_id, self.front, self.back)
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.compute_content_hash()
+        super(Flashcard, self).save(*args, **kwargs)
 
     def __str__(self):
         return str(self.id)
 
 
+class ListingVersion(models.Model):
+    # liczniki zmian list zestawów: jeden dla publicznego katalogu i po jednym na autora
+    PUBLIC_SETS = "public"
+
+    key = models.CharField(max_length=32, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    modified = models.DateTimeField(default=timezone.now)
+
+    @staticmethod
+    def user_key(user_id):
+        return f"user:{user_id}"
+
+    @classmethod
+    def versions(cls, keys):
+        found = {key: (version, modified) for key, version, modified in
+                 cls.objects.filter(key__in=keys).values_list("key", "version", "modified")}
+        return [(key,) + found.get(key, (0, None)) for key in sorted(keys)]
+
+    @classmethod
+    def bump(cls, keys):
+        keys = set(keys)
+        if not keys:
+            return
+        now = timezone.now()
+        if cls.objects.filter(key__in=keys).update(version=F("version") + 1, modified=now) == len(keys):
+            return
+        missing = keys.difference(cls.objects.filter(key__in=keys).values_list("key", flat=True))
+        cls.objects.bulk_create([cls(key=key, modified=now) for key in missing], ignore_conflicts=True)
+        cls.objects.filter(key__in=missing).update(version=F("version") + 1, modified=now)
+
+    def __str__(self):
+        return f"{self.key}@{self.version}"
+
+
+def bump_set_listings(listings):
+    # listings to krotki LISTING_FIELDS zmienionych zestawów
+    keys, public_authors, public_categories = set(), set(), set()
+    for author_id, category_id, status in listings:
+        keys.add(ListingVersion.user_key(author_id))
+        if status == "public":
+            keys.add(ListingVersion.PUBLIC_SETS)
+            public_authors.add(author_id)
+            public_categories.add(category_id)
+    ListingVersion.bump(keys)
+    if public_authors:
+        catalogue_cache.invalidate(public_authors, public_categories)
+
+
+def touch_flashcard_sets(flashcard_set_ids, using=None, **changes):
+    flashcard_sets = FlashcardsSet.objects.using(using).filter(id__in=flashcard_set_ids)
+    flashcard_sets.update(version=F("version") + 1, modified=timezone.now(), **changes)
+    if changes:
+        bump_set_listings(flashcard_sets.values_list(*LISTING_FIELDS))
+
+
+def change_flashcard_count(flashcard_set_id, delta, using=None):
+    touch_flashcard_sets([flashcard_set_id], using, flashcard_count=F("flashcard_count") + delta)
+
+
+@receiver(post_save, sender=FlashcardsSet)
+def bump_saved_set_listings(sender, instance=None, created=False, **kwargs):
+    listings = [(instance.author_id, instance.category_id, instance.status)]
+    if not created:
+        listings.append(getattr(instance, "_loaded_listing", (instance.author_id, instance.category_id, "public")))
+    bump_set_listings(listings)
+    instance._loaded_listing = listings[0]
+
+
+@receiver(post_delete, sender=FlashcardsSet)
+def bump_deleted_set_listings(sender, instance=None, **kwargs):
+    bump_set_listings([(instance.author_id, instance.category_id, instance.status)])
+
+
+@receiver(post_save, sender=Flashcard)
+def count_saved_flashcard(sender, instance=None, created=False, using=None, **kwargs):
+    loaded_flashcard_set_id = getattr(instance, "_loaded_flashcard_set_id", None)
+    if created:
+        change_flashcard_count(instance.flashcard_set_id, 1, using)
+    elif loaded_flashcard_set_id is not None and loaded_flashcard_set_id != instance.flashcard_set_id:
+        change_flashcard_count(loaded_flashcard_set_id, -1, using)
+        change_flashcard_count(instance.flashcard_set_id, 1, using)
+    else:
+        touch_flashcard_sets([instance.flashcard_set_id], using)
+    instance._loaded_flashcard_set_id = instance.flashcard_set_id
+
+
+def deleted_with_set(flashcard_set_id, origin):
+    # przy kaskadowym usuwaniu zestawu nie ma sensu aktualizować jego liczników
+    if isinstance(origin, FlashcardsSet):
+        return origin.pk == flashcard_set_id
+    return isinstance(origin, models.QuerySet) and origin.model is FlashcardsSet
+
+
+@receiver(post_delete, sender=Flashcard)
+def count_deleted_flashcard(sender, instance=None, origin=None, using=None, **kwargs):
+    if not deleted_with_set(instance.flashcard_set_id, origin):
+        change_flashcard_count(instance.flashcard_set_id, -1, using)
+
+
 class Rating(models.Model):
-    set = models.ForeignKey(FlashcardsSet, models.CASCADE)
+    set = models.ForeignKey(FlashcardsSet, models.CASCADE, db_constraint=CROSS_DATABASE_CONSTRAINTS)
     user = models.ForeignKey(User, models.CASCADE)
     rate = models.PositiveSmallIntegerField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "set"], name="rating_user_set_unique"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Rating, cls).from_db(db, field_names, values)
+        instance._loaded_rating = (instance.__dict__.get("set_id"), instance.__dict__.get("rate"))
+        return instance
+
+
+def change_rating_aggregates(flashcard_set_id, count_delta, rate_delta):
+    flashcard_sets = FlashcardsSet.objects.filter(id=flashcard_set_id)
+    if shards.is_enabled():
+        using = shards.locate(FlashcardsSet, flashcard_set_id)
+        if using is None:
+            return
+        flashcard_sets = flashcard_sets.using(using)
+    new_count = F("rating_count") + count_delta
+    new_sum = F("rating_sum") + rate_delta
+    flashcard_sets.update(
+        rating_count=new_count,
+        rating_sum=new_sum,
+        rating_avg=Case(
+            When(rating_count=-count_delta, then=Value(0.0)),
+            default=Cast(new_sum, models.FloatField()) / new_count,
+        ),
+    )
+    bump_set_listings(flashcard_sets.values_list(*LISTING_FIELDS))
+
+
+@receiver(post_save, sender=Rating)
+def aggregate_saved_rating(sender, instance=None, created=False, **kwargs):
+    # zmiana oceny (np. w panelu administracyjnym) przenosi różnicę względem wczytanych wartości
+    loaded_set_id, loaded_rate = getattr(instance, "_loaded_rating", (None, None))
+    if created:
+        change_rating_aggregates(instance.set_id, 1, instance.rate)
+    elif loaded_set_id is not None and loaded_set_id != instance.set_id:
+        change_rating_aggregates(loaded_set_id, -1, -loaded_rate)
+        change_rating_aggregates(instance.set_id, 1, instance.rate)
+    elif loaded_rate is not None and loaded_rate != instance.rate:
+        change_rating_aggregates(instance.set_id, 0, instance.rate - loaded_rate)
+    instance._loaded_rating = (instance.set_id, instance.rate)
+
+
+@receiver(post_delete, sender=Rating)
+def aggregate_deleted_rating(sender, instance=None, origin=None, **kwargs):
+    set_id, rate = getattr(instance, "_loaded_rating", (instance.set_id, instance.rate))
+    if not deleted_with_set(set_id, origin):
+        change_rating_aggregates(set_id, -1, -rate)
+
+
+class ReviewState(models.Model):
+    # stan powtórek SM-2 fiszki dla użytkownika; łatwość w setnych, odstęp w dniach
+    MIN_EASE = 130
+    # stany powtórek leżą razem z fiszkami autora, bo tylko autor ma je w kolejce
+    shard_key = "user"
+
+    # osobny indeks na user jest zbędny, oba indeksy złożone zaczynają się od tej kolumny
+    user = models.ForeignKey(User, models.CASCADE, db_index=False, db_constraint=CROSS_DATABASE_CONSTRAINTS)
+    flashcard = models.ForeignKey(Flashcard, models.CASCADE)
+    interval = models.PositiveIntegerField(default=0)
+    ease = models.PositiveSmallIntegerField(default=250)
+    repetitions = models.PositiveSmallIntegerField(default=0)
+    due_at = models.DateTimeField(default=timezone.now)
+
+    objects = shards.ShardedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "due_at"], name="review_due_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "flashcard"], name="review_user_flashcard_unique"),
+        ]
+
+    def schedule(self, quality, now):
+        # quality od 0 (brak odpowiedzi) do 5 (bezbłędnie), jak w SM-2
+        if quality >= 3:
+            if self.repetitions == 0:
+                self.interval = 1
+            elif self.repetitions == 1:
+                self.interval = 6
+            else:
+                self.interval = round(self.interval * self.ease / 100)
+            self.repetitions += 1
+        else:
+            self.repetitions = 0
+            self.interval = 1
+        self.ease = max(self.MIN_EASE, self.ease + 10 - (5 - quality) * (8 + (5 - quality) * 2))
+        self.due_at = now + timedelta(days=self.interval)
+
+    @staticmethod
+    def due(user, limit, now=None):
+        queryset = ReviewState.objects.for_author(user.id).filter(user=user, due_at__lte=now or timezone.now())
+        queryset = queryset.order_by("due_at")
+        return queryset.select_related("flashcard").only(
+            "flashcard__id", "flashcard__front", "flashcard__back", "interval", "ease", "repetitions", "due_at"
+        )[:limit]
+
+    @staticmethod
+    def answer_reviews(user, answers):
+        flashcard_ids = {answer.get("flashcard") for answer in answers}
+        states = ReviewState.objects.for_author(user.id).filter(user=user, flashcard_id__in=flashcard_ids)
+        states = {state.flashcard_id: state for state in states}
+        results = []
+        now = timezone.now()
+        for answer in answers:
+            state = states.get(answer.get("flashcard"))
+            if state is None:
+                results.append({"flashcard": answer.get("flashcard"), "error": "Fiszka nie istnieje."})
+                continue
+            state.schedule(answer.get("quality"), now)
+            results.append({"flashcard": state.flashcard_id, "interval": state.interval, "due_at": state.due_at})
+        ReviewState.objects.bulk_update(states.values(), ["interval", "ease", "repetitions", "due_at"])
+        return results
+
+
+@receiver(post_save, sender=Flashcard)
+def schedule_new_flashcard(sender, instance=None, created=False, **kwargs):
+    if created:
+        ReviewState.objects.create(user_id=instance.author_id, flashcard=instance)
+
 
 class Log(models.Model):
     ACTIONS = [
@@ -86,100 +395,299 @@ class Log(models.Model):
         ("B2", "Utworzono zestaw."),
     ]
     user = models.ForeignKey(User, models.CASCADE)
-    timestamp = models.DateTimeField(auto_created=True, auto_now=True)
+    # czas zdarzenia, a nie zapisu, bo zdarzenia trafiają do bazy z bufora (api.audit)
+    timestamp = models.DateTimeField(default=timezone.now)
     action = models.CharField(max_length=2, choices=ACTIONS)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["timestamp"], name="log_timestamp_idx"),
+        ]
+
     def __str__(self):
         return self.timestamp
 
 
+class DailyActivity(models.Model):
+    # dzienne liczniki zdarzeń Log, które przeżywają usuwanie starych wierszy (compact_logs)
+    user = models.ForeignKey(User, models.CASCADE, db_index=False)
+    day = models.DateField()
+    action = models.CharField(max_length=2, choices=Log.ACTIONS)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "day", "action"], name="daily_activity_unique"),
+        ]
+
+
+class LogRollup(models.Model):
+    # jedyny wiersz z id ostatniego zdarzenia Log wliczonego do DailyActivity
+    last_log_id = models.BigIntegerField(default=0)
+
+
+def sample_quiz(flashcard_ids, question_count=None, rng=random):
+    # zwraca listę par (id fiszki, [id fiszek z błędnymi odpowiedziami])
+    flashcard_ids = list(flashcard_ids)
+    rng.shuffle(flashcard_ids)
+    sample = []
+    for index, flashcard_id in enumerate(flashcard_ids[:question_count]):
+        distractor_ids = []
+        # indeksy z zakresu bez bieżącej fiszki, przesunięte o jeden za nią
+        for other in rng.sample(range(len(flashcard_ids) - 1), 3):
+            if other >= index:
+                other += 1
+            distractor_ids.append(flashcard_ids[other])
+        sample.append((flashcard_id, distractor_ids))
+    return sample
+
+
 class Quiz(models.Model):
-    flashcards_set = models.ForeignKey(FlashcardsSet, on_delete=models.CASCADE)
-    author = models.ForeignKey(User, on_delete=models.CASCADE)
+    # quiz leży u autora quizu, a zestaw, z którego powstał, może leżeć na innym shardzie
+    shard_key = "author"
+    cross_shard_fields = ("flashcards_set",)
+
+    flashcards_set = models.ForeignKey(FlashcardsSet, on_delete=models.CASCADE,
+                                       db_constraint=CROSS_DATABASE_CONSTRAINTS)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=CROSS_DATABASE_CONSTRAINTS)
     questions = models.ManyToManyField("QuizQuestion", related_name="quiz_questions")
     timestamp = models.DateTimeField(auto_created=True, auto_now=True)
     is_finished = models.BooleanField(default=False)
     score = models.PositiveSmallIntegerField(default=0)
+    question_count = models.PositiveSmallIntegerField(null=True, blank=True)
+    payload = models.JSONField(null=True, blank=True, editable=False)
+
+    objects = shards.ShardedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["author", "timestamp"], name="quiz_author_timestamp_idx"),
+        ]
 
     def __str__(self):
         return str(self.id)
 
-    def generate_quiz(self):
-        if self.flashcards_set.flashcard_count >= 4:
-            shuffled_set = self.flashcards_set.flashcard_set.order_by('?')
-            for flashcard in shuffled_set:
-                shuffled_temp = list(filter(lambda x: x != flashcard, shuffled_set))
-                question = QuizQuestion.objects.create(text=flashcard.front, quiz=self)
-                answers = ["A", "B", "C", "D"]
-                random_correct_answer = answers.pop(random.randint(0, len(answers) - 1))
-                question.correct_answer = random_correct_answer
-                correct = QuizAnswer.objects.create(question=question, text=flashcard.back, letter=random_correct_answer)
-                question.answers.add(correct)
-                for answer in answers:
-                    random_answer = random.choice(shuffled_temp)
-                    a = QuizAnswer.objects.create(question=question, text=random_answer.back,
-                                                  letter=answer)
-                    shuffled_temp.remove(random_answer)
-                    question.answers.add(a)
-                question.save()
-                self.questions.add(question)
-
-            self.serialize_quiz()
-        else:
+    def generate_quiz(self, rng=random, progress=None):
+        flashcard_ids = list(self.flashcards_set.flashcard_set.values_list("id", flat=True))
+        if len(flashcard_ids) < 4:
             return {"message": "Not enough flashcards in set."}
+        sample = sample_quiz(flashcard_ids, self.question_count, rng)
+
+        flashcards = Flashcard.objects.for_author(self.flashcards_set.author_id)
+        flashcards = flashcards.filter(flashcard_set_id=self.flashcards_set_id).only("front", "back")
+        needed_ids = {flashcard_id for question_id, distractor_ids in sample
+                      for flashcard_id in (question_id, *distractor_ids)}
+        if len(needed_ids) < len(flashcard_ids):
+            flashcards = flashcards.in_bulk(needed_ids)
+        else:
+            flashcards = {flashcard.id: flashcard for flashcard in flashcards}
+        if progress is not None:
+            progress(30)
+
+        questions = []
+        answers = []
+        for question_id, distractor_ids in sample:
+            flashcard = flashcards[question_id]
+            letters = ["A", "B", "C", "D"]
+            correct_letter = letters.pop(rng.randint(0, len(letters) - 1))
+            question = QuizQuestion(text=flashcard.front, quiz=self, correct_answer=correct_letter)
+            questions.append(question)
+            answers.append(QuizAnswer(question=question, text=flashcard.back, letter=correct_letter))
+            for letter, distractor_id in zip(letters, distractor_ids):
+                answers.append(QuizAnswer(question=question, text=flashcards[distractor_id].back, letter=letter))
+        if progress is not None:
+            progress(60)
+
+        db = self._state.db
+        with transaction.atomic(using=db):
+            QuizQuestion.objects.using(db).bulk_create(questions)
+            QuizAnswer.objects.using(db).bulk_create(answers)
+            QuizQuestion.answers.through.objects.using(db).bulk_create([
+                QuizQuestion.answers.through(quizquestion_id=answer.question_id, quizanswer_id=answer.id)
+                for answer in answers
+            ])
+            Quiz.questions.through.objects.using(db).bulk_create([
+                Quiz.questions.through(quiz_id=self.id, quizquestion_id=question.id)
+                for question in questions
+            ])
+
+            payload = [{"quiz_id": self.id}]
+            for index, question in enumerate(questions):
+                question_answers = sorted(answers[index * 4:index * 4 + 4], key=lambda answer: answer.letter)
+                payload.append({"id": question.id, "text": question.text, "answers": [
+                    {"letter": answer.letter, "text": answer.text} for answer in question_answers
+                ]})
+            self.store_payload(payload)
 
     def serialize_quiz(self):
+        if self.payload is not None:
+            return self.payload
         questions = [{"quiz_id": self.id}]
-        for question in self.questions.all():
+        ordered_answers = models.Prefetch("answers", queryset=QuizAnswer.objects.order_by("letter"))
+        for question in self.questions.prefetch_related(ordered_answers):
             answers = []
-            for answer in question.answers.all().order_by("letter"):
+            for answer in question.answers.all():
                 answers.append({"letter": answer.letter, "text": answer.text})
             questions.append({"id": question.id, "text": question.text, "answers": answers})
+        self.store_payload(questions)
         return questions
 
-    def check_quiz(self, answers):
-        if self.score != 0:
-            self.score = 0
-        raport = {}
-        answers_dict = json.loads(answers.get("answers"))
-        for question in self.questions.all():
-            if len(answers_dict.keys()) == len(self.questions.all()):
-                if question.is_correct(answers_dict.get(str(question.id))):
-                    raport[question.id] = "Correct"
-                    self.score += 1
-                else:
-                    raport[question.id] = "Incorrect"
-            else:
-                return {"error": "Nie wszystkie odpowiedzi zaznaczone."}
-        raport["final_score"] = self.score
-        self.is_finished = True
-        self.save()
+    def store_payload(self, payload):
+        self.payload = payload
+        Quiz.objects.using(self._state.db).filter(id=self.id).update(payload=payload)
+
+    def check_quiz(self, answers_dict):
+        correct_answers = list(self.questions.values_list("id", "correct_answer"))
+        raport = grade_quiz(correct_answers, answers_dict)
+        if raport.get("error") is None:
+            self.score = raport["final_score"]
+            self.is_finished = True
+            self.save(update_fields=["score", "is_finished", "timestamp"])
         return raport
 
+    @staticmethod
+    def check_quizzes(author, submissions):
+        answers_by_quiz = {}
+        for submission in submissions:
+            answers_by_quiz[submission.get("quiz_id")] = submission.get("answers")
+        quizzes = Quiz.objects.for_author(author.id).filter(id__in=answers_by_quiz.keys(), author=author)
+        quizzes = quizzes.only("id").in_bulk()
+        correct_answers = {quiz_id: [] for quiz_id in quizzes}
+        rows = Quiz.questions.through.objects.using(shards.author_db(author.id)).filter(quiz_id__in=quizzes.keys())
+        rows = rows.order_by("id").values_list("quiz_id", "quizquestion_id", "quizquestion__correct_answer")
+        for quiz_id, question_id, correct_answer in rows:
+            correct_answers[quiz_id].append((question_id, correct_answer))
+
+        results = []
+        finished = []
+        now = timezone.now()
+        for quiz_id, answers_dict in answers_by_quiz.items():
+            quiz = quizzes.get(quiz_id)
+            if quiz is None:
+                results.append({"quiz_id": quiz_id, "error": "Quiz nie istnieje."})
+                continue
+            raport = grade_quiz(correct_answers[quiz_id], answers_dict)
+            if raport.get("error") is None:
+                quiz.score = raport["final_score"]
+                quiz.is_finished = True
+                quiz.timestamp = now
+                finished.append(quiz)
+            results.append({"quiz_id": quiz_id, **raport})
+        Quiz.objects.bulk_update(finished, ["score", "is_finished", "timestamp"])
+        return results
+
+
+def grade_quiz(correct_answers, answers_dict):
+    if correct_answers and len(answers_dict) != len(correct_answers):
+        return {"error": "Nie wszystkie odpowiedzi zaznaczone."}
+    raport = {}
+    score = 0
+    for question_id, correct_answer in correct_answers:
+        if answers_dict.get(str(question_id)) == correct_answer:
+            raport[question_id] = "Correct"
+            score += 1
+        else:
+            raport[question_id] = "Incorrect"
+    raport["final_score"] = score
+    return raport
+
 
 @receiver(post_save, sender=Quiz)
 def generate_quiz(sender, instance=None, created=False, **kwargs):
-    if created:
+    if created and not getattr(instance, "defer_generation", False):
         instance.generate_quiz()
 
 
+class QuizJob(models.Model):
+    shard_parent = "quiz"
+
+    JOB_STATUSES = [
+        ("pending", "Oczekuje"),
+        ("running", "W trakcie"),
+        ("done", "Zakończony"),
+        ("failed", "Nieudany"),
+    ]
+    quiz = models.OneToOneField(Quiz, on_delete=models.CASCADE, related_name="job")
+    status = models.CharField(max_length=7, choices=JOB_STATUSES, default="pending")
+    # postęp w procentach; każdy zapis odświeża też updated, po którym rozpoznajemy porzucone zadania
+    progress = models.PositiveSmallIntegerField(default=0)
+    payload = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    objects = shards.ShardedManager()
+
+    def __str__(self):
+        return str(self.id)
+
+
 class QuizAnswer(models.Model):
+    shard_parent = "question"
+
     question = models.ForeignKey("QuizQuestion", on_delete=models.CASCADE)
     text = models.CharField(max_length=255)
     letter = models.CharField(max_length=1)
 
+    objects = shards.ShardedManager()
+
     def __str__(self):
         return self.text
 
 
 class QuizQuestion(models.Model):
+    shard_parent = "quiz"
+
     text = models.CharField(max_length=255)
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
     answers = models.ManyToManyField(QuizAnswer)
     correct_answer = models.CharField(max_length=1)
 
+    objects = shards.ShardedManager()
+
     def __str__(self):
         return self.text
 
     def is_correct(self, answer):
         return self.correct_answer == answer
+
+
+class ShardSequence(models.Model):
+    # ostatnie id nadane w tabeli podzielonego modelu na tym shardzie (api.shards.allocate_ids)
+    name = models.CharField(max_length=64, primary_key=True)
+    last_id = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name}@{self.last_id}"
+
+
+def assign_shard_id(sender, instance=None, using=None, **kwargs):
+    if shards.is_enabled() and instance._state.adding and instance.pk is None:
+        instance.pk = shards.allocate_ids(sender, using, 1)[0]
+
+
+for sharded_model in (FlashcardsSet, Flashcard, Quiz, QuizQuestion, QuizAnswer, QuizJob, ReviewState):
+    pre_save.connect(assign_shard_id, sender=sharded_model)
+
+
+@receiver(post_delete, sender=FlashcardsSet)
+def delete_cross_shard_set_rows(sender, instance=None, using=None, **kwargs):
+    # kaskada usuwa tylko wiersze z bazy zestawu; oceny leżą w bazie domyślnej, a quizy u swoich autorów
+    if not shards.is_enabled():
+        return
+    if using != DEFAULT_DB_ALIAS:
+        Rating.objects.filter(set_id=instance.id).delete()
+    for alias in shards.shard_aliases():
+        if alias != using:
+            Quiz.objects.using(alias).filter(flashcards_set_id=instance.id).delete()
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_author_rows(sender, instance=None, using=None, **kwargs):
+    db = shards.author_db(instance.id)
+    if db is None or db == using:
+        return
+    FlashcardsSet.objects.using(db).filter(author_id=instance.id).delete()
+    Quiz.objects.using(db).filter(author_id=instance.id).delete()
+    ReviewState.objects.using(db).filter(user_id=instance.id).delete()
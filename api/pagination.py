@@ -0,0 +1,9 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = getattr(settings, "API_PAGE_SIZE", 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, "API_MAX_PAGE_SIZE", 100)
@@ -0,0 +1,28 @@
+import csv
+import io
+import json
+
+from rest_framework import renderers
+
+
+# eksport zwraca StreamingHttpResponse, więc te klasy renderują tylko odpowiedzi z błędami
+class CSVRenderer(renderers.BaseRenderer):
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(data.keys())
+        writer.writerow(data.values())
+        return buffer.getvalue()
+
+
+class JSONLRenderer(renderers.BaseRenderer):
+    media_type = "application/x-ndjson"
+    format = "jsonl"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False) + "\n"
@@ -0,0 +1,156 @@
+import contextvars
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import metrics
+
+_routing = contextvars.ContextVar("replica_routing", default=None)
+
+
+class RequestRouting:
+    # replika wybrana dla bieżącego żądania; po pierwszym zapisie odczyty wracają do bazy głównej
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+
+
+class ReplicaStats:
+    def __init__(self):
+        self.reads = {}
+        self.pinned = 0
+        self._lock = threading.Lock()
+
+    def routed(self, alias):
+        with self._lock:
+            self.reads[alias] = self.reads.get(alias, 0) + 1
+
+    def pin(self):
+        with self._lock:
+            self.pinned += 1
+
+
+replica_stats = ReplicaStats()
+
+
+def replica_aliases():
+    return list(getattr(settings, "DATABASE_REPLICAS", []))
+
+
+def pin_key(user_id):
+    return f"replica-pin:{user_id}"
+
+
+def pin_cache():
+    # przypięcie musi widzieć każdy proces serwera, bo kolejne żądanie użytkownika może trafić do innego
+    return caches["replica_pins"]
+
+
+def pin_to_primary(user_id):
+    # przez REPLICA_STICKY_SECONDS po zapisie użytkownik czyta z bazy głównej, zanim repliki nadrobią opóźnienie
+    pin_cache().set(pin_key(user_id), True, timeout=getattr(settings, "REPLICA_STICKY_SECONDS", 5))
+    replica_stats.pin()
+
+
+def is_pinned(user_id):
+    return pin_cache().get(pin_key(user_id)) is not None
+
+
+def use_replica(user):
+    routing = _routing.get()
+    aliases = replica_aliases()
+    if routing is None or not aliases or routing.wrote or (user.is_authenticated and is_pinned(user.id)):
+        return None
+    routing.replica = random.choice(aliases)
+    replica_stats.routed(routing.replica)
+    return routing.replica
+
+
+@contextmanager
+def request_routing():
+    routing = RequestRouting()
+    token = _routing.set(routing)
+    try:
+        yield routing
+    finally:
+        _routing.reset(token)
+
+
+@contextmanager
+def primary():
+    routing = _routing.get()
+    replica = routing.replica if routing is not None else None
+    if routing is not None:
+        routing.replica = None
+    try:
+        yield
+    finally:
+        if routing is not None and not routing.wrote:
+            routing.replica = replica
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None or routing.wrote:
+            return None
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+            routing.replica = None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # repliki są kopiami bazy głównej razem ze schematem
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    replica_actions = ("list", "retrieve")
+
+    def initial(self, request, *args, **kwargs):
+        # uwierzytelnianie zawsze czyta z bazy głównej, więc nowy token działa od razu
+        super(ReplicaReadMixin, self).initial(request, *args, **kwargs)
+        if self.action in self.replica_actions and request.method in ("GET", "HEAD"):
+            use_replica(request.user)
+
+
+def copy_sqlite_database(source_alias, target_alias):
+    # kopia przez API backupu SQLite jest spójna nawet wtedy, gdy baza główna jest w trakcie zapisu
+    source = connections[source_alias]
+    source.ensure_connection()
+    target = sqlite3.connect(connections[target_alias].settings_dict["NAME"])
+    try:
+        source.connection.backup(target)
+    finally:
+        target.close()
+
+
+def collect_replica_metrics():
+    with replica_stats._lock:
+        reads = [({"database": alias}, count) for alias, count in sorted(replica_stats.reads.items())]
+        pinned = replica_stats.pinned
+    return [
+        ("flashwise_replica_requests_total", "counter", "Read requests routed to a replica.", reads),
+        ("flashwise_replica_pins_total", "counter",
+         "Requests that wrote and pinned their user to the primary.", [({}, pinned)]),
+    ]
+
+
+metrics.registry.register(collect_replica_metrics)
@@ -0,0 +1,122 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import models
+from . import shards
+
+# wiersze indeksu mają rowid wyliczany z id obiektu, dzięki czemu aktualizacja
+# i usuwanie są wyszukiwaniem po kluczu, a nie skanem tabeli FTS; przy podziale danych na shardy
+# każdy shard ma własny indeks swoich zestawów i fiszek
+def is_supported(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == "sqlite"
+
+
+def databases():
+    return shards.shard_aliases() or [DEFAULT_DB_ALIAS]
+
+
+def set_rowid(set_id):
+    return set_id * 2
+
+
+def flashcard_rowid(flashcard_id):
+    return flashcard_id * 2 + 1
+
+
+def index_rows(rows, using=DEFAULT_DB_ALIAS):
+    rows = list(rows)
+    if not rows or not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany("DELETE FROM api_searchindex WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(
+            "INSERT INTO api_searchindex (rowid, set_id, title, body) VALUES (%s, %s, %s, %s)", rows
+        )
+
+
+def index_sets(flashcard_sets, using=None):
+    index_rows(((set_rowid(s.id), s.id, s.name, "") for s in flashcard_sets), using or DEFAULT_DB_ALIAS)
+
+
+def index_flashcards(flashcards, using=None):
+    index_rows(((flashcard_rowid(f.id), f.flashcard_set_id, f.front, f.back) for f in flashcards),
+               using or DEFAULT_DB_ALIAS)
+
+
+def unindex(rowids, using=DEFAULT_DB_ALIAS):
+    if not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany("DELETE FROM api_searchindex WHERE rowid = %s", [(rowid,) for rowid in rowids])
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute("DELETE FROM api_searchindex")
+        cursor.execute(
+            "INSERT INTO api_searchindex (rowid, set_id, title, body) "
+            "SELECT id * 2, id, name, '' FROM api_flashcardsset"
+        )
+        cursor.execute(
+            "INSERT INTO api_searchindex (rowid, set_id, title, body) "
+            "SELECT id * 2 + 1, flashcard_set_id, front, back FROM api_flashcard"
+        )
+        cursor.execute("INSERT INTO api_searchindex (api_searchindex) VALUES ('optimize')")
+
+
+def build_query(text):
+    # każde słowo jako fraza z prefiksem, żeby znaki specjalne FTS5 nie psuły zapytania
+    words = [word.replace('"', '""') for word in text.split()]
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search(text, user, limit=20):
+    query = build_query(text)
+    if not query:
+        return []
+    rows = []
+    for using in databases():
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                "SELECT bm25(api_searchindex, 0.0, 2.0, 1.0) AS rank, api_searchindex.rowid, "
+                "api_searchindex.set_id, api_searchindex.title, api_searchindex.body "
+                "FROM api_searchindex "
+                "JOIN api_flashcardsset ON api_flashcardsset.id = api_searchindex.set_id "
+                "WHERE api_searchindex MATCH %s "
+                "AND (api_flashcardsset.status = 'public' OR api_flashcardsset.author_id = %s) "
+                "ORDER BY rank "
+                "LIMIT %s",
+                [query, user.id, limit],
+            )
+            rows += cursor.fetchall()
+    # bm25 liczy statystyki osobno dla indeksu każdego sharda, więc scalanie wyników jest przybliżone
+    rows = sorted(rows, key=lambda row: row[0])[:limit]
+    results = []
+    for _, rowid, set_id, title, body in rows:
+        if rowid % 2 == 0:
+            results.append({"type": "set", "id": rowid // 2, "name": title})
+        else:
+            results.append({"type": "flashcard", "id": rowid // 2, "flashcard_set": set_id,
+                            "front": title, "back": body})
+    return results
+
+
+@receiver(post_save, sender=models.FlashcardsSet)
+def index_saved_set(sender, instance=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    index_sets([instance], using)
+
+
+@receiver(post_delete, sender=models.FlashcardsSet)
+def unindex_deleted_set(sender, instance=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    unindex([set_rowid(instance.id)], using)
+
+
+@receiver(post_save, sender=models.Flashcard)
+def index_saved_flashcard(sender, instance=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    index_flashcards([instance], using)
+
+
+@receiver(post_delete, sender=models.Flashcard)
+def unindex_deleted_flashcard(sender, instance=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    unindex([flashcard_rowid(instance.id)], using)
@@ -1,37 +1,93 @@
+import copy
+import json
+
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
+from rest_framework.fields import empty
 
 from . import models
-
-
-class FlashcardSerializer(serializers.ModelSerializer):
+from . import shards
+
+
+class ContentHashSerializerMixin:
+    duplicate_message = None
+
+    def content_hash_exists(self, data):
+        candidate = copy.copy(self.instance) if self.instance is not None else self.Meta.model()
+        for field, value in data.items():
+            setattr(candidate, field, value)
+        # obiekt trafi na shard autora, a unikalny indeks skrótu też działa tylko w obrębie jednej bazy
+        duplicates = self.Meta.model.objects.for_author(candidate.author_id)
+        duplicates = duplicates.filter(content_hash=candidate.compute_content_hash())
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        return duplicates.exists()
+
+    def raise_duplicate(self, validated_data):
+        # jako duplikat zgłaszamy tylko naruszenie unikalnego skrótu, np. przy równoległym zapisie;
+        # inne błędy spójności (choćby klucz obcy) nie mogą udawać duplikatu
+        if self.content_hash_exists(validated_data):
+            raise serializers.ValidationError(self.duplicate_message)
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic(using=shards.author_db(validated_data["author"].id)):
+                return super(ContentHashSerializerMixin, self).create(validated_data)
+        except IntegrityError:
+            self.raise_duplicate(validated_data)
+            raise
+
+    def update(self, instance, validated_data):
+        try:
+            with transaction.atomic(using=shards.author_db(instance.author_id)):
+                return super(ContentHashSerializerMixin, self).update(instance, validated_data)
+        except IntegrityError:
+            self.raise_duplicate(validated_data)
+            raise
+
+
+class FlashcardSerializer(ContentHashSerializerMixin, serializers.ModelSerializer):
     author = serializers.HiddenField(
         default=serializers.CurrentUserDefault()
     )
 
+    duplicate_message = "Flashcard already exists."
+
     class Meta:
         model = models.Flashcard
         fields = ('id', 'author', 'front', 'back', 'flashcard_set')
 
     def validate(self, data):
         data = super(FlashcardSerializer, self).validate(data)
-        if models.Flashcard.objects.filter(**data).exists():
-            raise serializers.ValidationError("Flashcard already exists.")
+        author_id = data["author"].id if "author" in data else self.instance.author_id
+        flashcard_set = data.get("flashcard_set") or self.instance.flashcard_set
+        # fiszka leży na shardzie swojego autora, a klucz obcy do zestawu działa tylko w obrębie jednej bazy
+        if shards.author_db(author_id) != shards.author_db(flashcard_set.author_id):
+            raise serializers.ValidationError(
+                {"flashcard_set": "Flashcards set is stored on a different shard than your flashcards."}
+            )
+        if self.content_hash_exists(data):
+            raise serializers.ValidationError(self.duplicate_message)
         return data
 
 
-class FlashcardSetSerializer(serializers.ModelSerializer):
+class FlashcardSetSerializer(ContentHashSerializerMixin, serializers.ModelSerializer):
     author = serializers.HiddenField(
         default=serializers.CurrentUserDefault()
     )
 
+    duplicate_message = "Flashcards set already exists."
+
     class Meta:
         model = models.FlashcardsSet
-        fields = ('id', 'name', 'author', 'status', 'is_premium', 'tag', 'category')
+        fields = ('id', 'name', 'author', 'status', 'is_premium', 'tag', 'category', 'flashcard_count',
+                  'rating_count', 'rating_avg')
+        read_only_fields = ('flashcard_count', 'rating_count', 'rating_avg')
 
     def validate(self, data):
         data = super(FlashcardSetSerializer, self).validate(data)
-        if models.FlashcardsSet.objects.filter(**data).exists():
-            raise serializers.ValidationError("Flashcards set already exists.")
+        if self.content_hash_exists(data):
+            raise serializers.ValidationError(self.duplicate_message)
         return data
 
 
@@ -70,6 +126,62 @@ class QuizSerializer(serializers.ModelSerializer):
         default=serializers.CurrentUserDefault()
     )
 
+    question_count = serializers.IntegerField(min_value=1, max_value=32767, required=False)
+
     class Meta:
         model = models.Quiz
-        fields = ('id', 'flashcards_set', 'author', 'timestamp', 'is_finished', 'score')
\ No newline at end of file
+        fields = ('id', 'flashcards_set', 'author', 'timestamp', 'is_finished', 'score', 'question_count')
+
+
+class AnswersField(serializers.DictField):
+    child = serializers.CharField(max_length=1)
+
+    def get_value(self, dictionary):
+        # formularz przesyła odpowiedzi jako jeden napis JSON, a nie pola "answers.<id>"
+        return dictionary.get(self.field_name, empty)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                self.fail('not_a_dict', input_type=type(data).__name__)
+        return super(AnswersField, self).to_internal_value(data)
+
+
+class QuizSubmissionSerializer(serializers.Serializer):
+    quiz_id = serializers.IntegerField()
+    answers = AnswersField()
+
+
+class QuizBatchSerializer(serializers.Serializer):
+    quizzes = QuizSubmissionSerializer(many=True)
+
+
+class AnswerKeySubmissionSerializer(QuizSubmissionSerializer):
+    quiz_id = None
+    answer_key = serializers.CharField()
+
+
+class ReviewStateSerializer(serializers.ModelSerializer):
+    front = serializers.CharField(source='flashcard.front', read_only=True)
+    back = serializers.CharField(source='flashcard.back', read_only=True)
+
+    class Meta:
+        model = models.ReviewState
+        fields = ('flashcard', 'front', 'back', 'interval', 'ease', 'repetitions', 'due_at')
+
+
+class ReviewAnswerSerializer(serializers.Serializer):
+    flashcard = serializers.IntegerField()
+    quality = serializers.IntegerField(min_value=0, max_value=5)
+
+
+class ReviewAnswersSerializer(serializers.Serializer):
+    answers = ReviewAnswerSerializer(many=True)
+
+
+class QuizJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.QuizJob
+        fields = ('id', 'quiz', 'status', 'progress', 'payload', 'error', 'created', 'finished')
@@ -0,0 +1,534 @@
+import itertools
+import math
+import random
+import statistics
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models import Avg, Count, F, Max, Min, StdDev, Sum, Variance, prefetch_related_objects
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.expressions import OrderBy, Star
+from django.db.models.query import FlatValuesListIterable, ModelIterable, NamedValuesListIterable, ValuesIterable
+from django.db.models.utils import create_namedtuple_class
+
+# każdy shard nadaje nowym wierszom id z własnego przedziału (ShardSequence), więc id są unikalne
+# we wszystkich bazach i nie zmieniają się przy przenoszeniu autora; 2**40 na shard mieści się
+# w liczbach całkowitych JavaScriptu nawet dla tysięcy shardów
+SHARD_ID_SPAN = 2 ** 40
+
+
+def shard_aliases():
+    return list(getattr(settings, "FLASHCARD_SHARDS", []))
+
+
+def is_enabled():
+    return bool(shard_aliases())
+
+
+def cross_database_constraints():
+    # przy podziale danych klucze obce do użytkowników, kategorii, tagów i zestawów mogą wskazywać
+    # wiersze w innej bazie, więc pola tych kluczy (i migracja 0025) nie zakładają wtedy więzów
+    return not is_enabled()
+
+
+def shard_for(author_id):
+    aliases = shard_aliases()
+    return aliases[author_id % len(aliases)]
+
+
+def author_db(author_id):
+    # baza z danymi autora albo None (domyślna), gdy dane nie są podzielone
+    return shard_for(author_id) if is_enabled() else None
+
+
+def is_sharded(model):
+    # tabele pośrednie ManyToMany leżą razem z modelem, który je definiuje
+    model = model._meta.auto_created or model
+    return hasattr(model, "shard_key") or hasattr(model, "shard_parent")
+
+
+def colocated(model, other):
+    # wiersze powiązane przez cross_shard_fields mogą leżeć u różnych autorów
+    for owner, related in ((model, other), (other, model)):
+        for name in getattr(owner, "cross_shard_fields", ()):
+            if owner._meta.get_field(name).related_model is related:
+                return False
+    return True
+
+
+def shard_of(instance):
+    # baza, na której leży albo ma zostać zapisany wiersz, albo None, jeśli nie da się jej ustalić
+    model = type(instance)
+    if not instance._state.adding and instance._state.db is not None:
+        return instance._state.db
+    if hasattr(model, "shard_key"):
+        author_id = getattr(instance, model._meta.get_field(model.shard_key).attname)
+        return shard_for(author_id) if author_id is not None else None
+    field = model._meta.get_field(model.shard_parent)
+    if field.is_cached(instance):
+        return shard_of(field.get_cached_value(instance))
+    return None
+
+
+def shard_from_hints(model, hints):
+    instance = hints.get("instance")
+    if instance is None:
+        return None
+    if is_sharded(type(instance)):
+        return shard_of(instance) if colocated(model, type(instance)) else None
+    # np. user.flashcardsset_set: wiersze autora leżą na jego shardzie
+    if hasattr(model, "shard_key") and isinstance(instance, model._meta.get_field(model.shard_key).related_model):
+        return shard_for(instance.pk)
+    return None
+
+
+def locate(model, pk):
+    # shard z wierszem o danym kluczu albo None
+    for alias in shard_aliases():
+        if model.objects.using(alias).filter(pk=pk).exists():
+            return alias
+    return None
+
+
+class ShardRouter:
+    def db_for_read(self, model, **hints):
+        if not is_enabled():
+            return None
+        if is_sharded(model):
+            return shard_from_hints(model, hints) or DEFAULT_DB_ALIAS
+        # np. set.category: dane wspólne zawsze leżą w bazie domyślnej, a nie w bazie obiektu z podpowiedzi
+        instance = hints.get("instance")
+        if instance is not None and is_sharded(type(instance)):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        # zapisy bez wskazanego sharda obsługuje ShardedQuerySet, a save() podaje sam obiekt w podpowiedzi
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_enabled() and (is_sharded(type(obj1)) or is_sharded(type(obj2))):
+            return True
+        return None
+
+
+def combined_aggregate(aggregate, prefix):
+    # częściowe agregaty liczone osobno na każdym shardzie i funkcja, która składa z nich wynik
+    if not isinstance(aggregate, (Count, Sum, Min, Max, Avg, StdDev, Variance)) or (
+        aggregate.distinct and not isinstance(aggregate, (Min, Max))
+    ):
+        raise ValueError(f"{aggregate!r} cannot be combined across shards; use for_author() or using().")
+    source = aggregate.get_source_expressions()[0]
+    names = {part: f"{prefix}_{part}" for part in ("value", "sum", "squares", "count")}
+
+    def values(results, part):
+        return [result[names[part]] for result in results if result[names[part]] is not None]
+
+    if isinstance(aggregate, Count):
+        return {names["value"]: Count(source, filter=aggregate.filter)}, lambda results: sum(values(results, "value"))
+    if isinstance(aggregate, (Sum, Min, Max)):
+        combine = {Sum: sum, Min: min, Max: max}[type(aggregate)]
+        parts = {names["value"]: type(aggregate)(source, filter=aggregate.filter)}
+        return parts, lambda results: combine(values(results, "value")) if values(results, "value") else None
+    parts = {
+        names["sum"]: Sum(source, filter=aggregate.filter),
+        names["count"]: Count(source, filter=aggregate.filter),
+    }
+    if isinstance(aggregate, Avg):
+        def average(results):
+            count = sum(values(results, "count"))
+            return sum(values(results, "sum")) / count if count else None
+
+        return parts, average
+    parts[names["squares"]] = Sum(source * source, filter=aggregate.filter)
+    sample = int(aggregate.function.endswith("SAMP"))
+
+    def variance(results):
+        count = sum(values(results, "count"))
+        if count - sample <= 0:
+            return None
+        total = float(sum(values(results, "sum")))
+        result = max(float(sum(values(results, "squares"))) - total * total / count, 0) / (count - sample)
+        return math.sqrt(result) if isinstance(aggregate, StdDev) else result
+
+    return parts, variance
+
+
+def aggregate_rows(aggregate, rows):
+    # agregat policzony w Pythonie na scalonych wierszach values(), np. z grup albo DISTINCT
+    source = aggregate.get_source_expressions()[0]
+    if not isinstance(aggregate, (Count, Sum, Min, Max, Avg, StdDev, Variance)) or aggregate.filter is not None or (
+        not isinstance(source, (F, Star))
+    ):
+        raise ValueError(f"{aggregate!r} cannot be computed from merged rows; aggregate an output column instead.")
+    values = [row if isinstance(source, Star) else row[source.name] for row in rows]
+    values = [value for value in values if value is not None]
+    if aggregate.distinct:
+        values = list({value: None for value in values})
+    if isinstance(aggregate, Count):
+        return len(values)
+    if not values:
+        return None
+    if isinstance(aggregate, (Sum, Min, Max)):
+        return {Sum: sum, Min: min, Max: max}[type(aggregate)](values)
+    if isinstance(aggregate, Avg):
+        return sum(values) / len(values)
+    sample = aggregate.function.endswith("SAMP")
+    if sample and len(values) < 2:
+        return None
+    result = (statistics.variance if sample else statistics.pvariance)([float(value) for value in values])
+    return math.sqrt(result) if isinstance(aggregate, StdDev) else result
+
+
+def sort_rows(rows, keys):
+    # keys to (funkcja wartości, malejąco, NULL na początku); kolejne stabilne sortowania od ostatniego klucza
+    for value, descending, nulls_first in reversed(keys):
+        nulls = [row for row in rows if value(row) is None]
+        rows = sorted((row for row in rows if value(row) is not None), key=value, reverse=descending)
+        rows = nulls + rows if nulls_first else rows + nulls
+    return rows
+
+
+class ShardedQuerySet(models.QuerySet):
+    # bez wskazanego sharda zapytania są wykonywane na wszystkich shardach, a wyniki scalane
+    # według order_by, grupowania i agregatów, tak jakby dane leżały w jednej bazie
+
+    def for_author(self, author_id):
+        return self.using(shard_for(author_id)) if is_enabled() else self
+
+    def _shards(self):
+        if self._db is not None or not is_enabled() or shard_from_hints(self.model, self._hints) is not None:
+            return None
+        return shard_aliases()
+
+    def _on_shard(self, alias, limit=True, **annotations):
+        clone = self.using(alias)
+        clone.query.clear_limits()
+        if not issubclass(self._iterable_class, ModelIterable):
+            # wiersze wartości są scalane jako słowniki i dopiero na końcu zamieniane na krotki
+            clone._iterable_class = ValuesIterable
+        if annotations:
+            clone = clone.annotate(**annotations)
+        if limit and self.query.high_mark is not None:
+            clone.query.set_limits(high=self.query.high_mark)
+        return clone
+
+    def _ordering(self):
+        # elementy sortowania jako (wyrażenie, malejąco, NULL na początku) albo None przy order_by("?")
+        if self.query.order_by:
+            ordering = self.query.order_by
+        elif self.query.default_ordering:
+            ordering = self.model._meta.ordering
+        else:
+            ordering = ()
+        nulls_largest = connections[shard_aliases()[0]].features.nulls_order_largest
+        keys = []
+        for item in ordering:
+            if item == "?":
+                return None
+            if isinstance(item, str):
+                item = F(item[1:]).desc() if item.startswith("-") else F(item).asc()
+            elif not isinstance(item, OrderBy):
+                item = item.asc()
+            item = item.copy()
+            if not self.query.standard_ordering:
+                item.reverse_ordering()
+            if isinstance(item.expression, F):
+                self._check_local(item.expression.name)
+            nulls_first = item.nulls_first or (not item.nulls_last and nulls_largest == item.descending)
+            keys.append((item.expression, item.descending, bool(nulls_first)))
+        return keys
+
+    def _check_local(self, name):
+        # złączenie z tabelą z innej bazy zgubiłoby wiersze na shardach, gdzie jej nie ma
+        model = self.model
+        for part in name.split(LOOKUP_SEP):
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return
+            if not field.is_relation or field.related_model is None:
+                return
+            if not is_sharded(field.related_model) or not colocated(model, field.related_model):
+                raise ValueError(f"Cannot order {self.model._meta.label} across shards by {name!r}: "
+                                 f"{field.related_model._meta.label} is stored in another database.")
+            model = field.related_model
+
+    def _is_grouped(self):
+        return not issubclass(self._iterable_class, ModelIterable) and any(
+            annotation.contains_aggregate for annotation in self.query.annotation_select.values()
+        )
+
+    def _needs_merge(self):
+        values_distinct = self.query.distinct and not issubclass(self._iterable_class, ModelIterable)
+        return self.query.is_sliced or self._ordering() != [] or self._is_grouped() or values_distinct
+
+    def _merge(self, aliases):
+        keys = self._ordering()
+        if self._is_grouped():
+            rows, sort_keys = self._merge_groups(aliases, keys or [])
+        elif keys is None:
+            rows, sort_keys = self._sample(aliases), []
+        else:
+            names = [f"_shard_order_{index}" for index in range(len(keys))]
+            annotations = {name: expression for name, (expression, _, _) in zip(names, keys)}
+            rows = list(itertools.chain.from_iterable(self._on_shard(alias, **annotations) for alias in aliases))
+            sort_keys = [(self._value(name), descending, nulls_first)
+                         for name, (_, descending, nulls_first) in zip(names, keys)]
+        rows = sort_rows(rows, sort_keys)
+        if keys is None:
+            random.shuffle(rows)
+        rows = self._output(rows)
+        if self.query.distinct and not issubclass(self._iterable_class, ModelIterable):
+            seen, unique_rows = [], []
+            for row in rows:
+                if row not in seen:
+                    seen.append(row)
+                    unique_rows.append(row)
+            rows = unique_rows
+        return rows[self.query.low_mark:self.query.high_mark]
+
+    def _value(self, name):
+        if issubclass(self._iterable_class, ModelIterable):
+            return lambda row: getattr(row, name)
+        return lambda row: row[name]
+
+    def _sample(self, aliases):
+        # każdy wiersz, a nie każdy shard, ma tę samą szansę trafić do wycinka
+        if self.query.high_mark is None:
+            return list(itertools.chain.from_iterable(self._on_shard(alias) for alias in aliases))
+        counts = [self._on_shard(alias, limit=False).count() for alias in aliases]
+        picks = random.sample(range(sum(counts)), min(self.query.high_mark, sum(counts)))
+        rows, start = [], 0
+        for alias, count in zip(aliases, counts):
+            limit = sum(start <= pick < start + count for pick in picks)
+            if limit:
+                rows += list(self._on_shard(alias, limit=False)[:limit])
+            start += count
+        return rows
+
+    def _merge_groups(self, aliases, keys):
+        # ta sama grupa może mieć wiersze na kilku shardach, więc agregaty są składane z częściowych
+        aggregates = {name: annotation for name, annotation in self.query.annotation_select.items()
+                      if annotation.contains_aggregate}
+        parts, combiners, sort_keys, annotations = {}, {}, [], {}
+        for index, (name, aggregate) in enumerate(aggregates.items()):
+            aggregate_parts, combiners[name] = combined_aggregate(aggregate, f"_shard_part_{index}")
+            parts.update(aggregate_parts)
+        for index, (expression, descending, nulls_first) in enumerate(keys):
+            if isinstance(expression, F) and expression.name in aggregates:
+                sort_keys.append((self._value(expression.name), descending, nulls_first))
+                continue
+            if getattr(expression, "contains_aggregate", False):
+                raise ValueError(f"Cannot merge {self.model._meta.label} groups ordered by {expression!r}; "
+                                 f"order by the name of an aggregate annotation instead.")
+            annotations[f"_shard_order_{index}"] = expression
+            sort_keys.append((self._value(f"_shard_order_{index}"), descending, nulls_first))
+        groups = {}
+        for alias in aliases:
+            for row in self._on_shard(alias, limit=False, **annotations, **parts):
+                partial = {name: row.pop(name) for name in parts}
+                for name in aggregates:
+                    del row[name]
+                groups.setdefault(tuple(row.items()), (row, []))[1].append(partial)
+        rows = []
+        for row, partials in groups.values():
+            rows.append(dict(row, **{name: combine(partials) for name, combine in combiners.items()}))
+        return rows, sort_keys
+
+    def _output(self, rows):
+        if issubclass(self._iterable_class, ModelIterable):
+            for row in rows:
+                for name in [name for name in vars(row) if name.startswith("_shard_order_")]:
+                    delattr(row, name)
+            return rows
+        query = self.query
+        names = [*query.extra_select, *query.values_select, *query.annotation_select]
+        if issubclass(self._iterable_class, ValuesIterable):
+            return [{name: row[name] for name in names} for row in rows]
+        if self._fields:
+            names = list(self._fields)
+        rows = [tuple(row[name] for name in names) for row in rows]
+        if issubclass(self._iterable_class, FlatValuesListIterable):
+            return [row[0] for row in rows]
+        if issubclass(self._iterable_class, NamedValuesListIterable):
+            row_class = create_namedtuple_class(*names)
+            return [row_class(*row) for row in rows]
+        return rows
+
+    def _fetch_all(self):
+        aliases = self._shards()
+        if aliases is None or self._result_cache is not None:
+            return super(ShardedQuerySet, self)._fetch_all()
+        self._result_cache = self._rows(aliases)
+        if self._prefetch_related_lookups and issubclass(self._iterable_class, ModelIterable):
+            # powiązane wiersze są pobierane z bazy każdego obiektu osobno
+            by_shard = {}
+            for obj in self._result_cache:
+                by_shard.setdefault(obj._state.db, []).append(obj)
+            for objs in by_shard.values():
+                prefetch_related_objects(objs, *self._prefetch_related_lookups)
+        self._prefetch_done = True
+
+    def _rows(self, aliases):
+        if self._needs_merge():
+            return self._merge(aliases)
+        return self._output(list(itertools.chain.from_iterable(self._on_shard(alias) for alias in aliases)))
+
+    def iterator(self, chunk_size=None):
+        aliases = self._shards()
+        if aliases is None:
+            return super(ShardedQuerySet, self).iterator(chunk_size)
+        if self._needs_merge() or not issubclass(self._iterable_class, ModelIterable):
+            return iter(self._rows(aliases))
+        return itertools.chain.from_iterable(self._on_shard(alias).iterator(chunk_size) for alias in aliases)
+
+    def count(self):
+        aliases = self._shards()
+        if aliases is None:
+            return super(ShardedQuerySet, self).count()
+        values_distinct = self.query.distinct and not issubclass(self._iterable_class, ModelIterable)
+        if self._result_cache is not None or self.query.is_sliced or self._is_grouped() or values_distinct:
+            return len(self)
+        return sum(self._on_shard(alias).count() for alias in aliases)
+
+    def exists(self):
+        aliases = self._shards()
+        if aliases is None or self._result_cache is not None:
+            return super(ShardedQuerySet, self).exists()
+        return any(self._on_shard(alias).exists() for alias in aliases)
+
+    def aggregate(self, *args, **kwargs):
+        aliases = self._shards()
+        if aliases is None:
+            return super(ShardedQuerySet, self).aggregate(*args, **kwargs)
+        for arg in args:
+            try:
+                kwargs[arg.default_alias] = arg
+            except (AttributeError, TypeError):
+                raise TypeError("Complex aggregates require an alias")
+        if issubclass(self._iterable_class, ModelIterable) and (self.query.is_sliced or self.query.distinct):
+            # agregat wycinka liczymy na scalonych wierszach
+            pks = list(self.values_list("pk", flat=True))
+            return self.model._default_manager.filter(pk__in=pks).aggregate(**kwargs)
+        if self._needs_merge():
+            rows = self._output_dicts()
+            return {name: aggregate_rows(aggregate, rows) for name, aggregate in kwargs.items()}
+        parts, combiners = {}, {}
+        for index, (name, aggregate) in enumerate(kwargs.items()):
+            if getattr(aggregate, "distinct", False):
+                value = self._distinct_aggregate(aggregate, aliases)
+                combiners[name] = lambda results, value=value: value
+                continue
+            aggregate_parts, combiners[name] = combined_aggregate(aggregate, f"_shard_part_{index}")
+            parts.update(aggregate_parts)
+        results = [self._on_shard(alias).aggregate(**parts) for alias in aliases] if parts else []
+        return {name: combine(results) for name, combine in combiners.items()}
+
+    def _output_dicts(self):
+        # scalone wiersze zapytania values() albo values_list() jako słowniki
+        clone = self._chain()
+        clone._iterable_class = ValuesIterable
+        return list(clone)
+
+    def _distinct_aggregate(self, aggregate, aliases):
+        # ta sama wartość może wystąpić na kilku shardach, więc agregat liczymy na ich sumie
+        values = set()
+        for alias in aliases:
+            queryset = self.using(alias)
+            if aggregate.filter is not None:
+                queryset = queryset.filter(aggregate.filter)
+            queryset = queryset.annotate(_shard_value=aggregate.get_source_expressions()[0]).order_by()
+            values.update(queryset.values_list("_shard_value", flat=True).distinct())
+        rows = [{"_shard_value": value} for value in values]
+        return aggregate_rows(type(aggregate)(F("_shard_value"), distinct=True), rows)
+
+    def update(self, **kwargs):
+        aliases = self._shards()
+        if aliases is None:
+            return super(ShardedQuerySet, self).update(**kwargs)
+        return sum(self.using(alias).update(**kwargs) for alias in aliases)
+
+    def delete(self):
+        aliases = self._shards()
+        if aliases is None:
+            return super(ShardedQuerySet, self).delete()
+        deleted, rows = 0, {}
+        for alias in aliases:
+            count, counts = self.using(alias).delete()
+            deleted += count
+            for label, label_count in counts.items():
+                rows[label] = rows.get(label, 0) + label_count
+        return deleted, rows
+
+    def _shard_of(self, obj):
+        db = shard_of(obj)
+        if db is None:
+            raise ValueError(f"Cannot choose a shard for {obj!r}; set its author or parent first.")
+        return db
+
+    def create(self, **kwargs):
+        if self._shards() is None:
+            return super(ShardedQuerySet, self).create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True, using=self._shard_of(obj))
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        if not is_enabled():
+            return super(ShardedQuerySet, self).bulk_create(objs, *args, **kwargs)
+        if self._shards() is None:
+            by_shard = {self.db: objs}
+        else:
+            by_shard = {}
+            for obj in objs:
+                by_shard.setdefault(self._shard_of(obj), []).append(obj)
+        for alias, shard_objs in by_shard.items():
+            new_objs = [obj for obj in shard_objs if obj.pk is None]
+            for obj, pk in zip(new_objs, allocate_ids(self.model, alias, len(new_objs))):
+                obj.pk = pk
+            super(ShardedQuerySet, self.using(alias)).bulk_create(shard_objs, *args, **kwargs)
+        return objs
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        if self._shards() is None:
+            return super(ShardedQuerySet, self).bulk_update(objs, fields, batch_size)
+        by_shard = {}
+        for obj in objs:
+            by_shard.setdefault(obj._state.db, []).append(obj)
+        return sum(self.using(alias).bulk_update(shard_objs, fields, batch_size)
+                   for alias, shard_objs in by_shard.items())
+
+
+ShardedManager = models.Manager.from_queryset(ShardedQuerySet)
+
+
+def first_id(model, alias):
+    # shard 0 zaczyna powyżej id nadanych przed podziałem danych, które mogą leżeć na dowolnym shardzie
+    index = shard_aliases().index(alias)
+    if index:
+        return index * SHARD_ID_SPAN
+    return max(
+        model._base_manager.using(db).filter(pk__lt=SHARD_ID_SPAN).order_by("-pk").values_list("pk", flat=True).first()
+        or 0 for db in dict.fromkeys([DEFAULT_DB_ALIAS] + shard_aliases())
+    )
+
+
+def allocate_ids(model, alias, count):
+    # licznik leży na tym samym shardzie co wiersze, więc nie blokuje zapisów innych shardów
+    from .models import ShardSequence
+
+    if not count:
+        return range(0)
+    sequences = ShardSequence.objects.using(alias).filter(name=model._meta.db_table)
+    with transaction.atomic(using=alias):
+        if not sequences.update(last_id=F("last_id") + count):
+            ShardSequence.objects.using(alias).bulk_create(
+                [ShardSequence(name=model._meta.db_table, last_id=first_id(model, alias))], ignore_conflicts=True
+            )
+            sequences.update(last_id=F("last_id") + count)
+        last_id = sequences.values_list("last_id", flat=True).get()
+    return range(last_id - count + 1, last_id + 1)
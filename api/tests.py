@@ -1,11 +1,41 @@
+import json
+import os
+import random
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import call_command, CommandError
+from django.db import connection, connections, DatabaseError, IntegrityError, OperationalError
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Avg, Count, Max, Sum, Variance
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.authtoken.admin import User
 
 from rest_framework.authtoken.models import Token
 
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
-from .models import Flashcard, Category, FlashcardsSet
+from .audit import LogBuffer, log_buffer
+from .authentication import TokenCache, token_cache
+from .catalogue import catalogue_cache
+from .checks import check_replica_pin_cache
+from .jobs import run_quiz_job
+from .metrics import registry
+from .models import Flashcard, Category, FlashcardsSet, Rating, Quiz, QuizQuestion, QuizAnswer, QuizJob, Tag, \
+    ReviewState, Log, DailyActivity, sample_quiz
+from .replicas import copy_sqlite_database, pin_cache, pin_key
+from .serializers import FlashcardSerializer
+from .shards import SHARD_ID_SPAN, shard_for
 
 
 class FlashcardTests(APITestCase):
@@ -53,9 +83,9 @@ class FlashcardTests(APITestCase):
         self.client.post(self.url, self.valid_flashcard)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0].get('id'), 1)
-        self.assertEqual(response.data[0].get('front'), "Jak na dłoni widać mą stężałą twarz")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0].get('id'), 1)
+        self.assertEqual(response.data["results"][0].get('front'), "Jak na dłoni widać mą stężałą twarz")
 
     def test_flashcard_exists_already(self):
         self.client.post(self.url, self.valid_flashcard)
@@ -66,9 +96,9 @@ class FlashcardTests(APITestCase):
         self.client.post(self.url, self.valid_flashcard)
         response = self.client.get(self.url + f"?flashcard_set={self.flashcards_set.name}")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0].get("id"), 1)
-        self.assertEqual(response.data[0].get('front'), "Jak na dłoni widać mą stężałą twarz")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0].get("id"), 1)
+        self.assertEqual(response.data["results"][0].get('front'), "Jak na dłoni widać mą stężałą twarz")
 
     def test_delete_flashcard_of_given_id(self):
         self.client.post(self.url, self.valid_flashcard)
@@ -89,9 +119,9 @@ class FlashcardTests(APITestCase):
         self.client.post(self.url, self.valid_flashcard)
         response = self.client.get(self.url + "?flashcard_id=1")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0].get("id"), 1)
-        self.assertEqual(response.data[0].get('front'), "Jak na dłoni widać mą stężałą twarz")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0].get("id"), 1)
+        self.assertEqual(response.data["results"][0].get('front'), "Jak na dłoni widać mą stężałą twarz")
 
     def test_edit_flashcard_of_given_id(self):
         self.client.post(self.url, self.valid_flashcard)
@@ -102,8 +132,100 @@ class FlashcardTests(APITestCase):
         self.assertEqual(response.data.get('front'), "Nowych chwytów na gitarze nie wyćwiczę")
 
 
+    def test_edit_flashcard_into_duplicate(self):
+        self.client.post(self.url, self.valid_flashcard)
+        self.client.post(self.url, dict(self.valid_flashcard, front="Inny przód"))
+        response = self.client.patch(self.url + "2/", {"front": self.valid_flashcard["front"]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(self.url + "1/", {"front": self.valid_flashcard["front"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_flashcard_duplicate_created_concurrently(self):
+        request = self.client.get(self.url).wsgi_request
+        request.user = self.user
+        data = dict(self.valid_flashcard)
+        del data["author"]
+        serializer = FlashcardSerializer(data=data, context={"request": request})
+        self.assertTrue(serializer.is_valid())
+        Flashcard.objects.create(front=data["front"], back=data["back"], flashcard_set=self.flashcards_set,
+                                 author=self.user)
+        with self.assertRaises(ValidationError):
+            serializer.save()
+        self.assertEqual(Flashcard.objects.count(), 1)
+
+    def test_flashcard_duplicate_check_uses_index(self):
+        plan = Flashcard.objects.filter(content_hash="x").explain()
+        self.assertIn("(content_hash=?)", plan)
+        self.assertNotIn("SCAN", plan)
+
+    def test_flashcard_count_follows_create_move_and_delete(self):
+        another_set = FlashcardsSet.objects.create(name="drugi", author=self.user,
+                                                   category=self.flashcards_set.category)
+        self.client.post(self.url, self.valid_flashcard)
+        self.flashcards_set.refresh_from_db()
+        self.assertEqual(self.flashcards_set.flashcard_count, 1)
+
+        self.client.patch(self.url + "1/", {"flashcard_set": another_set.id})
+        self.flashcards_set.refresh_from_db()
+        another_set.refresh_from_db()
+        self.assertEqual(self.flashcards_set.flashcard_count, 0)
+        self.assertEqual(another_set.flashcard_count, 1)
+
+        self.client.delete(self.url + "1/")
+        another_set.refresh_from_db()
+        self.assertEqual(another_set.flashcard_count, 0)
+
+    def test_rebuild_flashcard_counts(self):
+        self.client.post(self.url, self.valid_flashcard)
+        FlashcardsSet.objects.update(flashcard_count=5)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_flashcard_counts", "--check", stdout=StringIO())
+        call_command("rebuild_flashcard_counts", stdout=StringIO())
+        self.flashcards_set.refresh_from_db()
+        self.assertEqual(self.flashcards_set.flashcard_count, 1)
+        call_command("rebuild_flashcard_counts", "--check", stdout=StringIO())
+
+    def test_get_flashcards_with_cursor_pagination(self):
+        for i in range(5):
+            self.valid_flashcard["front"] = f"fiszka {i}"
+            self.client.post(self.url, self.valid_flashcard)
+        response = self.client.get(self.url, {"page_size": 2})
+        self.assertEqual([f.get("front") for f in response.data["results"]], ["fiszka 0", "fiszka 1"])
+        self.assertIsNone(response.data["previous"])
+        fronts = []
+        while response.data["next"] is not None:
+            response = self.client.get(response.data["next"])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            fronts += [f.get("front") for f in response.data["results"]]
+        self.assertEqual(fronts, ["fiszka 2", "fiszka 3", "fiszka 4"])
+
+    def test_get_flashcards_from_given_set_conditionally(self):
+        response = self.client.post(self.url, self.valid_flashcard)
+        flashcard_id = response.data["id"]
+        response = self.client.get(self.url, {"flashcard_set": "testowy"})
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {"flashcard_set": "testowy"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+        another_set = FlashcardsSet.objects.create(name="inny", author=self.user,
+                                                   category=self.flashcards_set.category)
+        self.client.post(self.url, dict(self.valid_flashcard, flashcard_set=another_set.id))
+        response = self.client.get(self.url, {"flashcard_set": "testowy"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.patch(f"{self.url}{flashcard_id}/", {"back": "nowy tył"})
+        response = self.client.get(self.url, {"flashcard_set": "testowy"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["results"][0].get("back"), "nowy tył")
+
+
 class FlashcardsSetTests(APITestCase):
     def setUp(self):
+        catalogue_cache.clear()
         self.user = User.objects.create_user("tester", "Wy w ciemnościach – reflektory chronią was")
         self.token = Token.objects.get(user__username='tester')
         self.client.force_authenticate(user=self.user)
@@ -134,13 +256,55 @@ class FlashcardsSetTests(APITestCase):
         response = self.client.post(self.url, self.invalid_flashcards_set)
         self.assertEqual(response.status_code, 400)
 
+    def test_list_flashcards_sets_with_counts(self):
+        self.client.post(self.url, self.valid_flashcards_set)
+        self.valid_flashcards_set["name"] = "drugi"
+        self.client.post(self.url, self.valid_flashcards_set)
+        # wersje list do ETagu i sama lista
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual([s.get("flashcard_count") for s in response.data["results"]], [0, 0])
+
+    def test_list_flashcards_sets_conditionally(self):
+        response = self.client.post(self.url, self.valid_flashcards_set)
+        flashcards_set = FlashcardsSet.objects.get(id=response.data["id"])
+        etag = self.client.get(self.url)["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        another_user = User.objects.create_user("tester2", "Oświetlając tylko scenę, na niej mnie!")
+        FlashcardsSet.objects.create(name="prywatny", author=another_user, category=self.category, status="private")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Rating.objects.create(set=flashcards_set, user=another_user, rate=4)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"][0].get("rating_avg"), 4)
+        etag = response["ETag"]
+
+        own_etag = self.client.get(self.url, {"user_only": "True"})["ETag"]
+        FlashcardsSet.objects.create(name="publiczny", author=another_user, category=self.category)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url, {"user_only": "True"}, HTTP_IF_NONE_MATCH=own_etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_get_flashcards_sets_by_name(self):
+        self.client.post(self.url, self.valid_flashcards_set)
+        self.valid_flashcards_set["name"] = "inny zestaw"
+        self.client.post(self.url, self.valid_flashcards_set)
+        response = self.client.get(self.url, {"name": "niebieska"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([s.get("name") for s in response.data["results"]], ["ze sceny [niebieska karta remix]"])
+
     def test_get_flashcardset_of_given_id(self):
         self.client.post(self.url, self.valid_flashcards_set)
         response = self.client.get(self.url + "?flashcard_set_id=1")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0].get("id"), 1)
-        self.assertEqual(response.data[0].get('name'), "ze sceny [niebieska karta remix]")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0].get("id"), 1)
+        self.assertEqual(response.data["results"][0].get('name'), "ze sceny [niebieska karta remix]")
 
     def test_flashcards_set_exists_for_user_and_not_created(self):
         self.client.post(self.url, self.valid_flashcards_set)
@@ -167,7 +331,7 @@ class FlashcardsSetTests(APITestCase):
         self.client.post(self.url, self.valid_flashcards_set)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertNotEqual(len(response.data), 2)
+        self.assertNotEqual(len(response.data["results"]), 2)
 
     def test_get_only_public_and_user_flashcards_set(self):
         self.valid_flashcards_set["status"] = "private"
@@ -183,9 +347,9 @@ class FlashcardsSetTests(APITestCase):
         self.client.post(self.url, self.valid_flashcards_set)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
-        self.assertEqual(response.data[0].get("name"), "ze sceny [niebieska karta remix]")
-        self.assertEqual(response.data[1].get("name"), "ze sceny [niebieska karta remix] 2")
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertEqual(response.data["results"][0].get("name"), "ze sceny [niebieska karta remix]")
+        self.assertEqual(response.data["results"][1].get("name"), "ze sceny [niebieska karta remix] 2")
 
     def test_delete_flashcardset_of_given_id(self):
         self.client.post(self.url, self.valid_flashcards_set)
@@ -211,9 +375,9 @@ class FlashcardsSetTests(APITestCase):
         self.client.post(self.url, self.valid_flashcards_set)
         response = self.client.get(self.url + f"?category={self.category.name}")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0].get("id"), 1)
-        self.assertEqual(response.data[0].get('name'), "ze sceny [niebieska karta remix]")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0].get("id"), 1)
+        self.assertEqual(response.data["results"][0].get('name'), "ze sceny [niebieska karta remix]")
 
     def test_get_only_given_user_public_flashcards_set(self):
         second_user = User.objects.create_user("tester2", "Wy w ciemnościach – reflektory chronią was")
@@ -234,12 +398,102 @@ class FlashcardsSetTests(APITestCase):
 
         response = self.client.get(self.url + "?author=tester2")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0].get("name"), "publiczny zestaw")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0].get("name"), "publiczny zestaw")
+
+
+    def test_import_flashcards_from_csv(self):
+        flashcards_set = FlashcardsSet.objects.create(name="import", author=self.user, category=self.category)
+        Flashcard.objects.create(front="pies", back="dog", flashcard_set=flashcards_set, author=self.user)
+        body = 'front,back\npies,dog\nkot,cat\n"wiele\nlinii",lines\nkot,cat\n,pusty\n'
+        response = self.client.post(self.url + f"{flashcards_set.id}/import/", body, content_type="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data.get("created"), 2)
+        self.assertEqual(response.data.get("duplicates"), 2)
+        self.assertEqual(response.data.get("errors"), [{"row": 7, "error": "Brak przodu fiszki."}])
+        flashcards_set.refresh_from_db()
+        self.assertEqual(flashcards_set.flashcard_count, 3)
+        self.assertTrue(Flashcard.objects.filter(front="wiele\nlinii", back="lines").exists())
+        review_states = ReviewState.objects.filter(user=self.user, flashcard__flashcard_set=flashcards_set)
+        self.assertEqual(review_states.count(), 3)
+
+    def test_import_flashcards_with_byte_order_mark(self):
+        flashcards_set = FlashcardsSet.objects.create(name="import", author=self.user, category=self.category)
+        for body, content_type in [("front,back\npies,dog\n", "text/csv"),
+                                   ('{"front": "kot", "back": "cat"}\n', "application/x-ndjson")]:
+            response = self.client.post(self.url + f"{flashcards_set.id}/import/", "\ufeff" + body,
+                                        content_type=content_type)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual((response.data.get("created"), response.data.get("errors")), (1, []))
+
+    def test_failed_import_is_not_logged(self):
+        flashcards_set = FlashcardsSet.objects.create(name="import", author=self.user, category=self.category)
+        log_buffer.discard()
+        body = "front,back\n".encode() + b"".join(f"przod {i},tyl {i}\n".encode() for i in range(600)) + b"\xff,x\n"
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url + f"{flashcards_set.id}/import/", body, content_type="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Flashcard.objects.filter(flashcard_set=flashcards_set).exists())
+        # pierwsza porcja 500 fiszek została wycofana razem z transakcją importu
+        self.assertEqual(log_buffer.events, [])
+
+    def test_import_flashcards_from_jsonl(self):
+        flashcards_set = FlashcardsSet.objects.create(name="import", author=self.user, category=self.category)
+        body = '{"front": "pies", "back": "dog"}\n\nnie json\n{"front": "kot", "back": "cat"}\n'
+        response = self.client.post(self.url + f"{flashcards_set.id}/import/", body,
+                                    content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data.get("created"), 2)
+        self.assertEqual(response.data.get("errors"), [{"row": 3, "error": "Nieprawidłowy wiersz."}])
+        self.assertEqual(Flashcard.objects.filter(flashcard_set=flashcards_set).count(), 2)
 
+    def test_import_flashcards_into_set_of_another_user(self):
+        another_user = User.objects.create_user("tester2", "Oświetlając tylko scenę, na niej mnie!")
+        flashcards_set = FlashcardsSet.objects.create(name="cudzy", author=another_user, category=self.category)
+        response = self.client.post(self.url + f"{flashcards_set.id}/import/", "front,back\na,b\n",
+                                    content_type="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_import_flashcards_with_unsupported_format(self):
+        flashcards_set = FlashcardsSet.objects.create(name="import", author=self.user, category=self.category)
+        response = self.client.post(self.url + f"{flashcards_set.id}/import/", "<xml/>",
+                                    content_type="application/xml")
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_export_flashcards_as_csv(self):
+        flashcards_set = FlashcardsSet.objects.create(name="eksport", author=self.user, category=self.category)
+        Flashcard.objects.create(front="pies", back="dog", flashcard_set=flashcards_set, author=self.user)
+        Flashcard.objects.create(front="wiele\nlinii, z przecinkiem", back="lines",
+                                 flashcard_set=flashcards_set, author=self.user)
+        response = self.client.get(self.url + f"{flashcards_set.id}/export/", {"format": "csv"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(body, 'front,back\r\npies,dog\r\n"wiele\nlinii, z przecinkiem",lines\r\n')
+
+        another_set = FlashcardsSet.objects.create(name="kopia", author=self.user, category=self.category)
+        response = self.client.post(self.url + f"{another_set.id}/import/", body, content_type="text/csv")
+        self.assertEqual(response.data.get("created"), 2)
+
+    def test_export_flashcards_as_jsonl(self):
+        flashcards_set = FlashcardsSet.objects.create(name="eksport", author=self.user, category=self.category)
+        Flashcard.objects.create(front="żółw", back="turtle", flashcard_set=flashcards_set, author=self.user)
+        response = self.client.get(self.url + f"{flashcards_set.id}/export/", {"format": "jsonl"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{"front": "żółw", "back": "turtle"}])
+
+    def test_export_private_flashcards_set_of_another_user(self):
+        another_user = User.objects.create_user("tester2", "Oświetlając tylko scenę, na niej mnie!")
+        flashcards_set = FlashcardsSet.objects.create(name="cudzy", author=another_user, category=self.category,
+                                                      status="private")
+        response = self.client.get(self.url + f"{flashcards_set.id}/export/", {"format": "jsonl"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 class RatingTests(APITestCase):
     def setUp(self):
+        catalogue_cache.clear()
         self.user = User.objects.create_user("tester", "Wy w ciemnościach – reflektory chronią was")
         self.token = Token.objects.get(user__username='tester')
         self.client.force_authenticate(user=self.user)
@@ -280,10 +534,1188 @@ class RatingTests(APITestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.data.get("detail"), "Już zagłosowałeś na ten zestaw.")
 
+    def test_create_same_rating_concurrently(self):
+        self.client.post(self.url, self.valid_rating)
+        # drugie żądanie przechodzi sprawdzenie exists() zanim pierwsze zostanie zapisane
+        with mock.patch("django.db.models.query.QuerySet.exists", return_value=False):
+            response = self.client.post(self.url, self.valid_rating)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data.get("detail"), "Już zagłosowałeś na ten zestaw.")
+        self.flashcards_set.refresh_from_db()
+        self.assertEqual(self.flashcards_set.rating_count, 1)
+
     def test_get_rating_for_flashcard_set(self):
         self.client.post(self.url, self.valid_rating)
         response = self.client.get(self.url, {"flashcard_set": self.flashcards_set.name})
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 1)
+
+
+    def test_rating_aggregates(self):
+        self.client.post(self.url, self.valid_rating)
+        another_user = User.objects.create_user("tester2", "Oświetlając tylko scenę, na niej mnie!")
+        self.client.force_authenticate(user=another_user)
+        self.client.post(self.url, dict(self.valid_rating, rate=2))
+        self.flashcards_set.refresh_from_db()
+        self.assertEqual(self.flashcards_set.rating_count, 2)
+        self.assertEqual(self.flashcards_set.rating_sum, 7)
+        self.assertEqual(self.flashcards_set.rating_avg, 3.5)
+
+        Rating.objects.filter(user=another_user).delete()
+        self.flashcards_set.refresh_from_db()
+        self.assertEqual(self.flashcards_set.rating_avg, 5)
+        Rating.objects.all().delete()
+        self.flashcards_set.refresh_from_db()
+        self.assertEqual((self.flashcards_set.rating_count, self.flashcards_set.rating_avg), (0, 0))
+
+    def test_rating_aggregates_follow_changed_rating(self):
+        self.client.post(self.url, self.valid_rating)
+        another_set = FlashcardsSet.objects.create(name="inny", author=self.user,
+                                                   category=self.flashcards_set.category)
+        rating = Rating.objects.get()
+        rating.rate = 1
+        rating.save()
+        self.flashcards_set.refresh_from_db()
+        self.assertEqual((self.flashcards_set.rating_count, self.flashcards_set.rating_sum,
+                          self.flashcards_set.rating_avg), (1, 1, 1.0))
+
+        rating.set = another_set
+        rating.rate = 4
+        rating.save()
+        self.flashcards_set.refresh_from_db()
+        another_set.refresh_from_db()
+        self.assertEqual((self.flashcards_set.rating_count, self.flashcards_set.rating_avg), (0, 0))
+        self.assertEqual((another_set.rating_count, another_set.rating_sum, another_set.rating_avg), (1, 4, 4.0))
+        rating.delete()
+        another_set.refresh_from_db()
+        self.assertEqual((another_set.rating_count, another_set.rating_sum), (0, 0))
+
+    def test_get_top_rated_flashcards_sets(self):
+        category = self.flashcards_set.category
+        another_category = Category.objects.create(name="test2", level="easy")
+        better_set = FlashcardsSet.objects.create(name="lepszy", author=self.user, category=category)
+        private_set = FlashcardsSet.objects.create(name="prywatny", author=self.user, category=category,
+                                                   status="private")
+        other_set = FlashcardsSet.objects.create(name="inny", author=self.user, category=another_category)
+        for flashcards_set, rate in [(self.flashcards_set, 3), (better_set, 5), (private_set, 5), (other_set, 4)]:
+            Rating.objects.create(set=flashcards_set, user=self.user, rate=rate)
+
+        response = self.client.get("/api/sets/top/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s.get("name") for s in response.data], ["lepszy", "inny", "testowy"])
+        response = self.client.get("/api/sets/top/", {"category": "test", "limit": 1})
+        self.assertEqual([s.get("name") for s in response.data], ["lepszy"])
+        self.assertEqual(response.data[0].get("rating_avg"), 5)
+
+    def test_foreign_keys_are_enforced_without_shards(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, "api_flashcardsset")
+        foreign_keys = {column for constraint in constraints.values() if constraint["foreign_key"]
+                        for column in constraint["columns"]}
+        self.assertEqual(foreign_keys, {"author_id", "tag_id", "category_id"})
+
+    def test_get_top_rated_flashcards_sets_with_invalid_limit(self):
+        for limit in ["-1", "0", "dużo"]:
+            response = self.client.get("/api/sets/top/", {"limit": limit})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data, {"error": "Nieprawidłowy limit."})
+
+class QuizTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("tester", "Wy w ciemnościach – reflektory chronią was")
+        self.another_user = User.objects.create_user("tester2", "Oświetlając tylko scenę, na niej mnie!")
+        self.token = Token.objects.get(user__username='tester')
+        self.client.force_authenticate(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        category = Category.objects.create(name="test", level="easy")
+        self.flashcards_set = FlashcardsSet.objects.create(
+            name="testowy",
+            author=self.user,
+            category=category
+        )
+        for i in range(6):
+            Flashcard.objects.create(
+                front=f"pytanie {i}",
+                back=f"odpowiedź {i}",
+                flashcard_set=self.flashcards_set,
+                author=self.user
+            )
+
+        self.url = "/api/quiz/generate/"
+
+    def test_generate_quiz(self):
+        response = self.client.post(self.url, {"flashcards_set": self.flashcards_set.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        quiz_id = response.data[0].get("quiz_id")
+        questions = response.data[1:]
+        self.assertEqual(len(questions), 6)
+        self.assertEqual(QuizQuestion.objects.filter(quiz_id=quiz_id).count(), 6)
+        self.assertEqual(QuizAnswer.objects.filter(question__quiz_id=quiz_id).count(), 24)
+        for question in questions:
+            self.assertEqual([answer["letter"] for answer in question["answers"]], ["A", "B", "C", "D"])
+            number = question["text"].split()[-1]
+            texts = [answer["text"] for answer in question["answers"]]
+            self.assertIn(f"odpowiedź {number}", texts)
+            self.assertEqual(len(set(texts)), 4)
+            correct = QuizQuestion.objects.get(id=question["id"]).correct_answer
+            self.assertEqual(question["answers"]["ABCD".index(correct)]["text"], f"odpowiedź {number}")
+
+    def test_generate_quiz_not_enough_flashcards(self):
+        Flashcard.objects.filter(front__in=["pytanie 0", "pytanie 1", "pytanie 2"]).delete()
+        response = self.client.post(self.url, {"flashcards_set": self.flashcards_set.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(len(response.data), 1)
+        self.assertEqual(QuizQuestion.objects.count(), 0)
+
+    def test_generate_quiz_query_count_does_not_grow_with_set_size(self):
+        quiz = Quiz(flashcards_set=self.flashcards_set, author=self.user)
+        with self.assertNumQueries(10):
+            quiz.save()
+        for i in range(6, 40):
+            Flashcard.objects.create(front=f"pytanie {i}", back=f"odpowiedź {i}",
+                                     flashcard_set=self.flashcards_set, author=self.user)
+        quiz = Quiz(flashcards_set=self.flashcards_set, author=self.user)
+        with self.assertNumQueries(10):
+            quiz.save()
+
+    def test_generate_quiz_with_question_count(self):
+        response = self.client.post(self.url, {"flashcards_set": self.flashcards_set.id, "question_count": 2})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(QuizQuestion.objects.count(), 2)
+
+    def test_generate_quiz_with_invalid_question_count(self):
+        response = self.client.post(self.url, {"flashcards_set": self.flashcards_set.id, "question_count": 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sample_quiz_is_reproducible_with_seed(self):
+        flashcard_ids = list(range(1, 101))
+        sample = sample_quiz(flashcard_ids, 20, random.Random(42))
+        self.assertEqual(sample, sample_quiz(flashcard_ids, 20, random.Random(42)))
+        self.assertEqual(len(sample), 20)
+        self.assertEqual(len({question_id for question_id, _ in sample}), 20)
+        for question_id, distractor_ids in sample:
+            self.assertEqual(len(set(distractor_ids)), 3)
+            self.assertNotIn(question_id, distractor_ids)
+
+    def test_generate_quiz_async(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(self.url + "?async=True", {"flashcards_set": self.flashcards_set.id})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data.get("status"), "pending")
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(QuizQuestion.objects.count(), 0)
+
+        job_url = f"/api/quiz/jobs/{response.data.get('job_id')}/"
+        self.assertEqual(self.client.get(job_url).data.get("status"), "pending")
+        run_quiz_job(response.data.get("job_id"))
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get("status"), "done")
+        self.assertEqual(response.data.get("progress"), 100)
+        self.assertEqual(len(response.data.get("payload")), 7)
+        self.assertEqual(QuizQuestion.objects.count(), 6)
+
+    def create_job(self):
+        quiz = Quiz(flashcards_set=self.flashcards_set, author=self.user)
+        quiz.defer_generation = True
+        quiz.save()
+        return QuizJob.objects.create(quiz=quiz)
+
+    def test_quiz_job_records_progress(self):
+        job = self.create_job()
+        progress = []
+        save = QuizJob.save
+
+        def record(job, *args, **kwargs):
+            progress.append((job.status, job.progress))
+            save(job, *args, **kwargs)
+
+        with mock.patch.object(QuizJob, "save", record):
+            run_quiz_job(job.id)
+        self.assertEqual(progress, [("running", 0), ("running", 30), ("running", 60), ("done", 100)])
+
+    def test_quiz_job_failure_is_logged(self):
+        job = self.create_job()
+        with mock.patch.object(Quiz, "generate_quiz", side_effect=RuntimeError("brak fiszek")), \
+                self.assertLogs("api.jobs", level="ERROR"):
+            run_quiz_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ("failed", "brak fiszek"))
+        self.assertIsNotNone(job.finished)
+
+        job = self.create_job()
+        with mock.patch.object(QuizJob.objects, "select_related", side_effect=DatabaseError("baza niedostępna")), \
+                self.assertLogs("api.jobs", level="ERROR"):
+            run_quiz_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ("failed", "baza niedostępna"))
+
+    def test_stale_quiz_jobs_are_marked_failed(self):
+        running, pending, fresh = self.create_job(), self.create_job(), self.create_job()
+        QuizJob.objects.filter(id=running.id).update(status="running")
+        QuizJob.objects.filter(id__in=[running.id, pending.id]).update(updated=timezone.now() - timedelta(hours=1))
+        response = self.client.get(f"/api/quiz/jobs/{running.id}/")
+        self.assertEqual(response.data.get("status"), "failed")
+        self.assertEqual(response.data.get("error"), "Generowanie quizu zostało przerwane.")
+
+        out = StringIO()
+        call_command("expire_quiz_jobs", stdout=out)
+        self.assertIn("Marked 1 stale quiz job(s) as failed.", out.getvalue())
+        self.assertEqual(QuizJob.objects.get(id=fresh.id).status, "pending")
+        # zadanie uznane za porzucone nie jest już uruchamiane przez spóźniony wątek
+        run_quiz_job(pending.id)
+        self.assertEqual(QuizJob.objects.get(id=pending.id).status, "failed")
+        self.assertEqual(QuizQuestion.objects.count(), 0)
+
+    def test_get_quiz_job_of_another_user(self):
+        job = self.create_job()
+        self.client.force_authenticate(user=self.another_user)
+        response = self.client.get(f"/api/quiz/jobs/{job.id}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_generated_quiz(self):
+        data = self.client.post(self.url, {"flashcards_set": self.flashcards_set.id}).data
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url + f"{data[0].get('quiz_id')}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, data)
+
+    def test_serialize_quiz_without_stored_payload(self):
+        data = self.client.post(self.url, {"flashcards_set": self.flashcards_set.id}).data
+        quiz = Quiz.objects.get(id=data[0].get("quiz_id"))
+        quiz.payload = None
+        with self.assertNumQueries(3):
+            self.assertEqual(quiz.serialize_quiz(), data)
+        with self.assertNumQueries(0):
+            self.assertEqual(quiz.serialize_quiz(), data)
+
+    def correct_answers(self, quiz_id):
+        return {str(question.id): question.correct_answer
+                for question in QuizQuestion.objects.filter(quiz_id=quiz_id)}
+
+    def test_check_quiz(self):
+        quiz_id = self.client.post(self.url, {"flashcards_set": self.flashcards_set.id}).data[0].get("quiz_id")
+        answers = self.correct_answers(quiz_id)
+        wrong_question = next(iter(answers))
+        answers[wrong_question] = "A" if answers[wrong_question] != "A" else "B"
+        response = self.client.put("/api/quiz/check/", {"quiz_id": quiz_id, "answers": json.dumps(answers)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get("final_score"), 5)
+        self.assertEqual(response.data.get(int(wrong_question)), "Incorrect")
+        quiz = Quiz.objects.get(id=quiz_id)
+        self.assertTrue(quiz.is_finished)
+        self.assertEqual(quiz.score, 5)
+
+    def test_check_quiz_with_missing_answers(self):
+        quiz_id = self.client.post(self.url, {"flashcards_set": self.flashcards_set.id}).data[0].get("quiz_id")
+        answers = self.correct_answers(quiz_id)
+        answers.popitem()
+        response = self.client.put("/api/quiz/check/", {"quiz_id": quiz_id, "answers": json.dumps(answers)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Quiz.objects.get(id=quiz_id).is_finished)
+
+    def test_check_quiz_batch(self):
+        quiz_ids = [self.client.post(self.url, {"flashcards_set": self.flashcards_set.id}).data[0].get("quiz_id")
+                    for _ in range(3)]
+        submissions = [{"quiz_id": quiz_id, "answers": self.correct_answers(quiz_id)} for quiz_id in quiz_ids]
+        submissions[2]["answers"].popitem()
+        submissions.append({"quiz_id": 999, "answers": {}})
+        with self.assertNumQueries(3):
+            response = self.client.post("/api/quiz/check/batch/", {"quizzes": submissions}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data.get("results")
+        self.assertEqual([result.get("final_score") for result in results], [6, 6, None, None])
+        self.assertEqual(results[2].get("error"), "Nie wszystkie odpowiedzi zaznaczone.")
+        self.assertEqual(results[3].get("error"), "Quiz nie istnieje.")
+        self.assertEqual(list(Quiz.objects.order_by("id").values_list("score", "is_finished")),
+                         [(6, True), (6, True), (0, False)])
+
+    def test_check_quiz_batch_with_invalid_data(self):
+        response = self.client.post("/api/quiz/check/batch/", {"quizzes": [{"quiz_id": "x"}]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for data in [[1, 2], {}, {"quizzes": {"quiz_id": 1}}]:
+            response = self.client.post("/api/quiz/check/batch/", data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_check_quiz_with_answer_key(self):
+        response = self.client.post(self.url + "?answer_key=True", {"flashcards_set": self.flashcards_set.id})
+        quiz_id = response.data[0].get("quiz_id")
+        token = response.data[0].get("answer_key")
+        self.assertIsNotNone(token)
+        self.assertNotIn("answer_key", Quiz.objects.get(id=quiz_id).payload[0])
+        answers = self.correct_answers(quiz_id)
+        with self.assertNumQueries(1):
+            response = self.client.put("/api/quiz/check/", {"answer_key": token, "answers": json.dumps(answers)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get("final_score"), 6)
+        quiz = Quiz.objects.get(id=quiz_id)
+        self.assertTrue(quiz.is_finished)
+        self.assertEqual(quiz.score, 6)
+
+    def test_check_quiz_with_tampered_answer_key(self):
+        response = self.client.post(self.url + "?answer_key=True", {"flashcards_set": self.flashcards_set.id})
+        quiz_id = response.data[0].get("quiz_id")
+        token = response.data[0].get("answer_key")
+        answers = json.dumps(self.correct_answers(quiz_id))
+        tampered_token = token[:-1] + ("x" if token[-1] != "x" else "y")
+        response = self.client.put("/api/quiz/check/", {"answer_key": tampered_token, "answers": answers})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Quiz.objects.get(id=quiz_id).is_finished)
+
+    def test_check_quiz_with_answer_key_of_another_user(self):
+        response = self.client.post(self.url + "?answer_key=True", {"flashcards_set": self.flashcards_set.id})
+        quiz_id = response.data[0].get("quiz_id")
+        token = response.data[0].get("answer_key")
+        answers = json.dumps(self.correct_answers(quiz_id))
+        self.client.force_authenticate(user=self.another_user)
+        response = self.client.put("/api/quiz/check/", {"answer_key": token, "answers": answers})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data.get("error"), "Nieprawidłowy klucz odpowiedzi.")
+        self.assertFalse(Quiz.objects.get(id=quiz_id).is_finished)
+
+    def test_check_quiz_of_another_user(self):
+        quiz_id = self.client.post(self.url, {"flashcards_set": self.flashcards_set.id}).data[0].get("quiz_id")
+        answers = json.dumps(self.correct_answers(quiz_id))
+        self.client.force_authenticate(user=self.another_user)
+        response = self.client.put("/api/quiz/check/", {"quiz_id": quiz_id, "answers": answers})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Quiz.objects.get(id=quiz_id).is_finished)
+
+    def test_check_quiz_with_malformed_answers(self):
+        response = self.client.post(self.url + "?answer_key=True", {"flashcards_set": self.flashcards_set.id})
+        quiz_id = response.data[0].get("quiz_id")
+        token = response.data[0].get("answer_key")
+        for data in [{"answer_key": token}, {"answer_key": token, "answers": "{"},
+                     {"quiz_id": quiz_id}, {"quiz_id": quiz_id, "answers": "[1, 2]"},
+                     {"quiz_id": "x", "answers": "{}"}]:
+            response = self.client.put("/api/quiz/check/", data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Quiz.objects.get(id=quiz_id).is_finished)
+
+
+class ReviewTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("tester", "Wy w ciemnościach – reflektory chronią was")
+        self.another_user = User.objects.create_user("tester2", "Oświetlając tylko scenę, na niej mnie!")
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name="test", level="easy")
+        flashcards_set = FlashcardsSet.objects.create(name="testowy", author=self.user, category=category)
+        self.flashcards = [
+            Flashcard.objects.create(front=f"przód {i}", back=f"tył {i}", flashcard_set=flashcards_set,
+                                     author=self.user)
+            for i in range(3)
+        ]
+        Flashcard.objects.create(front="cudza", back="fiszka", flashcard_set=flashcards_set, author=self.another_user)
+
+    def test_get_due_reviews(self):
+        response = self.client.get("/api/review/due/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r.get("front") for r in response.data], ["przód 0", "przód 1", "przód 2"])
+        self.assertEqual(response.data[0].get("flashcard"), self.flashcards[0].id)
+        self.assertEqual(response.data[0].get("ease"), 250)
+        response = self.client.get("/api/review/due/", {"limit": 2})
+        self.assertEqual(len(response.data), 2)
+        response = self.client.get("/api/review/due/", {"limit": 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_due_reviews_use_index(self):
+        plan = ReviewState.due(self.user, 50).explain()
+        self.assertIn("review_due_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_answer_reviews(self):
+        answers = [
+            {"flashcard": self.flashcards[0].id, "quality": 5},
+            {"flashcard": self.flashcards[1].id, "quality": 2},
+            {"flashcard": 9999, "quality": 4},
+        ]
+        # stany fiszek i jeden UPDATE dla całej sesji
+        with self.assertNumQueries(2):
+            response = self.client.post("/api/review/answers/", {"answers": answers}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual([r.get("interval") for r in results[:2]], [1, 1])
+        self.assertEqual(results[2], {"flashcard": 9999, "error": "Fiszka nie istnieje."})
+        states = {state.flashcard_id: state for state in ReviewState.objects.filter(user=self.user)}
+        self.assertEqual((states[self.flashcards[0].id].ease, states[self.flashcards[0].id].repetitions), (260, 1))
+        self.assertEqual(states[self.flashcards[1].id].ease, 218)
+        response = self.client.get("/api/review/due/")
+        self.assertEqual([r.get("front") for r in response.data], ["przód 2"])
+
+        response = self.client.post("/api/review/answers/", {"answers": [{"flashcard": 1, "quality": 6}]},
+                                    format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for data in [[1, 2], {}, {"answers": {"flashcard": 1, "quality": 3}}]:
+            response = self.client.post("/api/review/answers/", data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_schedule_follows_sm2(self):
+        state = ReviewState.objects.get(flashcard=self.flashcards[0])
+        intervals = []
+        for quality in [5, 5, 5, 1, 4]:
+            state.schedule(quality, state.due_at)
+            intervals.append(state.interval)
+        self.assertEqual(intervals, [1, 6, 16, 1, 1])
+        self.assertEqual(state.repetitions, 1)
+        for _ in range(10):
+            state.schedule(0, state.due_at)
+        self.assertEqual(state.ease, ReviewState.MIN_EASE)
+
+    def test_deleting_flashcard_removes_review_state(self):
+        self.flashcards[0].delete()
+        self.assertEqual(ReviewState.objects.filter(user=self.user).count(), 2)
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("tester", "Wy w ciemnościach – reflektory chronią was")
+        self.another_user = User.objects.create_user("tester2", "Oświetlając tylko scenę, na niej mnie!")
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name="test", level="easy")
+        self.flashcards_set = FlashcardsSet.objects.create(name="Gitara basowa", author=self.user,
+                                                           category=category)
+        self.private_set = FlashcardsSet.objects.create(name="Prywatne akordy", author=self.another_user,
+                                                        category=category, status="private")
+        self.flashcard = Flashcard.objects.create(front="Ile strun ma gitara?", back="Sześć",
+                                                  flashcard_set=self.flashcards_set, author=self.user)
+        Flashcard.objects.create(front="Akord gitarowy", back="C-dur",
+                                 flashcard_set=self.private_set, author=self.another_user)
+        self.url = "/api/search/"
+
+    def test_search_sets_and_flashcards(self):
+        response = self.client.get(self.url, {"q": "gitar"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(r.get("type"), r.get("id")) for r in response.data],
+                         [("set", self.flashcards_set.id), ("flashcard", self.flashcard.id)])
+
+    def test_search_ignores_diacritics_and_special_characters(self):
+        response = self.client.get(self.url, {"q": 'szesc "'})
+        self.assertEqual([r.get("id") for r in response.data], [self.flashcard.id])
+
+    def test_search_with_invalid_limit(self):
+        for limit in ["-1", "0", "101", "dużo"]:
+            response = self.client.get(self.url, {"q": "gitar", "limit": limit})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.client.get(self.url, {"q": "gitar", "limit": 1}).data), 1)
+
+    def test_search_private_sets_of_owner(self):
+        self.client.force_authenticate(user=self.another_user)
+        response = self.client.get(self.url, {"q": "akord"})
+        self.assertEqual(len(response.data), 2)
+
+    def test_search_index_follows_updates_and_deletes(self):
+        self.flashcard.front = "Ile strun ma skrzypce?"
+        self.flashcard.save()
+        response = self.client.get(self.url, {"q": "gitara"})
+        self.assertEqual([r.get("type") for r in response.data], ["set"])
+        self.flashcards_set.delete()
+        self.assertEqual(self.client.get(self.url, {"q": "skrzypce"}).data, [])
+
+    def test_rebuild_search_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM api_searchindex")
+        self.assertEqual(self.client.get(self.url, {"q": "gitara"}).data, [])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(len(self.client.get(self.url, {"q": "gitara"}).data), 2)
+
+
+class TokenCacheTests(APITestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user("tester", "Wy w ciemnościach – reflektory chronią was")
+        self.token = Token.objects.get(user__username='tester')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.url = "/api/category/"
+
+    def test_token_lookup_is_cached(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        self.assertEqual((token_cache.hits, token_cache.misses), (1, 1))
+
+    def test_deleted_token_is_not_cached(self):
+        self.client.get(self.url)
+        self.token.delete()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_not_cached(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cache_evicts_least_recently_used_and_expired_entries(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        cache.ttl = -1
+        cache.set("d", 4)
+        self.assertIsNone(cache.get("d"))
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        registry.clear()
+        self.user = User.objects.create_user("tester", "Wy w ciemnościach – reflektory chronią was")
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "Oświetlając tylko scenę")
+        self.url = "/api/_metrics/"
+
+    def test_metrics_record_requests_and_queries(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.get("/api/category/")
+        self.client.get("/api/category/")
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn('flashwise_request_duration_seconds_count{view="category-list",method="GET"} 2', body)
+        self.assertIn('flashwise_request_duration_seconds_bucket{view="category-list",method="GET",le="+Inf"} 2',
+                      body)
+        self.assertIn('flashwise_db_queries_total{view="category-list",method="GET"} 2', body)
+        self.assertIn("flashwise_token_cache_hits_total", body)
+
+    def test_metrics_are_admin_only(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class LogBufferTests(APITestCase):
+    def setUp(self):
+        log_buffer.discard()
+        self.user = User.objects.create_user("tester", "Wy w ciemnościach – reflektory chronią was")
+        self.category = Category.objects.create(name="test", level="easy")
+
+    def test_events_are_flushed_on_size_threshold(self):
+        buffer = LogBuffer(max_size=3, flush_interval=60)
+        buffer.add(self.user.id, "A1")
+        buffer.add(self.user.id, "B2")
+        self.assertFalse(buffer.is_due())
+        buffer.add(self.user.id, "B1")
+        self.assertTrue(buffer.is_due())
+        # użytkownicy zdarzeń i jeden INSERT
+        with self.assertNumQueries(2):
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(list(Log.objects.order_by("id").values_list("action", flat=True)), ["A1", "B2", "B1"])
+        self.assertFalse(buffer.is_due())
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_events_are_flushed_on_time_threshold(self):
+        buffer = LogBuffer(max_size=100, flush_interval=0)
+        self.assertFalse(buffer.is_due())
+        buffer.add(self.user.id, "A1")
+        self.assertTrue(buffer.is_due())
+
+    def test_events_keep_their_timestamp(self):
+        buffer = LogBuffer(max_size=100, flush_interval=60)
+        buffer.add(self.user.id, "A1")
+        logged_at = buffer.events[0].timestamp
+        buffer.flush()
+        self.assertEqual(Log.objects.get().timestamp, logged_at)
+
+    def test_requests_do_not_write_logs(self):
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/sets/", {"name": "testowy", "category": self.category.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Log.objects.exists())
+        self.assertEqual([event.action for event in log_buffer.events], ["B2"])
+
+        with mock.patch.object(log_buffer, "max_size", 1):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post("/api/flashcards/",
+                                 {"front": "przód", "back": "tył", "flashcard_set": response.data["id"]})
+            # w teście transakcja zatwierdza się dopiero po żądaniu, więc bufor zapisuje kolejne
+            self.client.get("/api/sets/")
+        self.assertEqual(sorted(Log.objects.values_list("action", flat=True)), ["B1", "B2"])
+        self.assertEqual(log_buffer.events, [])
+
+    def test_login_is_logged(self):
+        self.client.force_login(self.user)
+        self.assertEqual([event.action for event in log_buffer.events], ["A1"])
+
+    def test_token_and_session_logins_are_logged(self):
+        password = "Kolejny dzień, kolejna noc"
+        # przy SESSION_LOGIN = False rejestracja wydaje token, a allauth i tak loguje użytkownika przez login()
+        response = self.client.post("/api/register", {"username": "nowy", "password1": password,
+                                                      "password2": password})
+        self.assertIn("key", response.data)
+        user = User.objects.get(username="nowy")
+        self.assertEqual([(event.user_id, event.action) for event in log_buffer.events], [(user.id, "A1")])
+
+        log_buffer.discard()
+        self.client.logout()
+        self.client.post("/auth/login/", {"username": "nowy", "password": password})
+        self.assertEqual([event.action for event in log_buffer.events], ["A2", "A1"])
+
+    def test_due_events_are_flushed_by_timer(self):
+        buffer = LogBuffer(max_size=100, flush_interval=0.01, timer=True)
+        flushed = threading.Event()
+        # bez żadnego żądania zapis wykonuje wątek w tle
+        with mock.patch.object(buffer, "flush", side_effect=flushed.set):
+            buffer.add(self.user.id, "A1")
+            self.assertTrue(flushed.wait(5))
+            buffer.stop_timer()
+
+    def test_failed_flush_keeps_events(self):
+        buffer = LogBuffer(max_size=1, flush_interval=60)
+        buffer.add(self.user.id, "A1")
+        buffer.add(self.user.id, "B2")
+        with mock.patch.object(Log.objects, "bulk_create", side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+            self.assertEqual([event.action for event in buffer.events], ["A1", "B2"])
+            self.assertTrue(buffer.is_due())
+            # ponad twardy limit (10 zdarzeń) odrzucane są najstarsze
+            with self.assertLogs("api.audit", level="ERROR"):
+                buffer.add(self.user.id, "B1", count=10)
+            self.assertEqual(([event.action for event in buffer.events], buffer.dropped), (["B1"] * 10, 2))
+
+            log_buffer.add(self.user.id, "A1")
+            with mock.patch.object(log_buffer, "max_size", 1), self.assertLogs("api.audit", level="ERROR"):
+                response = self.client.get("/api/sets/")
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual([event.action for event in log_buffer.events], ["A1"])
+        self.assertEqual(buffer.flush(), 10)
+
+    def test_events_of_deleted_users_are_dropped(self):
+        another_user = User.objects.create_user("tester2", "Oświetlając tylko scenę, na niej mnie!")
+        buffer = LogBuffer(max_size=100, flush_interval=60)
+        buffer.add(self.user.id, "A1")
+        buffer.add(another_user.id, "A1")
+        another_user.delete()
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual((Log.objects.get().user_id, buffer.dropped), (self.user.id, 1))
+
+
+class LogCompactionTests(APITestCase):
+    def setUp(self):
+        log_buffer.discard()
+        self.user = User.objects.create_user("tester", "Wy w ciemnościach – reflektory chronią was")
+        self.now = timezone.now()
+        self.log(100, "A1", "A1", "B1")
+        self.log(10, "B2", "B1")
+        self.log(0, "A1")
+
+    def log(self, days_ago, *actions):
+        Log.objects.bulk_create([
+            Log(user=self.user, action=action, timestamp=self.now - timedelta(days=days_ago)) for action in actions
+        ])
+
+    def compact(self, retention_days=30, batch_size=2):
+        stdout = StringIO()
+        call_command("compact_logs", retention_days=retention_days, batch_size=batch_size, stdout=stdout)
+        return stdout.getvalue()
+
+    def activity(self):
+        return {(a.day, a.action): a.count for a in DailyActivity.objects.all()}
+
+    def test_compact_logs(self):
+        output = self.compact()
+        self.assertIn("Rolled up 6 log event(s)", output)
+        self.assertIn("Deleted 3 log event(s) older than 30 day(s)", output)
+        def day(days_ago):
+            return (self.now - timedelta(days=days_ago)).date()
+        self.assertEqual(self.activity(), {
+            (day(100), "A1"): 2, (day(100), "B1"): 1, (day(10), "B2"): 1, (day(10), "B1"): 1, (day(0), "A1"): 1,
+        })
+        self.assertEqual(Log.objects.count(), 3)
+
+        self.log(0, "A1", "B1")
+        self.compact()
+        self.assertEqual(self.activity()[(day(0), "A1")], 2)
+        self.assertEqual(self.activity()[(day(0), "B1")], 1)
+        self.assertEqual(sum(self.activity().values()), 8)
+
+    def test_compact_logs_never_deletes_events_before_rollup(self):
+        call_command("compact_logs", retention_days=0, batch_size=4, stdout=StringIO())
+        self.assertFalse(Log.objects.exists())
+        self.assertEqual(sum(self.activity().values()), 6)
+        with self.assertRaises(CommandError):
+            self.compact(batch_size=0)
+
+    def test_get_activity(self):
+        self.compact()
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get("/api/activity/", {"days": 30})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(a["action"], a["count"]) for a in response.data], [("B1", 1), ("B2", 1), ("A1", 1)])
+        activity = DailyActivity.objects.filter(user=self.user, day__gt=self.now.date()).order_by("day", "action")
+        plan = activity.explain()
+        self.assertIn("(user_id=? AND day>?)", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class CatalogueCacheTests(APITestCase):
+    def setUp(self):
+        catalogue_cache.clear()
+        self.user = User.objects.create_user("tester", "Wy w ciemnościach – reflektory chronią was")
+        self.another_user = User.objects.create_user("tester2", "Oświetlając tylko scenę, na niej mnie!")
+        self.category = Category.objects.create(name="test", level="easy")
+        self.another_category = Category.objects.create(name="test2", level="easy")
+        self.flashcards_set = FlashcardsSet.objects.create(name="testowy", author=self.user, category=self.category)
+        FlashcardsSet.objects.create(name="inny", author=self.another_user, category=self.another_category)
+        self.client.force_authenticate(user=self.user)
+        self.url = "/api/sets/"
+
+    def names(self, params, url=None):
+        response = self.client.get(url or self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"] if url is None else response.data
+        return [s.get("name") for s in results]
+
+    def test_public_catalogue_is_cached(self):
+        self.assertEqual(self.names({"author": "tester2"}), ["inny"])
+        hits = catalogue_cache.hits.get("list", 0)
+        # wersje list i id autora, bez zapytania o zestawy
+        with self.assertNumQueries(2):
+            self.assertEqual(self.names({"author": "tester2"}), ["inny"])
+        self.assertEqual(catalogue_cache.hits["list"], hits + 1)
+
+        self.client.force_authenticate(user=self.another_user)
+        self.assertEqual(self.names({"author": "tester2"}), ["inny"])
+        self.assertEqual(catalogue_cache.hits["list"], hits + 2)
+        self.assertEqual(self.names({"user_only": "True"}), ["inny"])
+        self.assertEqual(catalogue_cache.hits["list"], hits + 2)
+
+        self.assertEqual(self.names({}, url="/api/sets/top/"), ["testowy", "inny"])
+        with self.assertNumQueries(0):
+            self.names({}, url="/api/sets/top/")
+
+    def test_catalogue_cache_is_invalidated_per_author_and_category(self):
+        self.names({"author": "tester"})
+        self.names({"author": "tester2"})
+        self.names({"category": "test2"}, url="/api/sets/top/")
+        hits = catalogue_cache.hits.get("list", 0)
+
+        FlashcardsSet.objects.create(name="drugi", author=self.user, category=self.category)
+        FlashcardsSet.objects.create(name="prywatny", author=self.another_user, category=self.another_category,
+                                     status="private")
+        self.assertEqual(self.names({"author": "tester"}), ["testowy", "drugi"])
+        self.assertEqual(self.names({"author": "tester2"}), ["inny"])
+        self.assertEqual(catalogue_cache.hits["list"], hits + 1)
+        top_hits = catalogue_cache.hits.get("top", 0)
+        self.assertEqual(self.names({"category": "test2"}, url="/api/sets/top/"), ["inny"])
+        self.assertEqual(catalogue_cache.hits["top"], top_hits + 1)
+
+        self.flashcards_set.category = self.another_category
+        self.flashcards_set.save()
+        self.assertEqual(self.names({"category": "test2"}, url="/api/sets/top/"), ["testowy", "inny"])
+        Rating.objects.create(set=FlashcardsSet.objects.get(name="inny"), user=self.user, rate=5)
+        self.assertEqual(self.names({"category": "test2"}, url="/api/sets/top/"), ["inny", "testowy"])
+        self.flashcards_set.delete()
+        self.assertEqual(self.names({"author": "tester"}), ["drugi"])
+
+    def test_catalogue_cache_metrics(self):
+        self.names({"author": "tester2"})
+        self.names({"author": "tester2"})
+        body = registry.render()
+        self.assertIn('flashwise_catalogue_cache_hits_total{endpoint="list"}', body)
+        self.assertIn('flashwise_catalogue_cache_misses_total{endpoint="list"}', body)
+        self.assertIn("flashwise_catalogue_cache_invalidations_total", body)
+
+
+class SeedTests(APITestCase):
+    def seed(self, prefix, seed=1):
+        call_command("seed_flashwise", users=3, sets=4, cards_per_set=5, ratings=6, quizzes=2, seed=seed,
+                     batch_size=7, prefix=prefix, stdout=StringIO())
+
+    def test_seed_flashwise(self):
+        self.seed("a")
+        self.assertEqual(User.objects.filter(username__startswith="a").count(), 3)
+        self.assertEqual(Token.objects.count(), 3)
+        self.assertEqual(FlashcardsSet.objects.count(), 4)
+        self.assertEqual(Flashcard.objects.count(), 20)
+        self.assertEqual(Rating.objects.count(), 6)
+        self.assertEqual(Quiz.objects.count(), 2)
+        self.assertTrue(Tag.objects.exists())
+        self.assertFalse(Flashcard.objects.filter(content_hash__isnull=True).exists())
+        self.assertEqual(sum(FlashcardsSet.objects.values_list("rating_count", flat=True)), 6)
+        call_command("rebuild_flashcard_counts", "--check", stdout=StringIO())
+
+    def test_seed_flashwise_is_deterministic(self):
+        self.seed("a")
+        names = list(FlashcardsSet.objects.order_by("id").values_list("name", flat=True))
+        fronts = list(Flashcard.objects.order_by("id").values_list("front", flat=True))
+        self.seed("b")
+        self.assertEqual(list(FlashcardsSet.objects.order_by("id").values_list("name", flat=True))[4:], names)
+        self.assertEqual(list(Flashcard.objects.order_by("id").values_list("front", flat=True))[20:], fronts)
+
+    def test_seed_flashwise_with_existing_prefix(self):
+        self.seed("a")
+        with self.assertRaises(CommandError):
+            self.seed("a", seed=2)
+
+    def test_list_endpoints_use_indexes(self):
+        call_command("seed_flashwise", users=5, sets=60, cards_per_set=5, ratings=100, quizzes=0, seed=1,
+                     prefix="a", stdout=StringIO())
+        user = User.objects.get(username="a0")
+        flashcards_set = FlashcardsSet.objects.filter(author=user).first()
+        self.client.force_authenticate(user=user)
+        urls = [
+            ("/api/sets/", {"category": flashcards_set.category.name}),
+            ("/api/sets/", {"author": "a1"}),
+            ("/api/sets/", {"user_only": "True"}),
+            ("/api/flashcards/", {}),
+            ("/api/flashcards/", {"flashcard_set": flashcards_set.name}),
+            ("/api/ratings/", {"flashcard_set": flashcards_set.name}),
+        ]
+        for url, params in urls:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            selects = [query["sql"] for query in queries if query["sql"].startswith("SELECT")]
+            self.assertTrue(selects)
+            for sql in selects:
+                with connection.cursor() as cursor:
+                    cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                    plan = [row[-1] for row in cursor.fetchall()]
+                self.assertFalse([step for step in plan if step.startswith("SCAN")], (url, params, plan))
+
+    def test_benchmark_api(self):
+        self.seed("a")
+        stdout = StringIO()
+        call_command("benchmark_api", requests=60, warmup=5, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report["requests"], 60)
+        self.assertEqual(report["scenarios"]["all"]["count"], 60)
+        for name, stats in report["scenarios"].items():
+            if stats["count"]:
+                self.assertLessEqual(stats["p50_ms"], stats["p99_ms"])
+        self.assertEqual(Rating.objects.count(), 6)
+        self.assertEqual(Quiz.objects.count(), 2)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTests(APITransactionTestCase):
+    # kopia bazy przez API backupu SQLite widzi tylko zatwierdzone dane, więc bez transakcji testu
+    @classmethod
+    def setUpClass(cls):
+        # replika to kopia pliku bazy testowej, tak jak lokalnie po manage.py sync_replicas
+        super().setUpClass()
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        connections.settings["replica"] = dict(connections.settings["default"],
+                                               NAME=os.path.join(cls.replica_dir.name, "replica.sqlite3"))
+
+    @classmethod
+    def tearDownClass(cls):
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        cls.replica_dir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        pin_cache().clear()
+        catalogue_cache.clear()
+        self.user = User.objects.create_user("tester", "Kiedy rano wstaję, jestem nieprzytomny")
+        self.another_user = User.objects.create_user("tester2", "Choć gdzieś w oddali pieje kogut")
+        self.category = Category.objects.create(name="test", level="easy")
+        self.flashcards_set = FlashcardsSet.objects.create(name="testowy", author=self.user, category=self.category)
+        copy_sqlite_database("default", "replica")
+        self.client.force_authenticate(user=self.user)
+
+    def names(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [flashcards_set["name"] for flashcards_set in response.data["results"]]
+
+    def test_reads_go_to_replica(self):
+        # zmiana zapisana poza API nie trafiła jeszcze do repliki
+        new_set = FlashcardsSet.objects.create(name="nowy", author=self.user, category=self.category)
+        self.assertEqual(self.names("/api/sets/?user_only=True"), ["testowy"])
+        self.assertEqual(self.client.get(f"/api/sets/{new_set.id}/").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(f"/api/sets/{self.flashcards_set.id}/").status_code, status.HTTP_200_OK)
+
+    def test_write_pins_user_to_primary(self):
+        response = self.client.post("/api/sets/", {"name": "nowy", "category": self.category.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.names("/api/sets/?user_only=True"), ["testowy", "nowy"])
+        self.assertEqual(self.client.get(f"/api/sets/{response.data['id']}/").status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(user=self.another_user)
+        self.assertEqual(self.names("/api/sets/"), ["testowy"])
+
+    def test_pin_is_visible_to_other_server_processes(self):
+        with tempfile.TemporaryDirectory() as location:
+            pins = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": location}
+            with override_settings(CACHES=dict(settings.CACHES, replica_pins=pins)):
+                response = self.client.post("/api/sets/", {"name": "nowy", "category": self.category.id},
+                                            format="json")
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                # inny proces ma własne obiekty pamięci podręcznej, ale współdzieli jej katalog
+                self.assertTrue(FileBasedCache(location, {}).get(pin_key(self.user.id)))
+
+    def test_replicas_require_shared_pin_cache(self):
+        self.assertEqual([error.id for error in check_replica_pin_cache(None)], ["api.E001"])
+        pins = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": self.replica_dir.name}
+        with override_settings(CACHES=dict(settings.CACHES, replica_pins=pins)):
+            self.assertEqual(check_replica_pin_cache(None), [])
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(check_replica_pin_cache(None), [])
+
+    def test_catalogue_cache_is_filled_from_primary(self):
+        FlashcardsSet.objects.create(name="nowy", author=self.user, category=self.category)
+        self.client.force_authenticate(user=self.another_user)
+        self.assertEqual(self.names("/api/sets/?author=tester"), ["testowy", "nowy"])
+
+    def test_sync_replicas_requires_replicas(self):
+        with override_settings(DATABASE_REPLICAS=[]):
+            with self.assertRaises(CommandError):
+                call_command("sync_replicas")
+        with self.assertRaises(CommandError):
+            call_command("sync_replicas", "default")
+
+
+@override_settings(FLASHCARD_SHARDS=["default", "shard"])
+class ShardingTests(APITransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.shard_dir = tempfile.TemporaryDirectory()
+        connections.settings["shard"] = dict(connections.settings["default"],
+                                             NAME=os.path.join(cls.shard_dir.name, "shard.sqlite3"))
+        call_command("migrate", database="shard", verbosity=0)
+        # baza testowa powstała bez FLASHCARD_SHARDS, więc ponownie stosujemy migrację zdejmującą więzy
+        call_command("migrate", "api", "0024", database="default", verbosity=0)
+        call_command("migrate", "api", database="default", verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections["shard"].close()
+        del connections["shard"]
+        del connections.settings["shard"]
+        cls.shard_dir.cleanup()
+        call_command("migrate", "api", "0024", database="default", verbosity=0)
+        super().tearDownClass()
+        call_command("migrate", "api", database="default", verbosity=0)
+
+    def setUp(self):
+        cache.clear()
+        catalogue_cache.clear()
+        users = [User.objects.create_user("tester", "Kolejny dzień, kolejna noc"),
+                 User.objects.create_user("tester2", "Niczego więcej nie chcę")]
+        # autorzy o parzystym id zostają w bazie domyślnej, a o nieparzystym trafiają na "shard"
+        self.user, self.shard_user = sorted(users, key=lambda user: user.id % 2)
+        self.category = Category.objects.create(name="test", level="easy")
+
+    def tearDown(self):
+        call_command("flush", database="shard", interactive=False, inhibit_post_migrate=True, verbosity=0)
+        with connections["shard"].cursor() as cursor:
+            cursor.execute("DELETE FROM api_searchindex")
+
+    def create_set(self, user, name, count=0, set_status="public"):
+        self.client.force_authenticate(user=user)
+        response = self.client.post("/api/sets/", {"name": name, "category": self.category.id, "status": set_status},
+                                    format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        for i in range(count):
+            self.client.post("/api/flashcards/", {"front": f"{name} {i}", "back": f"odpowiedź {i}",
+                                                  "flashcard_set": response.data["id"]}, format="json")
+        return response.data["id"]
+
+    def names(self, url, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"] if isinstance(response.data, dict) else response.data
+        return [flashcards_set["name"] for flashcards_set in results]
+
+    def foreign_keys(self, using, table):
+        with connections[using].cursor() as cursor:
+            constraints = connections[using].introspection.get_constraints(cursor, table)
+        return {column for constraint in constraints.values() if constraint["foreign_key"]
+                for column in constraint["columns"]}
+
+    def test_sharded_databases_drop_cross_database_constraints(self):
+        for using in ["default", "shard"]:
+            self.assertEqual(self.foreign_keys(using, "api_flashcardsset"), set())
+            self.assertEqual(self.foreign_keys(using, "api_flashcard"), {"flashcard_set_id"})
+            self.assertEqual(self.foreign_keys(using, "api_rating"), {"user_id"})
+
+    def test_table_rebuild_keeps_cross_database_constraints_dropped(self):
+        # SQLite przebudowuje tabelę ze stanu migracji, więc stan musi pamiętać zdjęte więzy
+        state = MigrationExecutor(connections["shard"]).loader.project_state()
+        model = state.apps.get_model("api", "FlashcardsSet")
+        old_field = model._meta.get_field("name")
+        new_field = old_field.clone()
+        new_field.max_length = 128
+        new_field.set_attributes_from_name("name")
+        with connections["shard"].schema_editor() as schema_editor:
+            schema_editor.alter_field(model, old_field, new_field)
+        self.assertEqual(self.foreign_keys("shard", "api_flashcardsset"), set())
+        with connections["shard"].schema_editor() as schema_editor:
+            schema_editor.alter_field(model, new_field, old_field)
+
+    def test_flashcard_in_set_on_another_shard(self):
+        set_id = self.create_set(self.user, "lokalny")
+        self.client.force_authenticate(user=self.shard_user)
+        flashcard = {"front": "przód", "back": "tył", "flashcard_set": set_id}
+        response = self.client.post("/api/flashcards/", flashcard, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["flashcard_set"],
+                         ["Flashcards set is stored on a different shard than your flashcards."])
+        # błąd klucza obcego z pominiętą walidacją nie jest zgłaszany jako duplikat
+        with mock.patch.object(FlashcardSerializer, "validate", lambda serializer, data: data):
+            with self.assertRaises(IntegrityError):
+                self.client.post("/api/flashcards/", flashcard, format="json")
+        self.assertFalse(Flashcard.objects.using("shard").exists())
+
+    def test_author_data_lives_on_author_shard(self):
+        set_id = self.create_set(self.shard_user, "zdalny", count=2)
+        self.assertEqual(shard_for(self.shard_user.id), "shard")
+        self.assertGreaterEqual(set_id, SHARD_ID_SPAN)
+        self.assertFalse(FlashcardsSet.objects.using("default").filter(id=set_id).exists())
+        flashcards_set = FlashcardsSet.objects.using("shard").get(id=set_id)
+        self.assertEqual(flashcards_set.flashcard_count, 2)
+        self.assertEqual(Flashcard.objects.using("shard").filter(flashcard_set_id=set_id).count(), 2)
+        self.assertEqual(ReviewState.objects.using("shard").filter(user=self.shard_user).count(), 2)
+
+        response = self.client.get("/api/flashcards/", {"flashcard_set": "zdalny"})
+        self.assertEqual([flashcard["front"] for flashcard in response.data["results"]], ["zdalny 0", "zdalny 1"])
+        self.assertEqual(len(self.client.get("/api/review/due/").data), 2)
+        response = self.client.patch(f"/api/sets/{set_id}/", {"name": "zmieniony"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(FlashcardsSet.objects.using("shard").get(id=set_id).name, "zmieniony")
+
+    def test_catalogue_merges_shards(self):
+        first = self.create_set(self.user, "pierwszy")
+        second = self.create_set(self.shard_user, "drugi")
+        self.create_set(self.shard_user, "prywatny", set_status="private")
+        self.assertEqual(self.names("/api/sets/", self.user), ["pierwszy", "drugi"])
+        self.assertEqual(self.names(f"/api/sets/?author={self.shard_user.username}", self.user), ["drugi"])
+        self.assertEqual(self.names("/api/sets/?category=test&user_only=True", self.shard_user),
+                         ["drugi", "prywatny"])
+
+        self.client.force_authenticate(user=self.user)
+        self.client.post("/api/ratings/", {"set": first, "rate": 2}, format="json")
+        self.client.post("/api/ratings/", {"set": second, "rate": 5}, format="json")
+        self.assertEqual(FlashcardsSet.objects.using("shard").get(id=second).rating_avg, 5)
+        self.assertEqual(self.names("/api/sets/top/", self.user), ["drugi", "pierwszy"])
+        self.assertEqual(self.names("/api/sets/top/?limit=1", self.user), ["drugi"])
+
+    def test_quiz_on_set_from_another_shard(self):
+        set_id = self.create_set(self.shard_user, "zdalny", count=4)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post("/api/quiz/generate/", {"flashcards_set": set_id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        quiz_id = response.data[0].get("quiz_id")
+        self.assertEqual(Quiz.objects.using("default").get(id=quiz_id).flashcards_set_id, set_id)
+        self.assertEqual(QuizQuestion.objects.using("default").filter(quiz_id=quiz_id).count(), 4)
+
+        answers = {str(question.id): question.correct_answer
+                   for question in QuizQuestion.objects.filter(quiz_id=quiz_id)}
+        response = self.client.post("/api/quiz/check/batch/", {"quizzes": [{"quiz_id": quiz_id, "answers": answers}]},
+                                    format="json")
+        self.assertEqual(response.data["results"][0].get("final_score"), 4)
+
+        # quiz autora z drugiego sharda leży razem z jego zestawami
+        self.client.force_authenticate(user=self.shard_user)
+        # bez transakcji testu on_commit od razu wysłałby zadanie do wątku, który ścigałby się z testem
+        with mock.patch("api.jobs.get_executor"):
+            response = self.client.post("/api/quiz/generate/?async=True", {"flashcards_set": set_id})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        run_quiz_job(response.data["job_id"])
+        job = QuizJob.objects.using("shard").get(id=response.data["job_id"])
+        self.assertEqual(job.status, "done")
+        self.assertEqual(self.client.get(f"/api/quiz/jobs/{job.id}/").data["status"], "done")
+
+    def test_search_merges_shards(self):
+        self.create_set(self.user, "Gitara basowa")
+        self.create_set(self.shard_user, "Gitara elektryczna", count=1)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get("/api/search/", {"q": "gitara"})
+        self.assertEqual(sorted(result["name"] for result in response.data if result["type"] == "set"),
+                         ["Gitara basowa", "Gitara elektryczna"])
+
+    def test_deleting_set_and_user_cleans_other_databases(self):
+        set_id = self.create_set(self.shard_user, "zdalny", count=4)
+        self.client.force_authenticate(user=self.user)
+        self.client.post("/api/ratings/", {"set": set_id, "rate": 4}, format="json")
+        self.client.post("/api/quiz/generate/", {"flashcards_set": set_id})
+        self.assertEqual(Rating.objects.count(), 1)
+
+        self.shard_user.delete()
+        self.assertFalse(FlashcardsSet.objects.using("shard").exists())
+        self.assertFalse(Flashcard.objects.using("shard").exists())
+        self.assertEqual(Rating.objects.count(), 0)
+        self.assertFalse(Quiz.objects.using("default").exists())
+
+    def test_rebalance_shards_moves_authors(self):
+        with override_settings(FLASHCARD_SHARDS=["default"]):
+            set_id = self.create_set(self.shard_user, "przenoszony", count=4)
+            quiz_id = self.client.post("/api/quiz/generate/", {"flashcards_set": set_id}).data[0].get("quiz_id")
+        self.assertTrue(FlashcardsSet.objects.using("default").filter(id=set_id).exists())
+
+        out = StringIO()
+        call_command("rebalance_shards", "--dry-run", stdout=out)
+        self.assertIn(f"Author {self.shard_user.id}: default -> shard", out.getvalue())
+        self.assertTrue(FlashcardsSet.objects.using("default").filter(id=set_id).exists())
+
+        call_command("rebalance_shards", stdout=StringIO())
+        self.assertFalse(FlashcardsSet.objects.using("default").filter(id=set_id).exists())
+        self.assertEqual(FlashcardsSet.objects.using("shard").get(id=set_id).flashcard_count, 4)
+        self.assertEqual(QuizAnswer.objects.using("shard").filter(question__quiz_id=quiz_id).count(), 16)
+        self.assertEqual(Quiz.questions.through.objects.using("shard").filter(quiz_id=quiz_id).count(), 4)
+        self.assertEqual(self.client.get(f"/api/quiz/generate/{quiz_id}/").status_code, status.HTTP_200_OK)
+        self.assertEqual(self.names("/api/sets/?user_only=True", self.shard_user), ["przenoszony"])
+        self.assertEqual(len(self.client.get("/api/search/", {"q": "przenoszony"}).data), 5)
+
+        # nowe wiersze dostają id z zakresu sharda, więc nie kolidują z przeniesionymi
+        self.assertGreaterEqual(self.create_set(self.shard_user, "nowy"), SHARD_ID_SPAN)
+        call_command("rebalance_shards", stdout=out)
+        self.assertIn("Moved 0 author(s).", out.getvalue())
+
+    def test_queries_across_shards(self):
+        other = Category.objects.create(name="inna", level="easy")
+        self.create_set(self.user, "a", count=1)
+        self.create_set(self.shard_user, "b", count=3)
+        self.create_set(self.shard_user, "c")
+        FlashcardsSet.objects.filter(name="c").update(category=other)
+        self.assertEqual(list(FlashcardsSet.objects.order_by("-flashcard_count").values_list("name", flat=True)),
+                         ["b", "a", "c"])
+        rows = FlashcardsSet.objects.order_by("flashcard_count").values_list("name", named=True)[1:]
+        self.assertEqual([row.name for row in rows], ["a", "b"])
+        flashcards = Flashcard.objects.order_by("-flashcard_set__name", "front")
+        self.assertEqual(list(flashcards.values_list("front", flat=True)), ["b 0", "b 1", "b 2", "a 0"])
+        with self.assertRaises(ValueError):
+            list(FlashcardsSet.objects.order_by("author__username"))
+        self.assertEqual(len(FlashcardsSet.objects.order_by("?")[:2]), 2)
+        self.assertEqual(sorted(s.name for s in FlashcardsSet.objects.order_by("?")), ["a", "b", "c"])
+
+        self.assertEqual(FlashcardsSet.objects.aggregate(Count("id"), Sum("flashcard_count"), Max("flashcard_count"),
+                                                         categories=Count("category", distinct=True)),
+                         {"id__count": 3, "flashcard_count__sum": 4, "flashcard_count__max": 3, "categories": 2})
+        self.assertAlmostEqual(FlashcardsSet.objects.aggregate(Avg("flashcard_count"))["flashcard_count__avg"], 4 / 3)
+        self.assertEqual(FlashcardsSet.objects.aggregate(s=Sum("flashcard_count", distinct=True))["s"], 4)
+        self.assertAlmostEqual(FlashcardsSet.objects.aggregate(v=Variance("flashcard_count"))["v"], 14 / 9)
+        self.assertEqual(FlashcardsSet.objects.order_by("name")[:2].aggregate(Sum("flashcard_count")),
+                         {"flashcard_count__sum": 4})
+        groups = FlashcardsSet.objects.values("category").annotate(sets=Count("id"), cards=Sum("flashcard_count"))
+        self.assertEqual(list(groups.order_by("-sets").values_list("category", "sets", "cards")),
+                         [(self.category.id, 2, 4), (other.id, 1, 0)])
+        self.assertEqual(groups.count(), 2)
+
+        flashcards_sets = FlashcardsSet.objects.order_by("name").prefetch_related("flashcard_set")
+        with self.assertNumQueries(2, using="default"), self.assertNumQueries(2, using="shard"):
+            self.assertEqual([len(s.flashcard_set.all()) for s in flashcards_sets], [1, 3, 0])
+
+    def test_seed_requires_unsharded_database(self):
+        with self.assertRaises(CommandError):
+            call_command("seed_flashwise", users=1, stdout=StringIO())
+
+
+def setUpModule():
+    # wątek zapisujący bufor w tle kolidowałby z transakcjami testów, które zapisują go jawnie
+    log_buffer.timer = False
 
 
+def tearDownModule():
+    # zdarzenia z testów nie mogą trafić do prawdziwej bazy przy zapisie bufora na wyjściu
+    log_buffer.discard()
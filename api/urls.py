@@ -9,10 +9,17 @@ router.register('flashcards', views.FlashcardViewSet, basename='flashcard')
 router.register('sets', views.FlashcardSetViewSet, basename='flashcardset')
 router.register('ratings', views.RatingList, basename='rating')
 router.register('quiz/generate', views.GenerateQuiz, basename='generate-quiz')
+router.register('quiz/jobs', views.QuizJobView, basename='quiz-job')
 router.register('category', views.CategoryList, basename='category')
 
 urlpatterns = [
-    path('quiz/check/', views.CheckQuizView.as_view(), name='check-quiz')
+    path('quiz/check/', views.CheckQuizView.as_view(), name='check-quiz'),
+    path('quiz/check/batch/', views.CheckQuizBatchView.as_view(), name='check-quiz-batch'),
+    path('review/due/', views.ReviewDueView.as_view(), name='review-due'),
+    path('review/answers/', views.ReviewAnswersView.as_view(), name='review-answers'),
+    path('activity/', views.ActivityView.as_view(), name='activity'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('_metrics/', views.MetricsView.as_view(), name='metrics'),
 ]
 
 urlpatterns += router.urls
@@ -1,28 +1,85 @@
+import csv
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
 from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import viewsets, mixins, status, permissions
-from rest_framework.generics import UpdateAPIView
+from rest_framework.decorators import action
+from rest_framework.generics import GenericAPIView, UpdateAPIView, get_object_or_404
+from rest_framework.views import APIView
 from rest_framework.response import Response
 
+from . import answer_keys
+from . import catalogue
+from . import conditional
+from . import exports
+from . import imports
+from . import jobs
+from . import metrics
 from . import models
+from . import pagination
+from . import renderers
+from . import replicas
+from . import search
 from . import serializers
+from . import shards
 
 
-class FlashcardViewSet(viewsets.ModelViewSet):
+class FlashcardViewSet(replicas.ReplicaReadMixin, conditional.ConditionalListMixin, viewsets.ModelViewSet):
     serializer_class = serializers.FlashcardSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = pagination.IdCursorPagination
+
+    def get_list_versions(self):
+        flashcard_set = self.request.query_params.get('flashcard_set', None)
+        if flashcard_set is None:
+            return None
+        flashcard_sets = models.FlashcardsSet.objects.filter(name=flashcard_set).order_by('id')
+        return list(flashcard_sets.values_list('id', 'version', 'modified'))
 
     def get_queryset(self):
-        queryset = models.Flashcard.objects.filter(author=self.request.user)
+        queryset = models.Flashcard.objects.for_author(self.request.user.id).filter(author=self.request.user)
         flashcard_set = self.request.query_params.get('flashcard_set', None)
         if flashcard_set is not None:
             queryset = queryset.filter(flashcard_set__name=flashcard_set)
         return queryset
 
 
-class FlashcardSetViewSet(viewsets.ModelViewSet):
+class FlashcardSetViewSet(replicas.ReplicaReadMixin,
+                          conditional.ConditionalListMixin,
+                          catalogue.CatalogueCacheMixin,
+                          viewsets.ModelViewSet):
     queryset = models.FlashcardsSet.objects.all()
     serializer_class = serializers.FlashcardSetSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = pagination.IdCursorPagination
+
+    def get_list_versions(self):
+        user_only = self.request.query_params.get('user_only', None)
+        author_name = self.request.query_params.get('author', None)
+        if author_name is not None and (user_only == "False" or user_only is None):
+            keys = [models.ListingVersion.user_key(self.get_author_id(author_name))]
+        elif user_only == "True":
+            keys = [models.ListingVersion.user_key(self.request.user.id)]
+        elif user_only == "False" or user_only is None:
+            keys = [models.ListingVersion.PUBLIC_SETS, models.ListingVersion.user_key(self.request.user.id)]
+        else:
+            return None
+        return models.ListingVersion.versions(keys)
+
+    def get_catalogue_scopes(self):
+        user_only = self.request.query_params.get('user_only', None)
+        author_name = self.request.query_params.get('author', None)
+        if author_name is None or (user_only != "False" and user_only is not None):
+            return None
+        return [catalogue.author_scope(self.get_author_id(author_name))]
+
+    def get_author_id(self, author_name):
+        if not hasattr(self, '_author_id'):
+            self._author_id = models.User.objects.filter(username=author_name).values_list('id', flat=True).first()
+        return self._author_id
 
     def get_queryset(self):
         category = self.request.query_params.get('category', None)
@@ -30,18 +87,77 @@ class FlashcardSetViewSet(viewsets.ModelViewSet):
         user_only = self.request.query_params.get('user_only', None)
         author_name = self.request.query_params.get('author', None)
         if category is not None:
-            self.queryset = self.queryset.filter(category__name=category)
+            # kategorie i użytkownicy leżą w bazie domyślnej, więc przy podziale danych na shardy
+            # nie da się ich złączyć z zestawami w jednym zapytaniu
+            if shards.is_enabled():
+                category_ids = list(models.Category.objects.filter(name=category).values_list('id', flat=True))
+                self.queryset = self.queryset.filter(category__in=category_ids)
+            else:
+                self.queryset = self.queryset.filter(category__name=category)
         if name is not None:
-            self.queryset = self.queryset.filter(Q(name__contains=name) | Q(slug__contains=name))
+            self.queryset = self.queryset.filter(name__contains=name)
         if author_name is not None and (user_only == "False" or user_only is None):
-            self.queryset = self.queryset.filter(Q(status="public") & Q(author__username=author_name))
+            if shards.is_enabled():
+                author_id = self.get_author_id(author_name)
+                self.queryset = self.queryset.for_author(author_id or 0).filter(status="public", author_id=author_id)
+            else:
+                self.queryset = self.queryset.filter(Q(status="public") & Q(author__username=author_name))
         elif user_only == "True":
-            self.queryset = self.queryset.filter(author=self.request.user)
+            self.queryset = self.queryset.for_author(self.request.user.id).filter(author=self.request.user)
         elif user_only == "False" or user_only is None:
             self.queryset = self.queryset.filter(Q(status="public") | Q(author=self.request.user))
 
         return self.queryset
 
+    @action(detail=False)
+    def top(self, request):
+        try:
+            limit = min(int(self.request.query_params.get('limit', 10)), 100)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response({"error": "Nieprawidłowy limit."}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = models.FlashcardsSet.objects.filter(status="public")
+        scopes = [catalogue.ALL_SETS]
+        category = self.request.query_params.get('category', None)
+        if category is not None:
+            category_ids = list(models.Category.objects.filter(name=category).values_list('id', flat=True))
+            queryset = queryset.filter(category__in=category_ids)
+            scopes = [catalogue.category_scope(category_id) for category_id in category_ids or [None]]
+        queryset = queryset.order_by('-rating_avg')[:limit]
+        data = catalogue.catalogue_cache.get_or_set(
+            "top", request, scopes, lambda: self.get_serializer(queryset, many=True).data
+        )
+        return Response(data)
+
+    @action(detail=True, methods=['post'], url_path='import')
+    def import_flashcards(self, request, pk=None):
+        flashcard_set = get_object_or_404(models.FlashcardsSet.objects.for_author(request.user.id), pk=pk,
+                                          author=request.user)
+        parser = imports.get_parser(request.content_type)
+        if parser is None:
+            return Response({"error": "Obsługiwane formaty to CSV i JSONL."},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        lines = iter(request.stream.readline, b"") if request.stream is not None else []
+        try:
+            report = imports.import_flashcards(flashcard_set, request.user, parser(lines))
+        except (UnicodeDecodeError, csv.Error):
+            return Response({"error": "Nie udało się odczytać pliku."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, renderer_classes=[renderers.CSVRenderer, renderers.JSONLRenderer])
+    def export(self, request, pk=None):
+        queryset = models.FlashcardsSet.objects.filter(Q(status="public") | Q(author=request.user))
+        flashcard_set = get_object_or_404(queryset, pk=pk)
+        if request.accepted_renderer.format == "jsonl":
+            rows = exports.export_jsonl(flashcard_set)
+        else:
+            rows = exports.export_csv(flashcard_set)
+        response = StreamingHttpResponse(rows, content_type=request.accepted_renderer.media_type)
+        filename = f"flashcards-{flashcard_set.id}.{request.accepted_renderer.format}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
 
 class TagList(viewsets.ModelViewSet):
     queryset = models.Tag.objects.all()
@@ -49,7 +165,7 @@ class TagList(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
 
-class CategoryList(viewsets.ModelViewSet):
+class CategoryList(replicas.ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = models.Category.objects.all()
     serializer_class = serializers.CategorySerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -65,11 +181,13 @@ class CategoryList(viewsets.ModelViewSet):
         return queryset
 
 
-class RatingList(mixins.CreateModelMixin,
+class RatingList(replicas.ReplicaReadMixin,
+                 mixins.CreateModelMixin,
                  mixins.ListModelMixin,
                  viewsets.GenericViewSet):
     serializer_class = serializers.RatingSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = pagination.IdCursorPagination
 
     def create(self, request, *args, **kwargs):
         user = request.user
@@ -80,27 +198,44 @@ class RatingList(mixins.CreateModelMixin,
                             data={'detail': 'Musisz być zalogowany, aby głosować.'})
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        try:
+            with transaction.atomic():
+                self.perform_create(serializer)
+        except IntegrityError:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'detail': 'Już zagłosowałeś na ten zestaw.'})
         headers = self.get_success_headers(serializer.data)
         return Response({"message": "Ocena została dodana!"}, status=status.HTTP_201_CREATED, headers=headers)
 
     def get_queryset(self):
         queryset = models.Rating.objects.all()
         flashcard_set = self.request.query_params.get('flashcard_set', None)
-        if flashcard_set is not None:
+        if flashcard_set is not None and shards.is_enabled():
+            set_ids = list(models.FlashcardsSet.objects.filter(name=flashcard_set).values_list('id', flat=True))
+            queryset = queryset.filter(set__in=set_ids)
+        elif flashcard_set is not None:
             queryset = queryset.filter(set__name=flashcard_set)
         return queryset
 
 
 class GenerateQuiz(mixins.CreateModelMixin,
+                   mixins.RetrieveModelMixin,
                    viewsets.GenericViewSet):
-    queryset = models.Quiz.objects.all()
     serializer_class = serializers.QuizSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        return models.Quiz.objects.for_author(self.request.user.id).filter(author=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return Response(instance.serialize_quiz(), status=status.HTTP_200_OK)
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        if self.request.query_params.get('async', None) == "True":
+            job = self.perform_create_async(serializer)
+            return Response({"job_id": job.id, "status": job.status}, status=status.HTTP_202_ACCEPTED)
         data = self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
         return Response(data, status=status.HTTP_201_CREATED, headers=headers)
@@ -108,19 +243,129 @@ class GenerateQuiz(mixins.CreateModelMixin,
     def perform_create(self, serializer):
         instance = serializer.save()
         data = instance.serialize_quiz()
+        if self.request.query_params.get('answer_key', None) == "True":
+            correct_answers = instance.questions.values_list("id", "correct_answer")
+            token = answer_keys.make_answer_key(instance.id, instance.author_id, correct_answers)
+            data = [dict(data[0], answer_key=token), *data[1:]]
         return data
 
+    def perform_create_async(self, serializer):
+        instance = models.Quiz(**serializer.validated_data)
+        instance.defer_generation = True
+        with transaction.atomic(using=shards.author_db(instance.author_id)):
+            instance.save()
+            job = models.QuizJob.objects.create(quiz=instance)
+            jobs.submit_quiz_job(job)
+        return job
+
+
+class QuizJobView(mixins.RetrieveModelMixin,
+                  viewsets.GenericViewSet):
+    serializer_class = serializers.QuizJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return models.QuizJob.objects.for_author(self.request.user.id).filter(quiz__author=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        jobs.expire_stale_jobs(self.get_queryset().filter(pk=kwargs['pk']))
+        return super(QuizJobView, self).retrieve(request, *args, **kwargs)
+
 
 class CheckQuizView(UpdateAPIView):
     serializer_class = serializers.QuizSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def update(self, request, *args, **kwargs):
-        quiz_id = self.request.data.get('quiz_id', None)
-        if quiz_id is not None:
-            quiz = models.Quiz.objects.filter(id=quiz_id).first()
-            raport = models.Quiz.check_quiz(quiz, request.data.dict())
+        if self.request.data.get('answer_key', None) is not None:
+            serializer = serializers.AnswerKeySubmissionSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            raport = answer_keys.check_quiz_with_answer_key(request.user, serializer.validated_data['answer_key'],
+                                                            serializer.validated_data['answers'])
+            if raport.get("error") is not None:
+                return Response(raport, status=status.HTTP_400_BAD_REQUEST)
+            return Response(raport, status=status.HTTP_200_OK)
+        if self.request.data.get('quiz_id', None) is not None:
+            serializer = serializers.QuizSubmissionSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            quizzes = models.Quiz.objects.for_author(request.user.id).filter(author=request.user)
+            quiz = quizzes.filter(id=serializer.validated_data['quiz_id']).first()
+            if quiz is None:
+                return Response({"error": "Quiz nie istnieje."}, status=status.HTTP_404_NOT_FOUND)
+            raport = quiz.check_quiz(serializer.validated_data['answers'])
             if raport.get("error") is not None:
                 return Response(raport, status=status.HTTP_400_BAD_REQUEST)
             return Response(raport, status=status.HTTP_200_OK)
         return Response({"error": "Quiz nie został sprawdzony poprawnie."}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class CheckQuizBatchView(GenericAPIView):
+    serializer_class = serializers.QuizBatchSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = models.Quiz.check_quizzes(request.user, serializer.validated_data['quizzes'])
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class ReviewDueView(GenericAPIView):
+    serializer_class = serializers.ReviewStateSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(self.request.query_params.get('limit', 50)), 100)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response({"error": "Nieprawidłowy limit."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(models.ReviewState.due(request.user, limit), many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class ReviewAnswersView(GenericAPIView):
+    serializer_class = serializers.ReviewAnswersSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = models.ReviewState.answer_reviews(request.user, serializer.validated_data['answers'])
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class ActivityView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            days = min(int(self.request.query_params.get('days', 30)), 366)
+        except ValueError:
+            return Response({"error": "Nieprawidłowa liczba dni."}, status=status.HTTP_400_BAD_REQUEST)
+        since = timezone.localdate() - timedelta(days=days)
+        activity = models.DailyActivity.objects.filter(user=request.user, day__gt=since).order_by('day', 'action')
+        return Response(list(activity.values('day', 'action', 'count')), status=status.HTTP_200_OK)
+
+
+class SearchView(GenericAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        text = self.request.query_params.get('q', '')
+        try:
+            limit = int(self.request.query_params.get('limit', 20))
+        except ValueError:
+            limit = 0
+        # LIMIT -1 w SQLite oznacza brak limitu
+        if not 1 <= limit <= 100:
+            return Response({"error": "Nieprawidłowy limit."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(search.search(text, request.user, limit), status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(metrics.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,9 +88,17 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.IsAuthenticated",
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
     ],
 }
+
+# API pagination
+# Flashcard, set and rating listings return API_PAGE_SIZE items per cursor page; clients may ask
+# for up to API_MAX_PAGE_SIZE with ?page_size=
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 100
+
 SESSION_LOGIN = False
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -99,6 +109,38 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
+
+# Read replicas
+# List and retrieve requests for sets, flashcards, categories and ratings read from a random alias
+# in DATABASE_REPLICAS; everything else, and every request of a user for REPLICA_STICKY_SECONDS
+# after one of their requests wrote, uses 'default'. For local SQLite replicas add e.g.
+#   DATABASES['replica1'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db-replica1.sqlite3',
+#                            'TEST': {'MIRROR': 'default'}}
+#   DATABASE_REPLICAS = ['replica1']
+#   CACHES['replica_pins'] = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#                             'LOCATION': BASE_DIR / 'cache' / 'replica-pins'}
+# and refresh the copies with `manage.py sync_replicas`. Pins are kept in the "replica_pins" cache,
+# which must be shared by all server processes; the system check api.E001 rejects a LocMemCache.
+
+DATABASE_REPLICAS = []
+REPLICA_STICKY_SECONDS = 5
+
+# Flashcard shards
+# When FLASHCARD_SHARDS lists database aliases, the sets, flashcards, review states and quizzes of
+# an author live on FLASHCARD_SHARDS[author_id % len(FLASHCARD_SHARDS)]; users, categories, tags,
+# ratings and logs stay in 'default', which may itself be one of the shards. Every shard hands out
+# ids from its own range, queries without an author are run on all shards and merged, and read
+# replicas are not used for sharded models. Run `manage.py migrate --database=<alias>` for each
+# shard and `manage.py rebalance_shards` after changing the list.
+# Foreign keys pointing across databases (authors, tags, categories, rated sets) keep their
+# constraints unless FLASHCARD_SHARDS is set while migration api.0025 runs; when enabling shards on
+# an existing database, re-run it with `manage.py migrate api 0024 --database=<alias>` followed by
+# `manage.py migrate --database=<alias>` for 'default' and every shard.
+
+FLASHCARD_SHARDS = []
+
+DATABASE_ROUTERS = ['api.shards.ShardRouter', 'api.replicas.ReplicaRouter']
+
 ACCOUNT_USERNAME_REQUIRED = True
 ACCOUNT_AUTHENTICATION_METHOD = "username"
 ACCOUNT_EMAIL_REQUIRED = False
@@ -148,3 +190,49 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Quiz generation jobs
+# Number of local worker threads used by ?async=True quiz generation; pending or running jobs
+# without progress for QUIZ_JOB_TIMEOUT seconds are marked failed, e.g. after a worker restart
+
+QUIZ_JOB_WORKERS = 2
+QUIZ_JOB_TIMEOUT = 600
+
+# Token authentication cache
+# Per-process LRU of token -> user lookups; entries expire after TOKEN_CACHE_TTL seconds
+
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE_TTL = 60
+
+# Audit log buffer
+# Log events are written in bulk after a request once LOG_BUFFER_SIZE events are pending
+# or the oldest one is LOG_FLUSH_INTERVAL seconds old; with LOG_FLUSH_TIMER a background thread
+# also checks every LOG_FLUSH_INTERVAL seconds, so idle processes write them too. The rest is flushed at exit.
+# `manage.py compact_logs` (run daily) rolls them up into DailyActivity and deletes
+# events older than LOG_RETENTION_DAYS
+
+LOG_BUFFER_SIZE = 500
+LOG_FLUSH_INTERVAL = 5
+LOG_FLUSH_TIMER = True
+LOG_RETENTION_DAYS = 90
+
+# Caches
+# "catalogue" holds public set catalogue responses, invalidated per author and category on set changes.
+# "replica_pins" remembers which users recently wrote and must read from the primary database.
+# Use a shared backend (e.g. FileBasedCache) for both when running more than one server process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogue': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogue',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'replica_pins': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'replica-pins',
+    },
+}